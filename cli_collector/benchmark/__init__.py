@@ -0,0 +1,18 @@
+#!/usr/bin/env python -tt
+"""
+Benchmark harness for the CLI collector.
+
+Simulated Cisco-style devices on local TCP ports, a jumpserver forwarding to them and a runner
+measuring devices/min and bytes/s of the collector at different concurrency levels:
+
+    python benchmark/run_benchmark.py --devices 100 --concurrency 1,8,32
+"""
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
@@ -0,0 +1,77 @@
+#!/usr/bin/env python -tt
+"""
+TCP client used as SSH or Telnet command in benchmark runs, relays the terminal to a fake device.
+
+    python client.py HOST PORT
+"""
+
+import os
+import select
+import socket
+import sys
+import termios
+import tty
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+def relay(host, port):
+    """
+    Relay stdin to the device and device output to stdout until either side closes.
+
+    The terminal is set to raw mode like an SSH client does, echo is done by the device.
+
+    Args:
+        host (basestring): Device address
+        port (int): Device port
+    """
+
+    connection = socket.create_connection((host, port))
+    stdin = sys.stdin.fileno()
+    stdout = sys.stdout.fileno()
+
+    settings = None
+    if os.isatty(stdin):
+        settings = termios.tcgetattr(stdin)
+        tty.setraw(stdin)
+
+    try:
+        while True:
+            readable = select.select([connection, stdin], [], [])[0]
+            if connection in readable:
+                data = connection.recv(65536)
+                if not data:
+                    break
+                while data:
+                    data = data[os.write(stdout, data):]
+            if stdin in readable:
+                data = os.read(stdin, 65536)
+                if not data:
+                    break
+                connection.sendall(data)
+    finally:
+        connection.close()
+        if settings:
+            termios.tcsetattr(stdin, termios.TCSADRAIN, settings)
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage: {} HOST PORT\n".format(sys.argv[0]))
+        sys.exit(2)
+    try:
+        relay(sys.argv[1], int(sys.argv[2]))
+    except socket.error as e:
+        sys.stderr.write("Unable to connect to {}:{} ({})\n".format(sys.argv[1], sys.argv[2], e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
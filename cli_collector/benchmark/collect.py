@@ -0,0 +1,32 @@
+#!/usr/bin/env python -tt
+"""
+Collector entry point for benchmark runs. Same arguments as cli_collector_tunnel.py, passwords are
+answered with BENCHMARK_PASSWORD (Default: benchmark) instead of a prompt.
+"""
+
+import getpass
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli_collector_tunnel
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+def benchmark_password(prompt='Password: ', stream=None):
+    return os.environ.get('BENCHMARK_PASSWORD', 'benchmark')
+
+
+if __name__ == '__main__':
+    getpass.getpass = benchmark_password
+    sys.argv[0] = cli_collector_tunnel.__file__
+    cli_collector_tunnel.main()
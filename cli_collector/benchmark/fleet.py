@@ -0,0 +1,381 @@
+#!/usr/bin/env python -tt
+"""
+Fleet of simulated Cisco-style devices on local TCP ports.
+
+A FakeDevice emulates the login the collector expects (Username/Password for Telnet, Password for SSH),
+a NAME# prompt, paging with --More-- until 'terminal length 0' and command output of a configured size
+after a configured latency. Other devices (see replay.py) implement the same Device interface. All
+devices are served by a single poll loop, responses of a session are sent in order.
+"""
+
+import errno
+import heapq
+import itertools
+import logging
+import select
+import socket
+import time
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+# Session states
+USERNAME = 'username'
+PASSWORD = 'password'
+EXEC = 'exec'
+MORE = 'more'
+
+PAGE_LINES = 24  # Lines per page until 'terminal length 0'
+MORE_PROMPT = ' --More-- '
+
+INTERFACE = ("GigabitEthernet{slot}/{port} is up, line protocol is up\r\n"
+             "  Hardware is iGbE, address is 5254.{slot:04x}.{port:04x} (bia 5254.{slot:04x}.{port:04x})\r\n"
+             "  Internet address is 10.{slot}.{port}.1/24\r\n"
+             "  MTU 1500 bytes, BW 1000000 Kbit/sec, DLY 10 usec,\r\n"
+             "     reliability 255/255, txload 1/255, rxload 1/255\r\n"
+             "  5 minute input rate 2000 bits/sec, 3 packets/sec\r\n"
+             "     {port} packets input, {slot} bytes, 0 no buffer\r\n"
+             "     {port} input errors, 0 CRC, 0 frame, 0 overrun, 0 ignored\r\n"
+             "     {slot} packets output, {port} bytes, 0 underruns\r\n"
+             "     {slot} output errors, 0 collisions, 1 interface resets\r\n")
+
+# NX-OS style, the admin state line after the header has no indent.
+NXOS_INTERFACE = ("Ethernet{slot}/{port} is up\r\n"
+                  "admin state is up, Dedicated Interface\r\n"
+                  "  Hardware: 1000/10000 Ethernet, address: 5254.{slot:04x}.{port:04x} "
+                  "(bia 5254.{slot:04x}.{port:04x})\r\n"
+                  "  Internet Address is 10.{slot}.{port}.1/24\r\n"
+                  "  MTU 9216 bytes, BW 10000000 Kbit, DLY 10 usec\r\n"
+                  "  RX\r\n"
+                  "    {port} input packets  {slot} bytes\r\n"
+                  "    0 runts  0 giants  0 CRC  0 no buffer\r\n"
+                  "    {port} input error  0 short frame  0 overrun   0 underrun  0 ignored\r\n"
+                  "  TX\r\n"
+                  "    {slot} output packets  {port} bytes\r\n"
+                  "    {slot} output error  0 collision  0 deferred  0 late collision\r\n")
+
+
+def make_output(size):
+    """
+    Interface style command output of at least size bytes, IOS and NX-OS interfaces alternate.
+
+    Args:
+        size (int): Output size in bytes
+
+    Returns:
+        list: Output lines (without line endings)
+    """
+
+    lines = []
+    length = 0
+    for index in itertools.count():
+        if length >= size:
+            break
+        template = NXOS_INTERFACE if index % 2 else INTERFACE
+        for line in template.format(slot=index // 48, port=index % 48).split('\r\n')[:-1]:
+            lines.append(line)
+            length += len(line) + 2
+    return lines
+
+
+class Device(object):
+    """
+    Listening socket of a simulated device. Subclasses return responses as lists of (delay, data)
+    actions, data None closes the session.
+    """
+
+    def __init__(self, name, protocol='SSH', address='127.0.0.1'):
+        """
+        Constructor
+
+        Args:
+            name (basestring): Hostname of the device
+            protocol (basestring): SSH or TELNET (PROTOCOL in the device list)
+            address (basestring): Listening address, the port is assigned by the system
+        """
+
+        self.name = name
+        self.protocol = protocol
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((address, 0))
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.address, self.port = self.listener.getsockname()
+
+    def __str__(self):
+        return '{},{},{},,,{}'.format(self.name, self.address, self.protocol, self.port)
+
+    def connect(self, session):
+        """
+        Actions for a new session (greeting).
+        """
+
+        return []
+
+    def receive(self, session, data):
+        """
+        Actions for data received, handled per line.
+        """
+
+        actions = []
+        session.input += data
+        while not session.closed:
+            ends = [index for index in (session.input.find('\r'), session.input.find('\n')) if index >= 0]
+            if not ends:
+                break
+            line = session.input[:min(ends)]
+            session.input = session.input[min(ends) + 1:].lstrip('\r\n')
+            actions.extend(self.line(session, line.strip()))
+        return actions
+
+    def line(self, session, line):
+        """
+        Actions for a line received.
+        """
+
+        raise NotImplementedError
+
+
+class FakeDevice(Device):
+    """
+    Simulated device with generated interface output.
+    """
+
+    def __init__(self, name, protocol='SSH', address='127.0.0.1', output_size=20000, latency=0.05,
+                 login_latency=0.0):
+        """
+        Constructor
+
+        Args:
+            name (basestring): Hostname shown in the prompt (word characters only)
+            protocol (basestring): SSH (password only) or TELNET (username and password)
+            address (basestring): Listening address, the port is assigned by the system
+            output_size (int): Bytes of output per command
+            latency (float): Seconds before command output
+            login_latency (float): Seconds before the prompt after the password
+        """
+
+        super(FakeDevice, self).__init__(name, protocol=protocol, address=address)
+        self.output_size = output_size
+        self.latency = latency
+        self.login_latency = login_latency
+        self.lines = make_output(output_size)
+
+    def connect(self, session):
+        session.paging = True
+        session.pages = []  # Remaining output lines while paging
+        if self.protocol == 'TELNET':
+            session.state = USERNAME
+            return [(0, '\r\nUser Access Verification\r\n\r\nUsername: ')]
+        session.state = PASSWORD
+        return [(0, 'Password: ')]
+
+    def receive(self, session, data):
+        if session.state == MORE:
+            return self.more(session, data)
+        return super(FakeDevice, self).receive(session, data)
+
+    def line(self, session, line):
+        if session.state == MORE:
+            # Typed ahead while paging, the key continues the output.
+            return self.more(session, line or ' ')
+        if session.state == USERNAME:
+            session.state = PASSWORD
+            return [(0, '{}\r\nPassword: '.format(line))]
+        if session.state == PASSWORD:
+            session.state = EXEC
+            return [(self.login_latency, '\r\n{}#'.format(self.name))]
+        if line in ('exit', 'quit', 'logout'):
+            return [(0, '{}\r\n'.format(line)), (0, None)]
+        if not line:
+            return [(0, '\r\n{}#'.format(self.name))]
+        if line.startswith('terminal length'):
+            session.paging = line.split()[-1] != '0'
+            return [(0, '{}\r\n{}#'.format(line, self.name))]
+
+        if session.paging and len(self.lines) > PAGE_LINES:
+            session.state = MORE
+            session.pages = self.lines[PAGE_LINES:]
+            return [(0, '{}\r\n'.format(line)),
+                    (self.latency, '\r\n'.join(self.lines[:PAGE_LINES]) + '\r\n' + MORE_PROMPT)]
+        return [(0, '{}\r\n'.format(line)),
+                (self.latency, '\r\n'.join(self.lines) + '\r\n{}#'.format(self.name))]
+
+    def more(self, session, data):
+        # Space (or any key) for the next page, q to stop.
+        erase = '\b' * len(MORE_PROMPT)
+        if data[0] in 'qQ':
+            session.pages = []
+        page, session.pages = session.pages[:PAGE_LINES], session.pages[PAGE_LINES:]
+        if session.pages:
+            return [(0, erase + '\r\n'.join(page) + '\r\n' + MORE_PROMPT)]
+        session.state = EXEC
+        return [(0, erase + '\r\n'.join(page) + '\r\n{}#'.format(self.name))]
+
+
+def fake_devices(count, prefix='BENCH', **settings):
+    """
+    Numbered fake devices.
+
+    Args:
+        count (int): Number of devices
+        prefix (basestring): Hostname prefix, followed by the device number
+        settings: FakeDevice settings (protocol, address, output_size, latency, login_latency)
+
+    Returns:
+        lst: FakeDevice instances
+    """
+
+    return [FakeDevice('{}{:04d}'.format(prefix, number), **settings) for number in range(1, count + 1)]
+
+
+class Session(object):
+    """
+    Connection to a device.
+    """
+
+    def __init__(self, device, connection):
+        self.device = device
+        self.connection = connection
+        self.state = None
+        self.input = ''
+        self.output = ''
+        self.ready = 0  # Time the last scheduled response is sent, responses stay in order
+        self.closed = False
+
+
+class Fleet(object):
+    """
+    Simulated devices served by one poll loop.
+    """
+
+    def __init__(self, devices):
+        """
+        Constructor, devices listen after construction and are served by serve_forever.
+
+        Args:
+            devices (lst): Device instances
+        """
+
+        self.devices = devices
+        self.listeners = dict((device.listener.fileno(), device) for device in self.devices)
+        self.sessions = {}  # File descriptor -> Session
+        self.timers = []  # Heap of (due, sequence, session, data)
+        self.sequence = itertools.count()
+        self.poller = select.poll()
+
+    def write_device_list(self, filename):
+        """
+        Write a device list file (NAME,IP,PROTOCOL,SITE,ROLE,PORT) for the collector.
+        """
+
+        with open(filename, 'w') as device_file:
+            for device in self.devices:
+                device_file.write('{}\n'.format(device))
+
+    def serve_forever(self):
+        """
+        Serve all devices until the process ends.
+        """
+
+        for fd in self.listeners:
+            self.poller.register(fd, select.POLLIN)
+        logging.info("Fleet of {} devices listening!".format(len(self.devices)))
+
+        while True:
+            timeout = None
+            if self.timers:
+                timeout = max(0, int((self.timers[0][0] - time.time()) * 1000))
+
+            for fd, event in self.poller.poll(timeout):
+                if fd in self.listeners:
+                    self._accept(self.listeners[fd])
+                elif fd in self.sessions:
+                    session = self.sessions[fd]
+                    if event & select.POLLOUT:
+                        self._flush(session)
+                    if event & (select.POLLIN | select.POLLHUP | select.POLLERR) and not session.closed:
+                        self._read(session)
+
+            now = time.time()
+            while self.timers and self.timers[0][0] <= now:
+                _, _, session, data = heapq.heappop(self.timers)
+                self._send(session, data)
+
+    def _accept(self, device):
+        while True:
+            try:
+                connection, _ = device.listener.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            connection.setblocking(False)
+            session = Session(device, connection)
+            self.sessions[connection.fileno()] = session
+            self.poller.register(connection.fileno(), select.POLLIN)
+            self._schedule(session, device.connect(session))
+
+    def _read(self, session):
+        try:
+            data = session.connection.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._close(session)
+            return
+        self._schedule(session, session.device.receive(session, data))
+
+    def _schedule(self, session, actions):
+        # Each action is sent its delay after the previous response of the session.
+        for delay, data in actions:
+            now = time.time()
+            due = max(now, session.ready) + delay
+            session.ready = due
+            if due <= now:
+                self._send(session, data)
+            else:
+                heapq.heappush(self.timers, (due, next(self.sequence), session, data))
+
+    def _send(self, session, data):
+        if session.closed:
+            return
+        if data is None:
+            self._close(session)
+            return
+        session.output += data
+        self._flush(session)
+
+    def _flush(self, session):
+        if session.closed:
+            return
+        try:
+            sent = session.connection.send(session.output)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                sent = 0
+            else:
+                self._close(session)
+                return
+        session.output = session.output[sent:]
+        self.poller.modify(session.connection.fileno(),
+                           select.POLLIN | select.POLLOUT if session.output else select.POLLIN)
+
+    def _close(self, session):
+        if session.closed:
+            return
+        session.closed = True
+        fd = session.connection.fileno()
+        self.poller.unregister(fd)
+        del self.sessions[fd]
+        session.connection.close()
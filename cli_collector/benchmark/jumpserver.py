@@ -0,0 +1,262 @@
+#!/usr/bin/env python -tt
+"""
+Jumpservers for benchmark runs, SSH servers forwarding TCP (direct-tcpip) channels to the fleet.
+
+A JumpChain starts jumpservers on consecutive loopback addresses (127.0.0.1, 127.0.0.2, ...) as the
+path of a JumpCollection, with an optional latency on every hop. Addresses other than 127.0.0.1 are
+available on Linux, other systems need loopback aliases for chains of more than one hop.
+"""
+
+import logging
+import Queue
+import select
+import socket
+import threading
+import time
+
+import paramiko
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+class ForwardingServer(paramiko.ServerInterface):
+    """
+    SSH server accepting any user and key, allowing port forwarding only.
+    """
+
+    def __init__(self):
+        self.destinations = {}  # Channel ID -> (address, port)
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'direct-tcpip':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+
+def delay(source, target, latency):
+    """
+    Copy data from source to target socket, each chunk delivered latency seconds after it was received.
+
+    Args:
+        source (object): Socket to read from
+        target (object): Socket to write to
+        latency (float): One way delay in seconds
+    """
+
+    pending = Queue.Queue()
+
+    def deliver():
+        while True:
+            due, data = pending.get()
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                if not data:
+                    target.shutdown(socket.SHUT_WR)
+                    break
+                target.sendall(data)
+            except socket.error:
+                break
+
+    thread = threading.Thread(target=deliver)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        try:
+            data = source.recv(65536)
+        except socket.error:
+            data = ''
+        pending.put((time.time() + latency, data))
+        if not data:
+            break
+
+
+class JumpServer(object):
+    """
+    Jumpserver listening on a local address, each SSH connection and channel handled by a thread.
+    """
+
+    def __init__(self, address='127.0.0.1', port=0, host_key=None, latency=0.0):
+        """
+        Constructor
+
+        Args:
+            address (basestring): Listening address
+            port (int): Listening port (Default: assigned by the system)
+            host_key (object): paramiko private key (Default: generated)
+            latency (float): One way delay in seconds added to the SSH connections of clients
+        """
+
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.latency = latency
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((address, port))
+        self.listener.listen(128)
+        self.address, self.port = self.listener.getsockname()
+        self.running = False
+
+    def start(self):
+        """
+        Accept connections in a background thread.
+        """
+
+        self.running = True
+        thread = threading.Thread(target=self._accept, name='JumpServer-{}'.format(self.address))
+        thread.daemon = True
+        thread.start()
+        logging.info("Jumpserver listening on {}:{}!".format(self.address, self.port))
+
+    def stop(self):
+        self.running = False
+        self.listener.close()
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, _ = self.listener.accept()
+            except socket.error:
+                break
+            thread = threading.Thread(target=self._serve, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client):
+        if self.latency > 0:
+            # SSH runs over a socket pair, the client side of it is relayed with a delay each way.
+            remote = client
+            client, peer = socket.socketpair()
+            for source, target in ((remote, peer), (peer, remote)):
+                thread = threading.Thread(target=delay, args=(source, target, self.latency))
+                thread.daemon = True
+                thread.start()
+
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = ForwardingServer()
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            logging.debug("Jumpserver handshake failed! ({})".format(e))
+            return
+
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            thread = threading.Thread(target=self._forward,
+                                      args=(channel, server.destinations.pop(channel.get_id())))
+            thread.daemon = True
+            thread.start()
+
+    def _forward(self, channel, destination):
+        try:
+            connection = socket.create_connection(destination, timeout=10)
+        except socket.error as e:
+            logging.debug("Jumpserver cannot reach {}:{}! ({})".format(destination[0], destination[1], e))
+            channel.close()
+            return
+
+        try:
+            while True:
+                readable = select.select([connection, channel], [], [])[0]
+                if connection in readable:
+                    data = connection.recv(65536)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                if channel in readable:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    connection.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+            channel.close()
+
+
+class JumpChain(object):
+    """
+    Jumpservers on consecutive loopback addresses, the path of a JumpCollection.
+    """
+
+    def __init__(self, hops=1, latency=0.0, username='benchmark'):
+        """
+        Constructor, jumpservers listen after construction and accept connections after start.
+
+        Args:
+            hops (int): Number of jumpservers (127.0.0.1 up to 127.0.0.<hops>)
+            latency (float): One way delay in seconds on every hop
+            username (basestring): Username in the jumpserver settings
+        """
+
+        host_key = paramiko.RSAKey.generate(2048)
+        self.jumpservers = [JumpServer(address='127.0.0.{}'.format(index + 1), host_key=host_key, latency=latency)
+                            for index in range(hops)]
+        self.username = username
+
+    def start(self):
+        for jumpserver in self.jumpservers:
+            jumpserver.start()
+
+    def stop(self):
+        for jumpserver in self.jumpservers:
+            jumpserver.stop()
+
+    def serve_forever(self):
+        """
+        Accept connections until the process ends (for a separate process).
+        """
+
+        self.start()
+        while True:
+            time.sleep(3600)
+
+    def path(self):
+        """
+        Returns:
+            lst: Jumpserver addresses in path order
+        """
+
+        return [jumpserver.address for jumpserver in self.jumpservers]
+
+    def settings(self, key_file):
+        """
+        Jumpserver settings for JumpCollection or the JUMPSERVERS section of a settings file.
+
+        Args:
+            key_file (basestring): Private key file of the client (any key is accepted)
+
+        Returns:
+            dict: Settings per jumpserver address
+        """
+
+        return dict((jumpserver.address, {'CONNECTION_TYPE': 'SSH_TUNNEL',
+                                          'USERNAME': self.username,
+                                          'RSA_KEY_FILE': key_file,
+                                          'PORT': jumpserver.port})
+                    for jumpserver in self.jumpservers)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python -tt
+"""
+Devices replaying session transcripts recorded by the collector (--transcripts).
+
+A ReplayDevice answers the login steps of its transcript in order (greeting, username and password prompts,
+device prompt) and each recorded command with its recorded output. Pipelined commands are split on the
+device prompt. Delays are the recorded delays divided by the replay speed, speed 0 replays without delays.
+Unknown commands are answered with the Cisco invalid input error.
+"""
+
+import glob
+import logging
+import os
+import sys
+
+import fleet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import TranscriptManager
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+# Session states
+LOGIN = 'login'
+EXEC = 'exec'
+
+# Prompt indexes of the collector login prompts (Username, Password, NAME#, NAME>)
+USERNAME_PROMPT = 0
+DEVICE_PROMPTS = (2, 3)
+
+INVALID = "{}\r\n% Invalid input detected at '^' marker.\r\n\r\n{}"
+
+
+def time_at(chunks, offset):
+    """
+    Time the byte at offset of the joined chunks was received.
+
+    Args:
+        chunks (lst): Received (time, data) chunks
+        offset (int): Offset in the joined data
+
+    Returns:
+        float: Time of the chunk holding offset (last chunk if beyond)
+    """
+
+    end = 0
+    for seconds, data in chunks:
+        end += len(data)
+        if end >= offset:
+            return seconds
+    return chunks[-1][0]
+
+
+class ReplayDevice(fleet.Device):
+    """
+    Device replaying the transcript of one session.
+    """
+
+    def __init__(self, name, events, speed=0.0, address='127.0.0.1'):
+        """
+        Constructor
+
+        Args:
+            name (basestring): Name of the device in the device list
+            events (lst): Transcript events (see TranscriptManager.read_transcript)
+            speed (float): Replay speed, 1 for the recorded delays, 0 without delays
+            address (basestring): Listening address, the port is assigned by the system
+
+        Raises:
+            ValueError: Transcript without a successful login
+        """
+
+        self.speed = speed
+        self.greeting = []  # Received (time, data) before anything was sent
+        self.exchanges = []  # (time, data sent, received (time, data) chunks)
+        self.commands = []  # Recorded commands in order
+        self.prompt = None
+        protocol = 'SSH'
+        login_steps = None
+
+        for event in events:
+            seconds, kind = event[0], event[1]
+            if kind == TranscriptManager.OUT:
+                self.exchanges.append((seconds, event[2], []))
+            elif kind == TranscriptManager.IN:
+                (self.exchanges[-1][2] if self.exchanges else self.greeting).append((seconds, event[2]))
+            elif kind == TranscriptManager.MATCH and self.prompt is None:
+                if event[2] == USERNAME_PROMPT and not self.exchanges:
+                    protocol = 'TELNET'
+                elif event[2] in DEVICE_PROMPTS:
+                    self.prompt = event[3].strip()
+                    login_steps = len(self.exchanges)
+            elif kind == TranscriptManager.COMMAND and event[2] not in self.commands:
+                self.commands.append(event[2])
+
+        if self.prompt is None:
+            raise ValueError("no successful login")
+
+        super(ReplayDevice, self).__init__(name, protocol=protocol, address=address)
+
+        self.login = [self._chunks(sent_at, received) for sent_at, _, received in self.exchanges[:login_steps]]
+        self.responses = {}  # Command -> list of (delay, data), used in turn
+        for sent_at, sent, received in self.exchanges[login_steps:]:
+            self._split(sent_at, sent, received)
+
+    def _delay(self, seconds):
+        if self.speed > 0:
+            return max(0.0, seconds / self.speed)
+        return 0
+
+    def _chunks(self, started, received):
+        actions = []
+        for seconds, data in received:
+            actions.append((self._delay(seconds - started), data))
+            started = seconds
+        return actions
+
+    def _split(self, sent_at, sent, received):
+        # Output of pipelined commands ends on the prompt, in order of the lines sent.
+        if not received:
+            return
+        text = ''.join(data for _, data in received)
+        start = 0
+        previous = sent_at
+        for line in sent.splitlines():
+            end = text.find(self.prompt, start)
+            if end < 0:
+                break
+            end += len(self.prompt)
+            seconds = time_at(received, end)
+            self.responses.setdefault(line.strip(), []).append((self._delay(seconds - previous), text[start:end]))
+            start, previous = end, seconds
+
+    def connect(self, session):
+        session.state = LOGIN if self.login else EXEC
+        session.step = 0
+        session.counts = {}  # Command -> times answered, recorded responses are used in turn
+        return self._chunks(0, self.greeting)
+
+    def line(self, session, line):
+        if session.state == LOGIN:
+            # Login steps are answered in order, whatever is sent.
+            actions = self.login[session.step]
+            session.step += 1
+            if session.step == len(self.login):
+                session.state = EXEC
+            return actions
+        if line in ('exit', 'quit', 'logout'):
+            return [(0, '{}\r\n'.format(line)), (0, None)]
+
+        responses = self.responses.get(line)
+        if responses:
+            count = session.counts.get(line, 0)
+            session.counts[line] = count + 1
+            return [responses[count % len(responses)]]
+        if not line:
+            return [(0, '\r\n{}'.format(self.prompt))]
+        return [(0, INVALID.format(line, self.prompt))]
+
+
+def replay_devices(directory, speed=0.0, address='127.0.0.1'):
+    """
+    Replay devices for all transcripts in a directory, named after the transcript file.
+
+    Args:
+        directory (basestring): Transcript directory (collector --transcripts)
+        speed (float): Replay speed, 1 for the recorded delays, 0 without delays
+        address (basestring): Listening address
+
+    Returns:
+        lst: ReplayDevice instances (transcripts without a successful login are skipped)
+    """
+
+    devices = []
+    for filename in sorted(glob.glob(os.path.join(directory, '*.jsonl.gz'))):
+        _, events = TranscriptManager.read_transcript(filename)
+        name = os.path.basename(filename)[:-len('.jsonl.gz')]
+        try:
+            devices.append(ReplayDevice(name, events, speed=speed, address=address))
+        except ValueError as e:
+            logging.warning("Skipping transcript {} ({})!".format(filename, e))
+    return devices
+
+
+def recorded_commands(devices):
+    """
+    Commands recorded by the devices in order, without the terminal length set by the collector.
+
+    Args:
+        devices (lst): ReplayDevice instances
+
+    Returns:
+        lst: Commands
+    """
+
+    commands = []
+    for device in devices:
+        for command in device.commands:
+            if command not in commands and not command.startswith('terminal length'):
+                commands.append(command)
+    return commands
@@ -0,0 +1,263 @@
+#!/usr/bin/env python -tt
+"""
+Collector throughput benchmark against a simulated device fleet.
+
+Starts a fleet of fake devices (or devices replaying session transcripts, see replay.py) and a chain of
+local jumpservers, runs the collector (cli_collector_tunnel.py) once per concurrency level and reports
+devices/min and bytes/s. Device and byte counts are taken from the collector metrics (--metrics).
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import pipes
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import paramiko
+
+import fleet
+import jumpserver
+import replay
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_settings(filename, chain, key_file, timeout):
+    """
+    Write a collector settings file using the benchmark jumpservers and client.
+    """
+
+    command = '{} {} HOST PORT'.format(pipes.quote(sys.executable),
+                                       pipes.quote(os.path.join(BENCHMARK_DIR, 'client.py')))
+    settings = {
+        'SETTINGS': {
+            'PATH': chain.path(),
+            'SSH_COMMAND': command,
+            'TELNET_COMMAND': command,
+            'TIMEOUT': timeout
+        },
+        'JUMPSERVERS': chain.settings(key_file)
+    }
+    with open(filename, 'w') as settings_file:
+        json.dump(settings, settings_file, indent=2)
+
+
+class BenchmarkClient(object):
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.build_parser()
+        self.args = self.parser.parse_args()
+
+    def build_parser(self):
+        """
+        Build the argparse parser based on the arguments given to the constructor
+        """
+
+        self.parser = argparse.ArgumentParser(
+            description='''Collector throughput benchmark against a simulated device fleet.''',
+            epilog='Created by ' + __author__ + ', version ' + __version__ + ' ' + __copyright__)
+        self.parser.add_argument("--log-level", metavar='LEVEL', choices=['debug', 'info', 'error', 'critical'],
+                                 default='info', help="Logging of the benchmark (Default: info)")
+        self.parser.add_argument("--devices", help="Number of simulated devices (Default: 50)",
+                                 type=int, default=50, dest='devices')
+        self.parser.add_argument("--protocol", help="Login of the devices (Default: SSH)",
+                                 choices=['SSH', 'TELNET'], default='SSH', dest='protocol')
+        self.parser.add_argument("--command", help="Command to collect, repeat for more commands "
+                                                   "(Default: show version and show interfaces)",
+                                 type=str, action='append', default=None, dest='commands')
+        self.parser.add_argument("--output-size", help="Bytes of output per command (Default: 20000)",
+                                 type=int, default=20000, dest='output_size')
+        self.parser.add_argument("--latency", help="Seconds before command output (Default: 0.05)",
+                                 type=float, default=0.05, dest='latency')
+        self.parser.add_argument("--login-latency", help="Seconds before the prompt after login (Default: 0.1)",
+                                 type=float, default=0.1, dest='login_latency')
+        self.parser.add_argument("--replay", help="Replay the session transcripts in DIR (collector --transcripts) "
+                                                  "instead of simulated devices, commands default to the recorded "
+                                                  "commands", type=str, default=None, dest='replay', metavar='DIR')
+        self.parser.add_argument("--replay-speed", help="Replay speed, 1 for the recorded timing, 0 for full speed "
+                                                        "(Default: 0)",
+                                 type=float, default=0.0, dest='replay_speed')
+        self.parser.add_argument("--hops", help="Jumpservers in the path, on 127.0.0.1 up to 127.0.0.<hops> "
+                                                "(Default: 1)",
+                                 type=int, default=1, dest='hops')
+        self.parser.add_argument("--hop-latency", help="One way delay in seconds on every hop (Default: 0)",
+                                 type=float, default=0.0, dest='hop_latency')
+        self.parser.add_argument("--concurrency", help="Comma separated collector worker counts (Default: 1,4,16)",
+                                 type=str, default='1,4,16', dest='concurrency')
+        self.parser.add_argument("--engine", help="Collection engine (Default: thread)",
+                                 choices=['event', 'thread'], default='thread', dest='engine')
+        self.parser.add_argument("--timeout", help="Collector timeout in seconds (Default: 20)",
+                                 type=int, default=20, dest='timeout')
+        self.parser.add_argument("--collector-log-level", help="Logging of the collector runs (Default: error)",
+                                 choices=['debug', 'info', 'error', 'critical'], default='error',
+                                 dest='collector_log_level')
+        self.parser.add_argument("--json", help="Write results to JSON file", type=str, default=None,
+                                 dest='output_json')
+        self.parser.add_argument("--keep", help="Keep the working directory (settings, outputs, metrics)",
+                                 default=False, dest='keep', action='store_true')
+        self.parser.add_argument('collector_args', nargs=argparse.REMAINDER, metavar='-- COLLECTOR_ARGS',
+                                 help="Extra collector arguments, e.g. -- --multiplex --pipeline 4")
+
+    def execute(self):
+
+        logging.basicConfig(stream=sys.stderr, level=getattr(logging, self.args.log_level.upper()),
+                            format="[ %(levelname)-8s ][ %(asctime)s,%(msecs)03d ]:  %(message)s",
+                            datefmt="%H:%M:%S")
+        if self.args.log_level != 'debug':
+            logging.getLogger("paramiko").setLevel(logging.WARNING)
+
+        try:
+            levels = [int(level) for level in self.args.concurrency.split(',')]
+        except ValueError:
+            self.parser.error("--concurrency must be comma separated numbers")
+        collector_args = self.args.collector_args
+        if collector_args and collector_args[0] == '--':
+            collector_args = collector_args[1:]
+
+        workdir = tempfile.mkdtemp(prefix='cli_collector_benchmark_')
+        logging.info("Working directory: {}".format(workdir))
+
+        commands = self.args.commands or ['show version', 'show interfaces']
+        if self.args.replay:
+            simulated = replay.replay_devices(self.args.replay, speed=self.args.replay_speed)
+            if not simulated:
+                self.parser.error("No transcripts found in {}".format(self.args.replay))
+            if not self.args.commands:
+                commands = replay.recorded_commands(simulated)
+            # A device per transcript.
+            self.args.devices = len(simulated)
+        else:
+            simulated = fleet.fake_devices(self.args.devices, protocol=self.args.protocol,
+                                           output_size=self.args.output_size, latency=self.args.latency,
+                                           login_latency=self.args.login_latency)
+        devices = fleet.Fleet(simulated)
+        devices.write_device_list(os.path.join(workdir, 'devices.txt'))
+
+        # Fleet in its own process, so the collector is measured and not the fleet.
+        fleet_process = multiprocessing.Process(target=devices.serve_forever, name='Fleet')
+        fleet_process.daemon = True
+        fleet_process.start()
+        for device in devices.devices:
+            device.listener.close()
+
+        chain = jumpserver.JumpChain(self.args.hops, latency=self.args.hop_latency)
+        chain.start()
+
+        key_file = os.path.join(workdir, 'id_rsa')
+        paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+        write_settings(os.path.join(workdir, 'settings.json'), chain, key_file, self.args.timeout)
+
+        with open(os.path.join(workdir, 'commands.txt'), 'w') as command_file:
+            for command in commands:
+                command_file.write('{}\n'.format(command))
+        with open(os.path.join(workdir, 'credentials.cfg'), 'w') as credential_file:
+            credential_file.write('[DEFAULT]\nusername = benchmark\npassword_type =\n')
+
+        results = []
+        try:
+            for level in levels:
+                results.append(self.run(workdir, level, collector_args))
+        finally:
+            fleet_process.terminate()
+            chain.stop()
+            if not self.args.keep:
+                shutil.rmtree(workdir)
+
+        print '{:>8} {:>8} {:>7} {:>9} {:>12} {:>12} {:>11} {:>11}'.format(
+            'WORKERS', 'DEVICES', 'FAILED', 'SECONDS', 'DEVICES/MIN', 'BYTES/S', 'DEVICE P50', 'DEVICE P90')
+        for result in results:
+            print '{WORKERS:>8} {DEVICES:>8} {FAILED:>7} {SECONDS:>9.2f} {DEVICES_PER_MINUTE:>12.1f} ' \
+                  '{BYTES_PER_SECOND:>12.0f} {DEVICE_P50:>11} {DEVICE_P90:>11}'.format(**result)
+
+        if self.args.output_json:
+            with open(self.args.output_json, 'w') as result_file:
+                json.dump({'DEVICES': self.args.devices, 'PROTOCOL': self.args.protocol,
+                           'OUTPUT_SIZE': self.args.output_size, 'LATENCY': self.args.latency,
+                           'REPLAY': self.args.replay, 'REPLAY_SPEED': self.args.replay_speed,
+                           'ENGINE': self.args.engine, 'HOPS': self.args.hops,
+                           'HOP_LATENCY': self.args.hop_latency, 'RESULTS': results}, result_file, indent=2)
+            logging.info("Saved results to {}!".format(self.args.output_json))
+
+    def run(self, workdir, workers, collector_args):
+        """
+        Collect all devices once with a number of workers.
+
+        Args:
+            workdir (basestring): Working directory with settings, commands, credentials and devices
+            workers (int): Collector workers
+            collector_args (lst): Extra collector arguments
+
+        Returns:
+            dict: WORKERS, DEVICES (collected), FAILED, SECONDS, DEVICES_PER_MINUTE, BYTES, BYTES_PER_SECOND,
+            DEVICE_P50 and DEVICE_P90
+        """
+
+        metrics_file = os.path.join(workdir, 'metrics_{}.json'.format(workers))
+        command = [sys.executable, '-W', 'ignore', os.path.join(BENCHMARK_DIR, 'collect.py'),
+                   '--log-level', self.args.collector_log_level,
+                   '--workers', str(workers),
+                   '--engine', self.args.engine,
+                   '--metrics', metrics_file,
+                   '--json_output', os.path.join(workdir, 'output_{}.json'.format(workers))] + collector_args + [
+                   os.path.join(workdir, 'settings.json'),
+                   os.path.join(workdir, 'commands.txt'),
+                   os.path.join(workdir, 'credentials.cfg'),
+                   '--device_list', os.path.join(workdir, 'devices.txt')]
+
+        # Keyring left alone, the benchmark password is answered by collect.py.
+        environment = dict(os.environ, PYTHON_KEYRING_BACKEND='keyring.backends.fail.Keyring')
+
+        logging.info("Collecting {} devices with {} workers...".format(self.args.devices, workers))
+        started = time.time()
+        status = subprocess.call(command, env=environment)
+        seconds = time.time() - started
+        if status:
+            logging.error("Collector ended with status {}!".format(status))
+
+        device = {}
+        collected_bytes = 0
+        if os.path.isfile(metrics_file):
+            with open(metrics_file) as metrics:
+                phases = json.load(metrics)['PHASES']
+            device = phases.get('device', {})
+            collected_bytes = phases.get('command', {}).get('BYTES', 0)
+
+        collected = device.get('COUNT', 0) - device.get('ERRORS', 0)
+        return {
+            'WORKERS': workers,
+            'DEVICES': collected,
+            'FAILED': self.args.devices - collected,
+            'SECONDS': seconds,
+            'DEVICES_PER_MINUTE': collected * 60.0 / seconds,
+            'BYTES': collected_bytes,
+            'BYTES_PER_SECOND': collected_bytes / seconds,
+            'DEVICE_P50': device.get('P50'),
+            'DEVICE_P90': device.get('P90')
+        }
+
+
+def main():
+    cli = BenchmarkClient()
+    cli.execute()
+
+
+if __name__ == '__main__':
+    main()
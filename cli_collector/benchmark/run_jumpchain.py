@@ -0,0 +1,264 @@
+#!/usr/bin/env python -tt
+"""
+Jumpserver chain benchmark of JumpCollection tunnel costs.
+
+Starts chains of local jumpservers with an optional latency per hop and measures, per chain length and
+for tunnel (SSH tunnel per destination) and multiplexed final connections:
+    - Chain setup: connecting the jumpservers before the final one (connect_jumpserver_chain)
+    - Final hop: opening a final connection and receiving the first byte from the destination
+    - Throughput: bytes/s received over one final connection
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+import jumpserver
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import ConnectionManager, MetricsManager
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+BLOCK = '\0' * 65536
+
+
+class TransferServer(object):
+    """
+    Destination behind the chain, sends the number of bytes requested on the first line and closes.
+    """
+
+    def __init__(self, address='127.0.0.1'):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((address, 0))
+        self.listener.listen(128)
+        self.address, self.port = self.listener.getsockname()
+
+    def start(self):
+        thread = threading.Thread(target=self._accept, name='TransferServer')
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            connection, _ = self.listener.accept()
+            thread = threading.Thread(target=self._send, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _send(self, connection):
+        try:
+            request = connection.makefile().readline()
+            remaining = int(request or 0)
+            while remaining > 0:
+                block = BLOCK[:remaining]
+                connection.sendall(block)
+                remaining -= len(block)
+        except (socket.error, ValueError):
+            pass
+        finally:
+            connection.close()
+
+
+def serve_forever(chain, transfer):
+    """
+    Serve the jumpservers and destination until the process ends.
+    """
+
+    transfer.start()
+    chain.serve_forever()
+
+
+def fetch(port, size):
+    """
+    Request size bytes from the destination through a local forwarded port.
+
+    Returns:
+        int: Bytes received
+    """
+
+    connection = socket.create_connection(('127.0.0.1', port), timeout=60)
+    try:
+        connection.sendall('{}\n'.format(size))
+        received = 0
+        while received < size:
+            data = connection.recv(65536)
+            if not data:
+                break
+            received += len(data)
+    finally:
+        connection.close()
+    return received
+
+
+def summary(durations):
+    samples = sorted(durations)
+    return {'P50': round(MetricsManager.percentile(samples, 50), 4),
+            'P90': round(MetricsManager.percentile(samples, 90), 4),
+            'MAX': round(samples[-1], 4)}
+
+
+class JumpChainClient(object):
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.build_parser()
+        self.args = self.parser.parse_args()
+
+    def build_parser(self):
+        """
+        Build the argparse parser based on the arguments given to the constructor
+        """
+
+        self.parser = argparse.ArgumentParser(
+            description='''Jumpserver chain benchmark of JumpCollection tunnel costs.''',
+            epilog='Created by ' + __author__ + ', version ' + __version__ + ' ' + __copyright__)
+        self.parser.add_argument("--log-level", metavar='LEVEL', choices=['debug', 'info', 'error', 'critical'],
+                                 default='info', help="Logging of the benchmark (Default: info)")
+        self.parser.add_argument("--hops", help="Comma separated chain lengths, on 127.0.0.1 up to 127.0.0.<hops> "
+                                                "(Default: 1,2,3)",
+                                 type=str, default='1,2,3', dest='hops')
+        self.parser.add_argument("--hop-latency", help="One way delay in seconds on every hop (Default: 0)",
+                                 type=float, default=0.0, dest='hop_latency')
+        self.parser.add_argument("--repeat", help="Chain setups measured per chain length (Default: 5)",
+                                 type=int, default=5, dest='repeat')
+        self.parser.add_argument("--connections", help="Final connections measured per mode (Default: 20)",
+                                 type=int, default=20, dest='connections')
+        self.parser.add_argument("--transfer-size", help="Bytes received for throughput (Default: 10000000)",
+                                 type=int, default=10000000, dest='transfer_size')
+        self.parser.add_argument("--json", help="Write results to JSON file", type=str, default=None,
+                                 dest='output_json')
+
+    def execute(self):
+
+        logging.basicConfig(stream=sys.stderr, level=getattr(logging, self.args.log_level.upper()),
+                            format="[ %(levelname)-8s ][ %(asctime)s,%(msecs)03d ]:  %(message)s",
+                            datefmt="%H:%M:%S")
+        if self.args.log_level != 'debug':
+            logging.getLogger("paramiko").setLevel(logging.WARNING)
+
+        try:
+            hops = [int(count) for count in self.args.hops.split(',')]
+        except ValueError:
+            self.parser.error("--hops must be comma separated numbers")
+
+        workdir = tempfile.mkdtemp(prefix='cli_collector_jumpchain_')
+        key_file = os.path.join(workdir, 'id_rsa')
+        paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+
+        results = []
+        try:
+            for count in hops:
+                results.extend(self.run(count, key_file))
+        finally:
+            shutil.rmtree(workdir)
+
+        print '{:>5} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+            'HOPS', 'MODE', 'CHAIN P50', 'CHAIN P90', 'FINAL P50', 'FINAL P90', 'BYTES/S')
+        for result in results:
+            print '{:>5} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12.0f}'.format(
+                result['HOPS'], result['MODE'], result['CHAIN']['P50'], result['CHAIN']['P90'],
+                result['FINAL']['P50'], result['FINAL']['P90'], result['BYTES_PER_SECOND'])
+
+        if self.args.output_json:
+            with open(self.args.output_json, 'w') as result_file:
+                json.dump({'HOP_LATENCY': self.args.hop_latency, 'RESULTS': results}, result_file, indent=2)
+            logging.info("Saved results to {}!".format(self.args.output_json))
+
+    def run(self, hops, key_file):
+        """
+        Measure a chain of jumpservers, served by a separate process.
+
+        Args:
+            hops (int): Number of jumpservers
+            key_file (basestring): Client private key file
+
+        Returns:
+            lst: Result per mode (tunnel and multiplex) with HOPS, MODE, CHAIN, FINAL (P50, P90, MAX in
+            seconds) and BYTES_PER_SECOND
+        """
+
+        chain = jumpserver.JumpChain(hops, latency=self.args.hop_latency)
+        transfer = TransferServer()
+        process = multiprocessing.Process(target=serve_forever, args=(chain, transfer), name='JumpChain')
+        process.daemon = True
+        process.start()
+
+        path, settings = chain.path(), chain.settings(key_file)
+        results = []
+        try:
+            for mode in ('tunnel', 'multiplex'):
+                logging.info("Measuring {} hops ({})...".format(hops, mode))
+
+                chain_durations = []
+                for _ in range(self.args.repeat):
+                    started = time.time()
+                    jumps = ConnectionManager.JumpCollection(path, settings, multiplex=mode == 'multiplex')
+                    chain_durations.append(time.time() - started)
+                    jumps.disconnect_jumpserver_chain()
+
+                jumps = ConnectionManager.JumpCollection(path, settings, multiplex=mode == 'multiplex')
+                try:
+                    final_durations = []
+                    for _ in range(self.args.connections):
+                        started = time.time()
+                        connection = jumps.open_final_connection(transfer.address, transfer.port)
+                        try:
+                            fetch(connection.local_port, 1)
+                        finally:
+                            connection.disconnect()
+                        final_durations.append(time.time() - started)
+
+                    connection = jumps.open_final_connection(transfer.address, transfer.port)
+                    try:
+                        started = time.time()
+                        received = fetch(connection.local_port, self.args.transfer_size)
+                        seconds = time.time() - started
+                    finally:
+                        connection.disconnect()
+                finally:
+                    jumps.disconnect_jumpserver_chain()
+
+                results.append({'HOPS': hops,
+                                'MODE': mode,
+                                'CHAIN': summary(chain_durations),
+                                'FINAL': summary(final_durations),
+                                'BYTES': received,
+                                'BYTES_PER_SECOND': received / seconds})
+        finally:
+            process.terminate()
+            for jump in chain.jumpservers:
+                jump.listener.close()
+            transfer.listener.close()
+
+        return results
+
+
+def main():
+    cli = JumpChainClient()
+    cli.execute()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,8 +17,7 @@ import logging
 import os
 import platform
 import sys
-from lib.DatabaseManager import DatbaseManager
-from lib import ConnectionManager, HostManager, accountmgr, utils
+from lib import AGENT_BACKENDS, DATABASE_BACKENDS, load_backend, utils
 
 __author__ = "Thomas Jongerius"
 __copyright__ = "Copyright 2016, Thomas Jongerius"
@@ -62,6 +61,79 @@ class CliClient(object):
                             type=str, default=None, dest='output_json')
         self.parser.add_argument("-c", "--connection", help="Connection Type (Default: SSH)",
                            type=str, default='SSH', dest='connection', choices=['SSH', 'TELNET'])
+        self.parser.add_argument("-w", "--workers", help="Number of devices collected in parallel (Default: 1)",
+                           type=int, default=1, dest='workers')
+        self.parser.add_argument("--engine", help="Collection engine, worker threads or a single event loop "
+                                                  "holding all sessions (Default: thread)",
+                           type=str, default='thread', dest='engine', choices=sorted(AGENT_BACKENDS))
+        self.parser.add_argument("--multiplex", help="Keep one SSH transport to the final jumpserver and open a "
+                                                     "channel per device instead of a new tunnel per device.",
+                           default=False, dest='multiplex', action='store_true')
+        self.parser.add_argument("--journal", help="Journal file recording collected output during the run",
+                           type=str, default=None, dest='journal')
+        self.parser.add_argument("--resume", help="Resume run from journal, skipping completed devices and commands",
+                           default=False, dest='resume', action='store_true')
+        self.parser.add_argument("--stream", help="Stream results of each device to the outputs as soon as the device "
+                                                  "is finished instead of exporting at the end of the run",
+                           default=False, dest='stream', action='store_true')
+        self.parser.add_argument("--jsonl", help="Output JSON Lines file, one host per line (requires --stream)",
+                           type=str, default=None, dest='output_jsonl')
+        self.parser.add_argument("--sink-queue", help="Maximum number of finished devices waiting to be written "
+                                                      "in stream mode (Default: 16)",
+                           type=int, default=16, dest='sink_queue')
+        self.parser.add_argument("--site", help="Only collect devices of this site (SITE column in device list file "
+                                                "or site column in database)",
+                           type=str, default=None, dest='site')
+        self.parser.add_argument("--role", help="Only collect devices with this role (ROLE column in device list file "
+                                                "or role column in database)",
+                           type=str, default=None, dest='role')
+        self.parser.add_argument("--collected-before", help="Only collect devices without output in the database "
+                                                            "since TIMESTAMP (e.g. 2016-01-31T00:00:00)",
+                           type=str, default=None, dest='collected_before', metavar='TIMESTAMP')
+        self.parser.add_argument("--shard", help="Only collect shard i of N (0 <= i < N) of the devices, by device "
+                                                 "identifier, so N collectors split the inventory without overlap",
+                           type=str, default=None, dest='shard', metavar='i/N')
+        self.parser.add_argument("--site-limit", help="Maximum number of devices of one site collected in parallel "
+                                                      "(SITE column in device list file or site column in database, "
+                                                      "Default: no limit)",
+                           type=int, default=None, dest='site_limit')
+        self.parser.add_argument("--prescan", help="Probe the SSH/Telnet port of all devices in parallel before "
+                                                   "collection and skip unreachable devices, via the jump path "
+                                                   "or directly from this host",
+                           type=str, default=None, dest='prescan', choices=['jump', 'direct'])
+        self.parser.add_argument("--prescan-timeout", help="Timeout in seconds per device for --prescan (Default: 5)",
+                           type=int, default=5, dest='prescan_timeout')
+        self.parser.add_argument("--pipeline", help="Number of commands sent to a device in a single write, output "
+                                                    "is split on the device prompt (Default: 1, one by one)",
+                           type=int, default=1, dest='pipeline')
+        self.parser.add_argument("--timing-history", help="File with durations of earlier runs per device and "
+                                                          "command, timeouts are derived from it, parallel runs "
+                                                          "start the longest devices first and it is updated "
+                                                          "after the run",
+                           type=str, default=None, dest='timing_history')
+        self.parser.add_argument("--timeout-margin", help="Multiplier on the 99th percentile of earlier durations "
+                                                          "for derived timeouts (Default: 3.0)",
+                           type=float, default=3.0, dest='timeout_margin')
+        self.parser.add_argument("--metrics", help="JSON file for durations, byte counts and errors per phase, command "
+                                                   "and device with percentiles, written at the end of the run",
+                           type=str, default=None, dest='metrics', metavar='FILE')
+        self.parser.add_argument("--metrics-textfile", help="Prometheus text file with the same metrics per phase and "
+                                                            "command (for the node exporter textfile collector)",
+                           type=str, default=None, dest='metrics_textfile', metavar='FILE')
+        self.parser.add_argument("--profile", help="Profile the run and write a report with hot spots and time in "
+                                                   "expect, regex and JSON to FILE (raw profile in FILE.pstats "
+                                                   "or FILE.folded)",
+                           type=str, default=None, dest='profile', metavar='FILE')
+        self.parser.add_argument("--profile-mode", help="cprofile: every call of every thread (slow), sample: "
+                                                        "sampled stacks, cheap enough for production runs "
+                                                        "(Default: sample)",
+                           choices=['cprofile', 'sample'], default='sample', dest='profile_mode')
+        self.parser.add_argument("--profile-interval", help="Seconds between samples in sample mode (Default: 0.01)",
+                           type=float, default=0.01, dest='profile_interval')
+        self.parser.add_argument("--transcripts", help="Record a transcript of every device session (data received "
+                                                       "and sent, prompts and command timings) in DIR, for "
+                                                       "offline replay (see benchmark/replay.py)",
+                           type=str, default=None, dest='transcripts', metavar='DIR')
         self.parser.add_argument("--allow_other_than_show", help="CAUTION: This option allows you to execute other"
                                                             " commands then show-commands!",
                            default=False, dest='allow_no_show', action='store_true')
@@ -79,13 +151,29 @@ class CliClient(object):
 
     def execute(self):
 
+        if self.args.resume and not self.args.journal:
+            self.parser.error("--resume requires --journal")
+        if self.args.output_jsonl and not self.args.stream:
+            self.parser.error("--jsonl requires --stream")
+        if self.args.collected_before and not self.args.output_db:
+            self.parser.error("--collected-before requires --database")
+        if self.args.device_list and not os.path.isfile(self.args.device_list):
+            self.parser.error("device list file {} not found".format(self.args.device_list))
+
+        shard = None
+        if self.args.shard:
+            try:
+                shard = utils.parse_shard(self.args.shard)
+            except ValueError as e:
+                self.parser.error(str(e))
+
         # Set logging level
         logging_format="[ %(levelname)-8s ][ %(asctime)s,%(msecs)03d ]:  %(message)s"
         datetime_format = "%H:%M:%S"
 
         if self.args.log_level == 'debug':
             level = level_paramiko_transport = logging.DEBUG
-            logging_format = "[%(levelname)8s][%(asctime)s,%(msecs)03d]:" \
+            logging_format = "[%(levelname)8s][%(asctime)s,%(msecs)03d]:%(threadName)s:" \
                              "%(name)s:%(funcName)s(){l.%(lineno)d}:  %(message)s"
             datetime_format = "%Y-%m-%d %H:%M:%S"
         elif self.args.log_level == 'info':
@@ -107,49 +195,73 @@ class CliClient(object):
         logging.info("Output directory: {}".format(self.args.output_dir))
         logging.info("JSON output file: {}".format(self.args.output_json))
         logging.info("Database output: {}".format(self.args.output_db))
+        logging.info("Collection workers: {}".format(self.args.workers))
+        logging.info("Collection engine: {}".format(self.args.engine))
+        logging.info("Multiplexed final jump node: {}".format(self.args.multiplex))
+        logging.info("Commands per write (pipeline): {}".format(self.args.pipeline))
+        logging.info("Journal file: {} (Resume: {})".format(self.args.journal, self.args.resume))
+        logging.info("Stream output: {} (JSON Lines file: {})".format(self.args.stream, self.args.output_jsonl))
+        logging.info("Reachability prescan: {} (Timeout: {})".format(self.args.prescan, self.args.prescan_timeout))
+        logging.info("Timing history file: {} (Margin: {})".format(self.args.timing_history,
+                                                                   self.args.timeout_margin))
+        logging.info("Metrics file: {} (Prometheus text file: {})".format(self.args.metrics,
+                                                                          self.args.metrics_textfile))
+        logging.info("Profile report: {} (Mode: {})".format(self.args.profile, self.args.profile_mode))
+        logging.info("Transcript directory: {}".format(self.args.transcripts))
         logging.info("Allow other then 'show'-commands: {}".format(self.args.allow_no_show))
         logging.info("Credential file: {}".format(self.args.credentials))
         logging.info("Credential reset: {}".format(self.args.reset))
         logging.info("Settings file: {}".format(self.args.setting_file))
         logging.info("Device list file: {}".format(self.args.device_list))
+        logging.info("Device filters: site {}, role {}, collected before {}, shard {}".format(
+            self.args.site, self.args.role, self.args.collected_before, self.args.shard))
+        logging.info("Devices of one site in parallel: {}".format(self.args.site_limit or 'no limit'))
         logging.info("Command list file: {}".format(self.args.command_list))
 
         logging.info("Initial setup loading...")
 
+        # Imported after argument parsing, backends (MySQL, engines) are loaded when selected.
+        from lib import CollectionManager, ConnectionManager, GovernorManager, HostManager, JournalManager, \
+            MetricsManager, SinkManager, TimingManager, TranscriptManager, accountmgr
+
+        # Durations per phase, written at the end of the run.
+        metrics = MetricsManager.Metrics()
+
         s = utils.read_from_json_file(self.args.setting_file)
         d = None
 
         # Receiving device list if device file is given use that.
-        devices = {}
+        # Devices are streamed, they are read while collection workers become available.
+        filters = {'site': self.args.site, 'role': self.args.role, 'shard': shard}
         if self.args.device_list:
             source = 'file'
-            with open(self.args.device_list) as device_file:
-                hosts_list = device_file.read().splitlines()
-                index = 0
-                for host in hosts_list:
-                    devices[index] = {
-                        'NAME': host,
-                        'IP': host,
-                        'PROTOCOL': self.args.connection
-                    }
-                    index += 1
+            devices = utils.read_device_file(self.args.device_list, protocol=self.args.connection, **filters)
         elif self.args.output_db:
 
-            # Setting up data base manager
-            d = DatbaseManager(database=s['SETTINGS']['MYSQL_DATABASE'],
-                               user=s['SETTINGS']['MYSQL_USER'],
-                               password=s['SETTINGS']['MYSQL_PASSWORD'],
-                               sql_server=s['SETTINGS']['MYSQL_SERVER'])
+            # Setting up data base manager (MySQL server or local SQLite file), only the selected backend is loaded.
+            backend = s['SETTINGS'].get('DATABASE_BACKEND', 'MYSQL')
+            database_class = load_backend(DATABASE_BACKENDS, backend)
+            if backend == 'SQLITE':
+                d = database_class(s['SETTINGS']['SQLITE_FILE'],
+                                   batch_size=s['SETTINGS'].get('SQLITE_BATCH_SIZE', 500),
+                                   commit_interval=s['SETTINGS'].get('SQLITE_COMMIT_INTERVAL', 10))
+            else:
+                d = database_class(database=s['SETTINGS']['MYSQL_DATABASE'],
+                                   user=s['SETTINGS']['MYSQL_USER'],
+                                   password=s['SETTINGS']['MYSQL_PASSWORD'],
+                                   sql_server=s['SETTINGS']['MYSQL_SERVER'],
+                                   batch_size=s['SETTINGS'].get('MYSQL_BATCH_SIZE', 100),
+                                   commit_interval=s['SETTINGS'].get('MYSQL_COMMIT_INTERVAL', 10),
+                                   pool_size=s['SETTINGS'].get('MYSQL_POOL_SIZE', 4))
 
             source = 'database'
             d.connect()
-            devices = d.get_device_list()
-            d.disconnect()
+            devices = d.iter_devices(collected_before=self.args.collected_before, **filters)
         else:
             logging.critical("Must select in-/output method!")
             sys.exit(10)
 
-        logging.info("Devices from {} loaded! (Total: {})".format(source, len(devices)))
+        logging.info("Devices from {} selected!".format(source))
 
         # Read commands from file:
         try:
@@ -161,82 +273,229 @@ class CliClient(object):
 
         # Connect SSH tunnel to jump node!
         logging.debug('Creating SSH tunnel connector...')
-        j = ConnectionManager.JumpCollection(s['SETTINGS']['PATH'], s["JUMPSERVERS"])
+        if 'PATHS' in s['SETTINGS']:
+            # Multiple equivalent jump paths, balance devices over them.
+            j = ConnectionManager.JumpPool(s['SETTINGS']['PATHS'], s["JUMPSERVERS"], multiplex=self.args.multiplex)
+        else:
+            j = ConnectionManager.JumpCollection(s['SETTINGS']['PATH'], s["JUMPSERVERS"],
+                                                 multiplex=self.args.multiplex)
         logging.info("Connected to Jumpservers!")
 
+        # Drop unreachable devices before any login attempt.
+        if self.args.prescan:
+            devices = self.prescan(dict(devices), j)
+
         # Setting up connection and output collector objects
-        c = ConnectionManager.TunnelConnectionAgent(
-            am=accountmgr.AccountManager(config_file=self.args.credentials, reset=self.args.reset),
-            jumpservers=j,
-            ssh_command=s['SETTINGS']['SSH_COMMAND'],
-            telnet_command=s['SETTINGS']['TELNET_COMMAND'],
-            timeout=s['SETTINGS']['TIMEOUT'])
+        am = accountmgr.AccountManager(config_file=self.args.credentials, reset=self.args.reset)
+
+        # Credentials resolved up front, so workers do not wait on the keyring or a password prompt.
+        if isinstance(devices, dict):
+            am.preload(device['IP'] for device in devices.itervalues())
+        else:
+            am.preload()
+
+        # Jumpserver session limits (MAX_SESSIONS of JUMPSERVERS) and login rates per credential section.
+        governor = None
+        session_limits = dict((jumpserver, settings['MAX_SESSIONS'])
+                              for jumpserver, settings in s['JUMPSERVERS'].iteritems() if 'MAX_SESSIONS' in settings)
+        login_rates = s.get('LOGIN_RATES', {})
+        if session_limits or login_rates:
+            governor = GovernorManager.Governor(j.final_jumpservers(), session_limits=session_limits,
+                                                login_rates=login_rates, realm=am.get_section)
+
+        # Timeouts derived from earlier runs, the settings timeout is used for unknown devices and commands.
+        history = None
+        if self.args.timing_history:
+            history = TimingManager.TimingHistory(self.args.timing_history, margin=self.args.timeout_margin)
+
+        # Session transcripts, one file per device session.
+        transcripts = None
+        if self.args.transcripts:
+            transcripts = TranscriptManager.TranscriptStore(self.args.transcripts)
+
+        agent_class = load_backend(AGENT_BACKENDS, self.args.engine)
+
+        def agent_factory():
+            # Each collection worker requires its own connection agent (final tunnel and PEXPECT session).
+            return agent_class(
+                am=am,
+                jumpservers=j,
+                ssh_command=s['SETTINGS']['SSH_COMMAND'],
+                telnet_command=s['SETTINGS']['TELNET_COMMAND'],
+                timeout=s['SETTINGS']['TIMEOUT'],
+                history=history,
+                metrics=metrics,
+                transcripts=transcripts)
 
         # Setup host manager (Output collector)
         h = HostManager.HostManagment(db=d)
 
+        # Setup output sinks in stream mode, results are written as soon as a device is finished.
+        sinks = None
+        if self.args.stream:
+            sink_list = []
+            if self.args.output_dir:
+                utils.dir_check(self.args.output_dir)
+                sink_list.append(SinkManager.TextFileSink(h, self.args.output_dir))
+            if self.args.output_json:
+                sink_list.append(SinkManager.JsonSink(self.args.output_json))
+            if self.args.output_jsonl:
+                sink_list.append(SinkManager.JsonLinesSink(self.args.output_jsonl))
+            if self.args.output_db:
+                sink_list.append(SinkManager.DatabaseSink(d))
+            sinks = SinkManager.SinkDispatcher(sink_list, max_queue=self.args.sink_queue, metrics=metrics)
+
+        # Setup journal, output of an interrupted run is loaded into the host manager.
+        journal = None
+        if self.args.journal:
+            journal = JournalManager.Journal(self.args.journal, resume=self.args.resume)
+            if self.args.resume:
+                if sinks:
+                    journal.replay(h, on_completed=lambda host: sinks.put(host, h.pop_host(host)))
+                else:
+                    journal.replay(h)
+
         # Collection of data
-        output = {}
         logging.info("Performing device captures...")
-        for device in devices:
-            # Add host to host manager
-            h.add_host(devices[device]['NAME'], db_id=device, ipv4=devices[device]['IP'])
-
-            # Connect to end device
-            connection = c.connect(devices[device]['IP'], connection_protocol=devices[device]['PROTOCOL'])
-
-            if connection:
-                # Set unlimited terminal length
-                c.terminal_lenth_cisco(devices[device]['NAME'])
-
-                # Send commands and collect output
-                output[device] = {}
-                for command in commands_list:
-                    if connection:
-                        # Only show commands are allowed!
-                        connection, out = c.send_command(devices[device]['NAME'],
-                                             command, allow_more_show=self.args.allow_no_show)
-                        if out:
-                            h.add_command(devices[device]['NAME'], command, out)
-
-                # Disconnect from end node gracefully
-                if connection:
-                    c.disconnect()
-                logging.info("Finished data collection for {}!".format(devices[device]['NAME']))
-
-        # Disconnect from jump nodes
-        logging.debug('Terminating SSH tunnel to connector...')
-        j.disconnect_jumpserver_chain()
-        logging.info("Disconnected from jumpservers!")
-
-        # Output options!
+        collector = CollectionManager.CollectionManager(agent_factory, h, commands_list,
+                                                        workers=self.args.workers,
+                                                        allow_more_show=self.args.allow_no_show,
+                                                        engine=self.args.engine,
+                                                        journal=journal,
+                                                        sinks=sinks,
+                                                        pipeline=self.args.pipeline,
+                                                        history=history,
+                                                        site_limit=self.args.site_limit,
+                                                        governor=governor,
+                                                        metrics=metrics)
+
+        # Metrics are written and database connections closed at the end of every run, also on errors.
+        try:
+            try:
+                collector.run(devices)
+            finally:
+                if history:
+                    history.save()
+                if journal:
+                    journal.close()
+                if sinks:
+                    # Hosts left over from the journal, then flush all sinks.
+                    for host in list(h.hm):
+                        sinks.put(host, h.pop_host(host))
+                    sinks.close()
+                    logging.info("Streamed output to all outputs!")
+
+            # Disconnect from jump nodes
+            logging.debug('Terminating SSH tunnel to connector...')
+            j.disconnect_jumpserver_chain()
+            logging.info("Disconnected from jumpservers!")
+
+            # Output options! (Already written in stream mode)
+            if not self.args.stream:
+                self.export(h, metrics)
+        finally:
+            # Close pooled database connections
+            if d:
+                d.disconnect()
+            self.write_metrics(metrics)
+
+        logging.debug("Script ended")
+        sys.exit()
+
+    def export(self, h, metrics):
+        """
+        Write collected output to the selected outputs (text files, JSON file, database).
+
+        Args:
+            h (object): HostManagment instance with the output of the run
+            metrics (object): Metrics instance of the run
+        """
+
+        from lib import MetricsManager
 
         # Output to files in output directory
         if self.args.output_dir:
             utils.dir_check(self.args.output_dir)
-            h.write_to_txt_files(self.args.output_dir)
+            with metrics.timer(MetricsManager.EXPORT, key='text'):
+                h.write_to_txt_files(self.args.output_dir)
             logging.info("Saved output to text files in:{}!".format(self.args.output_dir))
 
         # Write to JSON output
         if self.args.output_json:
-            h.write_to_json(self.args.output_json)
+            with metrics.timer(MetricsManager.EXPORT, key='json'):
+                h.write_to_json(self.args.output_json)
             logging.info("Saved output to JSON file:{}!".format(self.args.output_json))
 
         # Send output to SQL server
         if self.args.output_db:
             if not self.args.device_list:
-                h.write_to_db()
+                with metrics.timer(MetricsManager.EXPORT, key='database'):
+                    h.write_to_db()
                 logging.info("Saved output to database!")
             else:
                 logging.error("Not saving output to database! Can only save output to database"
                               " if devices are retreived from database!")
 
-        logging.debug("Script ended")
-        sys.exit()
+    def write_metrics(self, metrics):
+        """
+        Log phase summary and write metrics files if requested.
+
+        Args:
+            metrics (object): Metrics instance of the run
+        """
+
+        metrics.log_summary()
+        if self.args.metrics:
+            metrics.write_json(self.args.metrics)
+        if self.args.metrics_textfile:
+            metrics.write_prometheus(self.args.metrics_textfile)
+
+    def prescan(self, devices, j):
+        """
+        Probe the connection port of all devices and return only the reachable devices.
+
+        Args:
+            devices (dict): Device settings by device identifier
+            j (object): JumpCollection or JumpPool instance (used for prescan via jump path)
+
+        Returns:
+            dict: Reachable device settings by device identifier
+        """
+
+        ports = {'SSH': 22, 'TELNET': 23}
+        targets = {}
+        for device in devices:
+            protocol = devices[device]['PROTOCOL']
+            if protocol not in ports:
+                # Same fallback as connect, the device is collected with the default connection type.
+                logging.error("{} not a allowed connection type for {}. Falling back to: {}".format(
+                    protocol, devices[device]['NAME'], self.args.connection))
+                protocol = self.args.connection
+            targets[device] = (devices[device]['IP'], devices[device].get('PORT') or ports[protocol])
+
+        logging.info("Probing {} devices ({})...".format(len(targets), self.args.prescan))
+        if self.args.prescan == 'jump':
+            reachable = j.scan_reachable(targets.values(), timeout=self.args.prescan_timeout)
+        else:
+            reachable = utils.scan_reachable(targets.values(), timeout=self.args.prescan_timeout)
+
+        for device in devices:
+            if not reachable[targets[device]]:
+                logging.error("Skipping {}, not reachable on {}:{}!".format(devices[device]['NAME'],
+                                                                            *targets[device]))
+
+        logging.info("Prescan finished! (Reachable: {} of {})".format(
+            len([device for device in devices if reachable[targets[device]]]), len(devices)))
+        return dict((device, devices[device]) for device in devices if reachable[targets[device]])
 
 def main():
     cli = CliClient()
-    cli.execute()
+    if cli.args.profile:
+        from lib import ProfileManager
+        with ProfileManager.profiling(cli.args.profile, cli.args.profile_mode, cli.args.profile_interval):
+            cli.execute()
+    else:
+        cli.execute()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,552 @@
+#!/usr/bin/env python -tt
+"""
+Collection Manager library for collecting command output from hosts.
+"""
+
+import itertools
+import logging
+import threading
+import time
+import Queue
+
+import MetricsManager
+from TimingManager import DEVICE, LOGIN
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+class CollectionWorker(threading.Thread):
+    """
+    Worker thread collecting devices from a shared queue with its own connection agent.
+    """
+
+    def __init__(self, name, manager, work_queue, agent):
+        """
+        Worker thread for collection of devices.
+
+        Args:
+            name (basestring): Name of the worker (logging purposes)
+            manager (object): CollectionManager instance owning this worker
+            work_queue (object): Queue with (device identifier, device settings) tuples to collect,
+            None when all devices are scheduled
+            agent (object): TunnelConnectionAgent instance, owned by this worker only
+        """
+
+        super(CollectionWorker, self).__init__(name=name)
+        self.daemon = True
+
+        self.manager = manager
+        self.work_queue = work_queue
+        self.agent = agent
+
+    def run(self):
+        while not self.manager.stop_event.is_set():
+            try:
+                item = self.work_queue.get(timeout=1)
+            except Queue.Empty:
+                continue
+
+            if item is None:
+                self.work_queue.task_done()
+                break
+
+            device_id, device = item
+            try:
+                self.manager.collect_device(self.agent, device_id, device)
+            except Exception as e:
+                logging.error("Collection for {} failed! ({})".format(device['NAME'], e))
+                if self.agent.connected:
+                    self.agent.disconnect()
+            finally:
+                self.work_queue.task_done()
+
+        logging.debug("{} finished!".format(self.name))
+
+
+class DeviceScheduler(object):
+    """
+    Scheduler handing out devices longest expected duration first, with a limit of devices per site in flight.
+    """
+
+    def __init__(self, devices, history=None, site_limit=None):
+        """
+        Scheduler for devices collected in parallel (longest processing time first).
+
+        The expected duration of a device is the median of its durations in earlier runs (or of its logins
+        if it never completed), devices without history are expected to take the median of all known devices. Workers take the
+        longest device of all sites which have less than site_limit devices in flight. Devices
+        without SITE are not limited.
+
+        Args:
+            devices (iter): Iterable of (device identifier, device settings) tuples, read at once
+            history (object): TimingHistory instance with DEVICE and LOGIN durations per device name (optional)
+            site_limit (int): Maximum number of devices per site in flight (optional, unlimited if not set)
+        """
+
+        self.site_limit = site_limit
+        self.condition = threading.Condition()
+        self.in_flight = {}  # Device identifier -> site
+        self.site_count = {}  # Site -> devices in flight
+
+        devices = list(devices)
+        estimates = [None] * len(devices)
+        if history:
+            estimates = [history.estimate(device['NAME'], DEVICE, percentile=50, min_samples=1,
+                                          default=history.estimate(device['NAME'], LOGIN, percentile=50,
+                                                                   min_samples=1))
+                         for _, device in devices]
+
+        known = sorted(estimate for estimate in estimates if estimate is not None)
+        unknown = known[len(known) // 2] if known else 0
+
+        # Pending devices per site, sorted so the longest (first listed on equal estimates) is popped first.
+        self.pending = {}
+        self.total = len(devices)
+        self.expected = 0
+        for order, (item, estimate) in enumerate(zip(devices, estimates)):
+            if estimate is None:
+                estimate = unknown
+            self.expected += estimate
+            self.pending.setdefault(item[1].get('SITE'), []).append((estimate, -order, item))
+        for site_pending in self.pending.itervalues():
+            site_pending.sort()
+
+        logging.info("Scheduled {} devices ({} with history), {:.0f} seconds of expected work!".format(
+            self.total, len(known), self.expected))
+
+    def __len__(self):
+        return self.total
+
+    def _pick(self):
+        # Site with the longest pending device of all sites below their limit, empty list if none.
+        best = []
+        for site, site_pending in self.pending.iteritems():
+            if site is not None and self.site_limit and self.site_count.get(site, 0) >= self.site_limit:
+                continue
+            if not best or site_pending[-1][:2] > self.pending[best[0]][-1][:2]:
+                best = [site]
+        return best
+
+    def get(self, block=True, timeout=None):
+        """
+        Take the next device to collect (Queue interface).
+
+        Args:
+            block (bool): Wait until a device is available
+            timeout (int): Seconds to wait (optional, wait forever if not set)
+
+        Returns:
+            tuple: (device identifier, device settings), None when all devices are scheduled
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                if not self.pending:
+                    return None
+
+                best = self._pick()
+                if best:
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Queue.Empty
+                self.condition.wait(remaining)
+
+            site = best[0]
+            site_pending = self.pending[site]
+            item = site_pending.pop()[2]
+            if not site_pending:
+                del self.pending[site]
+
+            self.in_flight[item[0]] = site
+            self.site_count[site] = self.site_count.get(site, 0) + 1
+            return item
+
+    def wait(self, timeout=None):
+        """
+        Wait until a device is done or the timeout expired.
+        """
+
+        with self.condition:
+            self.condition.wait(timeout)
+
+    def task_done(self):
+        # Queue interface, devices are released with done.
+        pass
+
+    def done(self, device_id):
+        """
+        Release the site of a device in flight.
+
+        Args:
+            device_id (int): Device identifier
+        """
+
+        with self.condition:
+            if device_id not in self.in_flight:
+                return
+            site = self.in_flight.pop(device_id)
+            self.site_count[site] -= 1
+            self.condition.notify_all()
+
+
+class CollectionManager(object):
+    """
+    Collection Manager to collect devices sequentially or with a pool of workers.
+    """
+
+    def __init__(self, agent_factory, hm, commands_list, workers=1, allow_more_show=False, engine='thread',
+                 journal=None, sinks=None, pipeline=1, history=None, site_limit=None, governor=None, metrics=None):
+        """
+        Collection Manager for collecting output of commands for a list of devices.
+
+        Each worker gets its own connection agent from the agent factory, so each worker holds its
+        own final-hop tunnel and PEXPECT session. All workers share the jumpserver chain and HostManager.
+
+        With the 'event' engine all workers are coroutines on a single SessionLoop, the agent factory
+        must return EventTunnelConnectionAgent instances.
+
+        Args:
+            agent_factory (callable): Callable returning a new TunnelConnectionAgent instance
+            hm (object): HostManagment instance to store output in
+            commands_list (lst): List of commands to collect
+            workers (int): Number of devices collected in parallel (Default: 1)
+            allow_more_show (bool): Allow other than 'show'-commands
+            engine (basestring): Collection engine, 'thread' (worker threads) or 'event' (SessionLoop)
+            journal (object): Journal instance to record results in and skip completed work (optional)
+            sinks (object): SinkDispatcher instance, results of a device are passed on and released from
+            the HostManager as soon as the device is finished (optional)
+            pipeline (int): Number of commands sent to a device in a single write (Default: 1, one by one)
+            history (object): TimingHistory instance, device durations are recorded in it and parallel
+            runs are scheduled longest device first (optional)
+            site_limit (int): Maximum number of devices of one site collected in parallel (optional)
+            governor (object): Governor instance limiting jumpserver sessions and login rates (optional)
+            metrics (object): Metrics instance recording the duration of each device (optional)
+        """
+
+        self.agent_factory = agent_factory
+        self.hm = hm
+        self.commands_list = commands_list
+        self.workers = max(1, workers)
+        self.allow_more_show = allow_more_show
+        self.engine = engine
+        self.journal = journal
+        self.sinks = sinks
+        self.pipeline = max(1, pipeline)
+        self.history = history
+        self.site_limit = site_limit
+        self.governor = governor
+        self.metrics = metrics
+        self.scheduler = None
+        self.stop_event = threading.Event()
+
+    def _pending_commands(self, device):
+        # Commands not yet collected for device according to the journal.
+        if self.journal is None:
+            return self.commands_list
+
+        completed = self.journal.completed_commands(device['NAME'])
+        return [command for command in self.commands_list if command not in completed]
+
+    def _batches(self, commands):
+        # Commands split in batches for pipelining.
+        return [commands[index:index + self.pipeline] for index in range(0, len(commands), self.pipeline)]
+
+    def _start_device(self, device_id, device):
+        # Add host to host manager, keep output replayed from the journal.
+        if device['NAME'] not in self.hm.hm:
+            self.hm.add_host(device['NAME'], db_id=device_id, ipv4=device['IP'])
+
+    def _add_output(self, device_id, device, command, out, completed=True):
+        # Failed commands (error output, disconnected) are kept in the output but not journaled, resume retries them.
+        record = self.hm.add_command(device['NAME'], command, out)
+        if self.journal and completed:
+            self.journal.record_command(device['NAME'], device_id, command, out, record['TIMESTAMP'],
+                                        ipv4=device['IP'])
+
+    def _add_outputs(self, device_id, device, batch, outputs, connection):
+        # After a failure in a batch the last output is the error, the outputs before it completed.
+        sent = [index for index, out in enumerate(outputs) if out is not None]
+        for index, (command, out) in enumerate(zip(batch, outputs)):
+            if out:
+                self._add_output(device_id, device, command, out, completed=connection or index < sent[-1])
+
+    def _finish_device(self, device_id, device, connection, started):
+        if connection and self.history:
+            self.history.record(device['NAME'], DEVICE, time.time() - started)
+        if connection and self.journal:
+            self.journal.record_device(device['NAME'], device_id)
+        logging.info("Finished data collection for {}!".format(device['NAME']))
+
+    def _record_device(self, device, connection, started):
+        if self.metrics:
+            self.metrics.record(MetricsManager.DEVICE, time.time() - started, host=device['IP'], error=not connection)
+
+    def _release_device(self, device_id, device):
+        # Stream results of device to sinks, only devices in flight are kept in memory.
+        if self.sinks and device['NAME'] in self.hm.hm:
+            self.sinks.put(device['NAME'], self.hm.pop_host(device['NAME']))
+        if self.scheduler:
+            self.scheduler.done(device_id)
+
+    def collect_device(self, agent, device_id, device):
+        """
+        Method to connect to a single device, collect all commands and disconnect.
+
+        Args:
+            agent (object): TunnelConnectionAgent instance used for this device.
+            device_id (int): Device identifier (Database ID or index of device list).
+            device (dict): Device settings containing NAME, IP and PROTOCOL (and optional PORT).
+
+        Returns:
+            bool: Connection status after collection.
+        """
+
+        self._start_device(device_id, device)
+
+        # Wait for a jumpserver session and login token.
+        permit = None
+        if self.governor:
+            permit = self.governor.acquire(device)
+            time.sleep(permit.delay)
+        started = time.time()
+        connection = False
+
+        try:
+            # Connect to end device
+            connection = agent.connect(device['IP'], connection_protocol=device['PROTOCOL'],
+                                       port=device.get('PORT'), via=permit.jumpserver if permit else None,
+                                       name=device['NAME'], reroute=self._reroute(permit))
+
+            if connection:
+                # Set unlimited terminal length
+                agent.terminal_lenth_cisco(device['NAME'])
+
+                # Send commands and collect output
+                if self.pipeline > 1:
+                    for batch in self._batches(self._pending_commands(device)):
+                        if connection:
+                            # Only show commands are allowed!
+                            connection, outputs = agent.send_commands(device['NAME'], batch,
+                                                                      allow_more_show=self.allow_more_show)
+                            self._add_outputs(device_id, device, batch, outputs, connection)
+                else:
+                    for command in self._pending_commands(device):
+                        if connection:
+                            # Only show commands are allowed!
+                            connection, out = agent.send_command(device['NAME'], command,
+                                                                 allow_more_show=self.allow_more_show)
+                            if out:
+                                self._add_output(device_id, device, command, out, completed=connection)
+
+                # Disconnect from end node gracefully
+                if connection:
+                    agent.disconnect()
+                self._finish_device(device_id, device, connection, started)
+        finally:
+            self._record_device(device, connection, started)
+            if permit:
+                self.governor.release(permit)
+            self._release_device(device_id, device)
+
+        return connection
+
+    def collect_device_events(self, agent, device_id, device):
+        """
+        Coroutine equivalent of collect_device for an EventTunnelConnectionAgent running on a SessionLoop.
+        """
+
+        # Imported here as the event engine is optional.
+        from EventConnectionManager import Sleep
+
+        self._start_device(device_id, device)
+
+        permit = None
+        if self.governor:
+            permit = yield self._acquire_events(device)
+            if permit.delay:
+                yield Sleep(permit.delay)
+        started = time.time()
+        connection = False
+
+        try:
+            connection = yield agent.connect(device['IP'], connection_protocol=device['PROTOCOL'],
+                                             port=device.get('PORT'), via=permit.jumpserver if permit else None,
+                                             name=device['NAME'], reroute=self._reroute(permit))
+
+            if connection:
+                yield agent.terminal_lenth_cisco(device['NAME'])
+
+                if self.pipeline > 1:
+                    for batch in self._batches(self._pending_commands(device)):
+                        if connection:
+                            connection, outputs = yield agent.send_commands(device['NAME'], batch,
+                                                                            allow_more_show=self.allow_more_show)
+                            self._add_outputs(device_id, device, batch, outputs, connection)
+                else:
+                    for command in self._pending_commands(device):
+                        if connection:
+                            connection, out = yield agent.send_command(device['NAME'], command,
+                                                                       allow_more_show=self.allow_more_show)
+                            if out:
+                                self._add_output(device_id, device, command, out, completed=connection)
+
+                if connection:
+                    yield agent.disconnect()
+                self._finish_device(device_id, device, connection, started)
+        finally:
+            self._record_device(device, connection, started)
+            if permit:
+                self.governor.release(permit)
+            # Blocks the loop if the sink queue is full, backpressure for all sessions.
+            self._release_device(device_id, device)
+
+    def _skip_completed(self, devices):
+        # Devices not completed according to the journal.
+        skipped = 0
+        for device_id, device in devices:
+            if self.journal.is_completed(device['NAME']):
+                skipped += 1
+                continue
+            yield device_id, device
+
+        if skipped:
+            logging.info("Skipped {} devices completed in journal!".format(skipped))
+
+    def run(self, devices):
+        """
+        Collect all devices.
+
+        Args:
+            devices (dict): Device settings by device identifier, or an iterable of (device identifier,
+            device settings) tuples which is consumed while devices are collected (e.g. a database cursor)
+        """
+
+        total = len(devices) if hasattr(devices, '__len__') else None
+        if isinstance(devices, dict):
+            devices = devices.iteritems()
+        devices = iter(devices)
+
+        if self.journal:
+            devices = self._skip_completed(devices)
+
+        # Order matters only with parallel collection, the scheduler reads all devices up front.
+        if (self.workers > 1 or self.engine == 'event') and (self.history or self.site_limit):
+            self.scheduler = DeviceScheduler(devices, history=self.history, site_limit=self.site_limit)
+            total = len(self.scheduler)
+
+        if self.engine == 'event':
+            self.run_events(devices, total)
+            return
+
+        if self.workers == 1:
+            # Sequential collection in current thread.
+            agent = self.agent_factory()
+            for device_id, device in devices:
+                self.collect_device(agent, device_id, device)
+            return
+
+        # Bounded queue, devices are read from the source as workers become available.
+        # With a scheduler workers take devices from the scheduler instead.
+        work_queue = self.scheduler or Queue.Queue(maxsize=self.workers * 2)
+
+        workers = []
+        for index in range(self.workers if total is None else min(self.workers, total)):
+            worker = CollectionWorker('Worker-{}'.format(index), self, work_queue, self.agent_factory())
+            workers.append(worker)
+            worker.start()
+
+        logging.info("Started {} collection workers!".format(len(workers)))
+
+        try:
+            # Put and join with timeout to keep main thread responsive for KeyboardInterrupt.
+            if not self.scheduler:
+                for item in itertools.chain(devices, [None] * len(workers)):
+                    while True:
+                        try:
+                            work_queue.put(item, timeout=1)
+                            break
+                        except Queue.Full:
+                            continue
+
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(1)
+        except KeyboardInterrupt:
+            logging.warn("Interrupted! Stopping collection workers...")
+            self.stop_event.set()
+            raise
+
+    def run_events(self, devices, total=None):
+        """
+        Collect all devices with coroutines on a single SessionLoop.
+
+        Args:
+            devices (iter): Iterator of (device identifier, device settings) tuples
+            total (int): Number of devices if known, limits the number of sessions
+        """
+
+        # Imported here as the event engine is optional.
+        from EventConnectionManager import SessionLoop
+
+        sessions = self.workers if total is None else min(self.workers, total)
+        loop = SessionLoop(executor_threads=min(self.workers, 16))
+
+        for index in range(sessions):
+            loop.spawn(self._event_worker(self.agent_factory(), devices), name='Session-{}'.format(index))
+
+        logging.info("Started {} collection sessions!".format(sessions))
+        loop.run()
+
+    def _next_scheduled(self):
+        # Coroutine returning the next device of the scheduler, waiting outside of the loop for a free site.
+        from EventConnectionManager import Call, Return
+
+        while True:
+            try:
+                yield Return(self.scheduler.get(block=False))
+            except Queue.Empty:
+                yield Call(self.scheduler.wait, 1)
+
+    def _reroute(self, permit):
+        # Session of the permit moves along when a device is connected through another final jumpserver.
+        if permit is None:
+            return None
+        return lambda jumpserver: self.governor.transfer(permit, jumpserver)
+
+    def _acquire_events(self, device):
+        # Coroutine returning a permit of the governor, waiting outside of the loop for a free session.
+        from EventConnectionManager import Call, Return
+
+        while True:
+            try:
+                yield Return(self.governor.acquire(device, block=False))
+            except Queue.Empty:
+                yield Call(self.governor.wait, 1)
+
+    def _event_worker(self, agent, devices):
+        # Sessions share the device iterator (or scheduler), each takes the next device when done.
+        while True:
+            if self.scheduler:
+                item = yield self._next_scheduled()
+            else:
+                item = next(devices, None)
+            if item is None:
+                break
+
+            device_id, device = item
+            try:
+                yield self.collect_device_events(agent, device_id, device)
+            except Exception as e:
+                logging.error("Collection for {} failed! ({})".format(device['NAME'], e))
+                if agent.connected:
+                    yield agent.disconnect()
@@ -3,15 +3,27 @@
 Connection Manager library for managing connections to hosts.
 """
 
+import errno
 import logging
 import pexpect
 import accountmgr
 import re
 import os
+import select
+import socket
+import threading
+import time
+import Queue
 
 import sys
+import paramiko
 from sshtunnel import SSHTunnelForwarder
 from sshtunnel import BaseSSHTunnelForwarderError
+import MetricsManager
+from TimingManager import LOGIN
+
+# Bytes buffered per direction of a multiplexed forward, reading from the other side pauses when full.
+FORWARD_BUFFER_SIZE = 262144
 
 __author__ = "Thomas Jongerius"
 __copyright__ = "Copyright 2016, Thomas Jongerius"
@@ -23,6 +35,34 @@ __email__ = "thomasjongerius@yaworks.nl"
 __status__ = "Development"
 
 
+def _run_probes(probe, targets, max_parallel):
+    # Run probe for each target from a pool of threads, returns results by target.
+    pending = Queue.Queue()
+    for target in set(targets):
+        pending.put(target)
+
+    result = {}
+
+    def prober():
+        while True:
+            try:
+                target = pending.get_nowait()
+            except Queue.Empty:
+                break
+            result[target] = probe(target)
+
+    threads = [threading.Thread(target=prober, name='Probe-{}'.format(index))
+               for index in range(max(1, min(max_parallel, pending.qsize())))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+
+    return result
+
+
 class SSHTunnelingConnectionAgent(object):
     """
     Connection Agent to manage TCP port forwarding instances.
@@ -94,7 +134,7 @@ class SSHTunnelingConnectionAgent(object):
             raise ValueError(e)
         except BaseSSHTunnelForwarderError as e:
             logging.critical("Could not connect to {} due to connectivity issues! ({})".format(self.ssh_server, e))
-            raise BaseSSHTunnelForwarderError(e)
+            raise BaseSSHTunnelForwarderError(str(e))
         except Exception as e:
             logging.error('*** Failed to connect to %s:%d: %r' % (self.ssh_server, self.ssh_port, e))
             raise BaseException(e)
@@ -110,12 +150,283 @@ class SSHTunnelingConnectionAgent(object):
         logging.debug("Connection to {} ({}) terminated!".format(self.ssh_server, self.tunnel._remote_binds))
 
 
+class ForwardedChannel(object):
+    """
+    Local TCP port forwarded to a destination over a direct-tcpip channel of a shared SSH transport.
+    """
+
+    def __init__(self, multiplexer, channel, destination, port):
+        """
+        Args:
+            multiplexer (object): MultiplexedTunnelingConnectionAgent owning the transport
+            channel (object): Opened paramiko channel to the destination
+            destination (basestring): Destination address (documentation purposes)
+            port (int): Destination port (documentation purposes)
+        """
+
+        self.multiplexer = multiplexer
+        self.channel = channel
+        self.remote_bind_address = destination
+        self.remote_bind_port = port
+        self.client = None
+        self.to_client = ''  # Received from the channel, not yet sent to the client.
+        self.to_channel = ''  # Received from the client, not yet sent to the channel.
+        self.eof = False  # One side closed, the forward closes once the buffers are sent.
+        self.channel.settimeout(0.0)
+
+        # Listen on loopback for a single local client (PEXPECT session).
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.local_port = self.listener.getsockname()[1]
+
+    def disconnect(self):
+        """
+        Method for terminating forwarded channel, the shared transport stays connected.
+        """
+
+        self.multiplexer.close_forward(self)
+        logging.debug("Forwarding to {}:{} terminated!".format(self.remote_bind_address, self.remote_bind_port))
+
+
+class MultiplexedTunnelingConnectionAgent(object):
+    """
+    Connection Agent keeping a single authenticated SSH transport to a jumpserver, forwarding
+    local ports to destinations over direct-tcpip channels of that transport.
+    """
+
+    def __init__(self, server, username, password=None, ssh_pkey=os.path.expanduser("~") + '/.ssh/id_rsa',
+                 port=22, channel_timeout=10):
+        """
+        Connection Manager for a multiplexed SSH transport.
+
+        Args:
+            ssh_pkey (str): String to path with private key for SSH authentication (required) (Default: ~/.ssh/id_rsa)
+            password (str): Optional password for private key if required
+            port (int): Port number for SSH connection (Default 22)
+            username (str): Username for SSH connection (required)
+            server (str): Server name to connect to (str)
+            channel_timeout (int): Timeout for opening a channel to a destination
+        """
+
+        self.ssh_server = server
+        self.username = username
+        self.password = password
+        self.ssh_port = port
+        self.ssh_pkey = ssh_pkey
+        self.channel_timeout = channel_timeout
+        self.transport = None
+        self.forwards = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.pump = None
+
+        # Auto connect on initialization
+        self.connect()
+
+    def _load_key(self):
+        key_file = os.path.expanduser(self.ssh_pkey)
+        for key_class in (paramiko.RSAKey, paramiko.ECDSAKey, paramiko.DSSKey):
+            try:
+                return key_class.from_private_key_file(key_file, password=self.password)
+            except paramiko.SSHException:
+                continue
+        raise ValueError("Unsupported or encrypted private key file ({})!".format(key_file))
+
+    def connect(self):
+        """
+        Method for creating authenticated transport to the jumpserver and starting the forwarding thread.
+        """
+
+        try:
+            logging.debug('Connecting to ssh host %s:%d (multiplexed)...' % (self.ssh_server, self.ssh_port))
+            sock = socket.create_connection((self.ssh_server, self.ssh_port), timeout=self.channel_timeout)
+            self.transport = paramiko.Transport(sock)
+            self.transport.start_client(timeout=self.channel_timeout)
+            self.transport.auth_publickey(self.username, self._load_key())
+            self.transport.set_keepalive(30)
+        except (paramiko.SSHException, socket.error) as e:
+            logging.critical("Could not connect to {} due to connectivity issues! ({})".format(self.ssh_server, e))
+            if self.transport:
+                self.transport.close()
+            raise BaseSSHTunnelForwarderError(str(e))
+
+        self.running = True
+        self.pump = threading.Thread(target=self._pump, name='Multiplexer-{}'.format(self.ssh_server))
+        self.pump.daemon = True
+        self.pump.start()
+
+        logging.debug("Connected to {}!".format(self.ssh_server))
+
+    def is_active(self):
+        return self.running and self.transport is not None and self.transport.is_active()
+
+    def open_forward(self, destination, port):
+        """
+        Method for opening a channel to destination and a local port forwarded to it.
+
+        Args:
+            port (int): Port for end destination (TCP only)
+            destination (basestring): String to destination address.
+
+        Returns:
+            ForwardedChannel: Forwarding instance with local port.
+        """
+
+        try:
+            channel = self.transport.open_channel('direct-tcpip', (destination, port), ('127.0.0.1', 0),
+                                                  timeout=self.channel_timeout)
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            logging.error("Could not open channel to {}:{} via {}! ({})".format(destination, port,
+                                                                              self.ssh_server, e))
+            raise BaseSSHTunnelForwarderError(str(e))
+
+        forward = ForwardedChannel(self, channel, destination, port)
+        with self.lock:
+            self.forwards.append(forward)
+
+        logging.debug('Now forwarding port {} to {}:{} (multiplexed)...'.format(forward.local_port, destination, port))
+        return forward
+
+    def probe(self, destination, port, timeout=None):
+        """
+        Method to check if destination accepts connections, by opening and closing a channel to it.
+
+        Args:
+            port (int): Port for end destination (TCP only)
+            destination (basestring): String to destination address.
+            timeout (int): Timeout for opening the channel (Default: channel_timeout)
+
+        Returns:
+            bool: True if the jumpserver could connect to destination.
+        """
+
+        try:
+            channel = self.transport.open_channel('direct-tcpip', (destination, port), ('127.0.0.1', 0),
+                                                  timeout=timeout or self.channel_timeout)
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            logging.debug("Probe to {}:{} via {} failed! ({})".format(destination, port, self.ssh_server, e))
+            return False
+
+        channel.close()
+        return True
+
+    def close_forward(self, forward):
+        with self.lock:
+            if forward in self.forwards:
+                self.forwards.remove(forward)
+        for s in (forward.client, forward.channel, forward.listener):
+            if s is not None:
+                s.close()
+
+    def _pump(self):
+        # Single thread moving data between all local clients and their channels. Sends never block, data
+        # is buffered per forward, so a slow client or a full channel window only holds up its own forward.
+        while self.running:
+            with self.lock:
+                forwards = list(self.forwards)
+
+            if not forwards:
+                time.sleep(0.05)
+                continue
+
+            readers = {}
+            writers = {}
+            channel_pending = False
+            for forward in forwards:
+                if forward.client is None:
+                    readers[forward.listener] = forward
+                    continue
+                if not forward.eof:
+                    if len(forward.to_channel) < FORWARD_BUFFER_SIZE:
+                        readers[forward.client] = forward
+                    if len(forward.to_client) < FORWARD_BUFFER_SIZE:
+                        readers[forward.channel] = forward
+                if forward.to_client:
+                    writers[forward.client] = forward
+                if forward.to_channel:
+                    channel_pending = True
+
+            # Channels can not be selected for writing, pending channel data is retried after a short wait.
+            try:
+                readable, writable, _ = select.select(list(readers), list(writers), [],
+                                                      0.01 if channel_pending else 0.05)
+            except (select.error, socket.error, ValueError):
+                # Socket closed by another thread, rebuild list.
+                continue
+
+            for s in readable:
+                forward = readers[s]
+                try:
+                    if s is forward.listener:
+                        forward.client, _ = forward.listener.accept()
+                        forward.client.setblocking(False)
+                        continue
+
+                    data = s.recv(32768)
+                    if not data:
+                        forward.eof = True
+                    elif s is forward.client:
+                        forward.to_channel += data
+                    else:
+                        forward.to_client += data
+                except socket.timeout:
+                    pass
+                except socket.error as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        self.close_forward(forward)
+                except (paramiko.SSHException, EOFError):
+                    self.close_forward(forward)
+
+            for forward in forwards:
+                if forward.client is not None and forward in self.forwards:
+                    self._flush(forward)
+
+    def _flush(self, forward):
+        # Send buffered data without blocking, close the forward after EOF once all data is sent.
+        try:
+            if forward.to_channel and forward.channel.send_ready():
+                sent = forward.channel.send(forward.to_channel)
+                forward.to_channel = forward.to_channel[sent:]
+            if forward.to_client:
+                sent = forward.client.send(forward.to_client)
+                forward.to_client = forward.to_client[sent:]
+        except socket.timeout:
+            pass
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.close_forward(forward)
+                return
+        except (paramiko.SSHException, EOFError):
+            self.close_forward(forward)
+            return
+
+        if forward.eof and not forward.to_client and not forward.to_channel:
+            self.close_forward(forward)
+
+    def disconnect(self):
+        """
+        Method for terminating all forwards and the transport.
+        """
+
+        self.running = False
+        with self.lock:
+            forwards = list(self.forwards)
+        for forward in forwards:
+            self.close_forward(forward)
+        if self.pump:
+            self.pump.join(1)
+        self.transport.close()
+        logging.debug("Connection to {} (multiplexed) terminated!".format(self.ssh_server))
+
+
 class JumpCollection(object):
     """
     Jumpserver object to maintain SSH tunnels to series of jumpservers via TCP port forwarding.
     """
 
-    def __init__(self, path, jumpserver_settings):
+    def __init__(self, path, jumpserver_settings, multiplex=False):
         """
         Class to maintain jumpserver collection for chaining multiple SSH server jumps
         over TCP forwarding sockets.
@@ -134,6 +445,11 @@ class JumpCollection(object):
                 - PASSWORD: Basestring keyphrase for private key
                 - RSA_KEY_FILE: Basestring to location path for private key for SSH authentication. (Mandatory)
                 - PORT: Port to connect to for SSH connection.
+                - MAX_SESSIONS: Maximum number of end destinations connected via this jumpserver as final
+                jumpserver at the same time (Optional, enforced by the collection Governor)
+
+            multiplex (bool): Keep one SSH transport to the final jumpserver for all end destinations,
+            opening a channel per destination instead of a new SSH tunnel per destination.
         """
 
         # Initial variables
@@ -145,9 +461,12 @@ class JumpCollection(object):
         self.loopback_address = '127.0.0.1'
         self.local_port = None
         self.final_connection = None # SSHTunnelingConnectionAgent instances maintaining connectivity to last host.
+        self.multiplex = multiplex
+        self.multiplexed_connection = None # MultiplexedTunnelingConnectionAgent shared by all end destinations.
+        self.lock = threading.Lock()
 
         # Validate if all connection settings are there
-        required_settings = ['CONNECTION_TYPE', 'USERNAME', 'PASSWORD', 'RSA_KEY_FILE', 'PORT']
+        required_settings = ['CONNECTION_TYPE', 'USERNAME', 'PASSWORD', 'RSA_KEY_FILE', 'PORT', 'MAX_SESSIONS']
         for jumpserver in path:
             if jumpserver not in self.jump_settings:
                 logging.error("Not all jumpserver-data ({}) in setting file!".format(jumpserver))
@@ -222,19 +541,35 @@ class JumpCollection(object):
 
         return current_connection.local_port
 
-    def connect_jumpserver_final(self, destination, port):
+    def final_jumpservers(self):
         """
-        Method required to open connection via final jumpserver to host.
+        Final jumpservers end destinations are connected through.
+
+        Returns:
+            lst: Final jumpserver of the path
+        """
+
+        return [self.path[-1]]
+
+    def open_final_connection(self, destination, port, via=None, reroute=None):
+        """
+        Method required to open a new connection via final jumpserver to host.
+
+        The connection is not tracked by the collection and must be disconnected by the caller. This
+        allows multiple connections to end hosts to be open at the same time over the same chain.
 
         Args:
             port (int): Port for end destination (TCP only)
             destination (basestring): String to destination address.
+            via (basestring): Final jumpserver to connect through (not used, a collection has one path)
+            reroute (callable): Not used, a collection has one path (see JumpPool)
+
+        Returns:
+            SSHTunnelingConnectionAgent: Connected tunnel instance to the end destination.
         """
 
-        # Validate if there is still a connection, drop it if there is.
-        if self.final_connection:
-            logging.warn("Still connected to final jump node, forcing disconnect!")
-            self.disconnect_jumpserver_final()
+        if self.multiplex:
+            return self.connect_jumpserver_multiplexed().open_forward(destination, port)
 
         # Connect to last jumpserver in the path
         jumpserver = self.path[-1]
@@ -268,8 +603,92 @@ class JumpCollection(object):
                                             port=self.local_port,
                                             password=password)
 
+        return current_connection
+
+    def connect_jumpserver_multiplexed(self):
+        """
+        Method to return the shared transport to the final jumpserver, (re)connecting if required.
+
+        Returns:
+            MultiplexedTunnelingConnectionAgent: Connected multiplexed transport instance.
+        """
+
+        with self.lock:
+            if self.multiplexed_connection and self.multiplexed_connection.is_active():
+                return self.multiplexed_connection
+
+            if self.multiplexed_connection:
+                logging.warn("Multiplexed connection to final jump node lost, reconnecting!")
+                self.multiplexed_connection.disconnect()
+
+            jumpserver = self.path[-1]
+            logging.debug("Connecting to final jump node {} (multiplexed)...".format(jumpserver))
+
+            password = None
+            if 'PASSWORD' in self.jump_settings[jumpserver]:
+                password = self.jump_settings[jumpserver]['PASSWORD']
+
+            if len(self.jumpserver_collection) < 1:
+                # First connection to direct host
+                server, port = jumpserver, self.jump_settings[jumpserver]['PORT']
+            else:
+                # Next hops via local loopback
+                server, port = self.loopback_address, self.local_port
+
+            self.multiplexed_connection = \
+                MultiplexedTunnelingConnectionAgent(server=server,
+                                                    username=self.jump_settings[jumpserver]['USERNAME'],
+                                                    ssh_pkey=self.jump_settings[jumpserver]['RSA_KEY_FILE'],
+                                                    port=port,
+                                                    password=password)
+
+            return self.multiplexed_connection
+
+    def scan_reachable(self, targets, timeout=5, max_parallel=32):
+        """
+        Method to check reachability of destinations from the final jumpserver.
+
+        Probes are channels opened concurrently over the shared transport to the final jumpserver, no
+        tunnel is set up per destination. Without multiplex the transport is closed after the scan, it
+        would hold a jumpserver session for the whole run.
+
+        Args:
+            targets (lst): List of (destination, port) tuples
+            timeout (int): Timeout in seconds per destination
+            max_parallel (int): Maximum number of probes in flight
+
+        Returns:
+            dict: (destination, port) as key and True if reachable else False
+        """
+
+        multiplexer = self.connect_jumpserver_multiplexed()
+        try:
+            return _run_probes(lambda target: multiplexer.probe(target[0], target[1], timeout=timeout),
+                               targets, max_parallel)
+        finally:
+            if not self.multiplex:
+                with self.lock:
+                    logging.debug("Terminating multiplexed connection to final jump node after scan!")
+                    multiplexer.disconnect()
+                    if self.multiplexed_connection is multiplexer:
+                        self.multiplexed_connection = None
+
+    def connect_jumpserver_final(self, destination, port):
+        """
+        Method required to open connection via final jumpserver to host.
+
+        Args:
+            port (int): Port for end destination (TCP only)
+            destination (basestring): String to destination address.
+        """
+
+        # Validate if there is still a connection, drop it if there is.
+        if self.final_connection:
+            logging.warn("Still connected to final jump node, forcing disconnect!")
+            self.disconnect_jumpserver_final()
+
         # Set final connectivity instance!
-        self.final_connection = current_connection
+        self.final_connection = self.open_final_connection(destination, port)
 
         return self.final_connection.local_port
 
@@ -278,7 +697,7 @@ class JumpCollection(object):
         Method terminate open connection to jumpservers.
         """
 
-        if isinstance(self.final_connection, SSHTunnelingConnectionAgent):
+        if self.final_connection:
             logging.debug("Terminating SSH tunnel to final host!")
             self.final_connection.disconnect()
             self.final_connection = None
@@ -290,15 +709,238 @@ class JumpCollection(object):
         Method terminate open connection to jumpservers.
         """
 
-        if isinstance(self.final_connection, SSHTunnelingConnectionAgent):
+        if self.final_connection:
             logging.warn("Still connected to final host!")
             self.disconnect_jumpserver_final()
 
+        if self.multiplexed_connection:
+            logging.debug("Terminating multiplexed connection to final jump node!")
+            self.multiplexed_connection.disconnect()
+            self.multiplexed_connection = None
+
         logging.debug("Terminating jumpserver connection chain!")
         for jumpserver in reversed(self.jumpserver_collection):
             jumpserver.disconnect()
 
 
+class PooledConnection(object):
+    """
+    Final connection handed out by a JumpPool, releasing its load on the jump path when disconnected.
+    """
+
+    def __init__(self, pool, member, connection):
+        self.pool = pool
+        self.member = member
+        self.connection = connection
+        self.local_port = connection.local_port
+
+    def disconnect(self):
+        try:
+            self.connection.disconnect()
+        finally:
+            self.pool.release(self.member)
+
+
+class JumpPool(object):
+    """
+    Pool of equivalent jumpserver chains. Final connections are spread over the healthy chains by load.
+    """
+
+    def __init__(self, paths, jumpserver_settings, multiplex=False, max_failures=3, retry_interval=60):
+        """
+        Class to maintain multiple JumpCollection instances with the same reach.
+
+        Args:
+            paths (lst): List of paths (list of strings) as used by JumpCollection.
+            jumpserver_settings (dict): Dictionary of jumpserver settings as used by JumpCollection.
+            multiplex (bool): Multiplex final connections per chain (see JumpCollection).
+            max_failures (int): Consecutive failures before a chain is marked down.
+            retry_interval (int): Seconds before a chain that is down is retried.
+        """
+
+        self.paths = paths
+        self.jump_settings = jumpserver_settings
+        self.multiplex = multiplex
+        self.max_failures = max_failures
+        self.retry_interval = retry_interval
+        self.loopback_address = '127.0.0.1'
+        self.lock = threading.Lock()  # Guards load and health counters.
+        self.connect_lock = threading.Lock()  # Serialises reconnects of jump paths.
+
+        # Pool members, one per path:
+        # - PATH: Path of jumpservers
+        # - COLLECTION: JumpCollection instance (None if not connected)
+        # - ACTIVE: Number of open final connections
+        # - TOTAL: Number of final connections opened
+        # - FAILURES: Consecutive failures
+        # - DOWN_UNTIL: Timestamp until chain is not used
+        self.members = []
+        for path in self.paths:
+            member = {'PATH': path, 'COLLECTION': None, 'ACTIVE': 0, 'TOTAL': 0, 'FAILURES': 0, 'DOWN_UNTIL': 0}
+            self._connect_member(member)
+            self.members.append(member)
+
+        if not [m for m in self.members if m['COLLECTION']]:
+            logging.critical("Cannot proceed without jumpservers! None of the jump paths could be connected.")
+            raise BaseSSHTunnelForwarderError("No jump path available")
+
+        logging.info("Connected {} of {} jump paths!".format(len([m for m in self.members if m['COLLECTION']]),
+                                                             len(self.members)))
+
+    def _connect_member(self, member):
+        try:
+            member['COLLECTION'] = JumpCollection(member['PATH'], self.jump_settings, multiplex=self.multiplex)
+            member['FAILURES'] = 0
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except BaseException as e:
+            logging.error("Could not connect jump path {}! ({})".format(' > '.join(member['PATH']), e))
+            member['COLLECTION'] = None
+            member['DOWN_UNTIL'] = time.time() + self.retry_interval
+
+    def _select(self, exclude):
+        # Least loaded chain which is up, retry chains that have been down long enough.
+        now = time.time()
+        with self.lock:
+            candidates = [m for m in self.members if m not in exclude and m['DOWN_UNTIL'] <= now]
+            if not candidates:
+                return None
+            member = min(candidates, key=lambda m: (m['ACTIVE'], m['TOTAL']))
+            member['ACTIVE'] += 1
+            member['TOTAL'] += 1
+            return member
+
+    def _failed(self, member):
+        with self.lock:
+            member['ACTIVE'] -= 1
+            member['FAILURES'] += 1
+            if member['FAILURES'] >= self.max_failures:
+                logging.warn("Jump path {} failed {} times, not used for {} seconds!".format(
+                    ' > '.join(member['PATH']), member['FAILURES'], self.retry_interval))
+                member['DOWN_UNTIL'] = time.time() + self.retry_interval
+
+    def release(self, member):
+        with self.lock:
+            member['ACTIVE'] -= 1
+
+    def final_jumpservers(self):
+        """
+        Final jumpservers end destinations are connected through.
+
+        Returns:
+            lst: Final jumpservers of all paths (unique)
+        """
+
+        jumpservers = []
+        for path in self.paths:
+            if path[-1] not in jumpservers:
+                jumpservers.append(path[-1])
+        return jumpservers
+
+    def open_final_connection(self, destination, port, via=None, reroute=None):
+        """
+        Method required to open a new connection via the least loaded healthy jump path to host.
+
+        Args:
+            port (int): Port for end destination (TCP only)
+            destination (basestring): String to destination address.
+            via (basestring): Final jumpserver to connect through, other paths are used only if
+            no path via this jumpserver is available (optional)
+            reroute (callable): Called with the final jumpserver of another path before it is used,
+            the path is skipped if it returns False (e.g. Governor.transfer of the session, optional)
+
+        Returns:
+            PooledConnection: Connected tunnel instance to the end destination.
+        """
+
+        tried = []
+        fallback = False
+        if via is not None:
+            # Paths via other final jumpservers are excluded until all paths via the given one failed.
+            tried = [m for m in self.members if m['PATH'][-1] != via]
+        while True:
+            member = self._select(tried)
+            if member is None and not fallback and via is not None:
+                logging.warn("No jump path via {} available to {}, trying other paths!".format(via, destination))
+                tried = [m for m in self.members if m['PATH'][-1] == via]
+                fallback = True
+                continue
+            if member is None:
+                raise BaseSSHTunnelForwarderError("No jump path available to {}:{}".format(destination, port))
+            tried.append(member)
+
+            if fallback and reroute is not None and not reroute(member['PATH'][-1]):
+                logging.warn("No session available via {}, skipping path {}!".format(
+                    member['PATH'][-1], ' > '.join(member['PATH'])))
+                self.release(member)
+                continue
+
+            try:
+                with self.connect_lock:
+                    if member['COLLECTION'] is None:
+                        self._connect_member(member)
+                if member['COLLECTION'] is None:
+                    raise BaseSSHTunnelForwarderError("Jump path not connected")
+
+                connection = member['COLLECTION'].open_final_connection(destination, port)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException as e:
+                logging.warn("Could not connect to {} via {}, trying next path! ({})".format(
+                    destination, ' > '.join(member['PATH']), e))
+                self._failed(member)
+                continue
+
+            member['FAILURES'] = 0
+            logging.debug("Connecting to {} via {}...".format(destination, ' > '.join(member['PATH'])))
+            return PooledConnection(self, member, connection)
+
+    def scan_reachable(self, targets, timeout=5, max_parallel=32):
+        """
+        Method to check reachability of destinations via the connected jump paths.
+
+        Destinations not reachable via the first path are probed again via the next paths.
+
+        Args:
+            targets (lst): List of (destination, port) tuples
+            timeout (int): Timeout in seconds per destination
+            max_parallel (int): Maximum number of probes in flight per path
+
+        Returns:
+            dict: (destination, port) as key and True if reachable via any path else False
+        """
+
+        result = dict((target, False) for target in targets)
+        for member in self.members:
+            remaining = [target for target in result if not result[target]]
+            if not remaining:
+                break
+            if member['COLLECTION'] is None:
+                continue
+
+            try:
+                probed = member['COLLECTION'].scan_reachable(remaining, timeout=timeout, max_parallel=max_parallel)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException as e:
+                logging.warn("Could not scan via {}! ({})".format(' > '.join(member['PATH']), e))
+                continue
+
+            result.update(probed)
+
+        return result
+
+    def disconnect_jumpserver_chain(self):
+        """
+        Method terminate open connection to all jump paths.
+        """
+
+        for member in self.members:
+            if member['COLLECTION']:
+                member['COLLECTION'].disconnect_jumpserver_chain()
+                member['COLLECTION'] = None
+
+
 class ConnectionHandler(object):
     """
     ConnectionHandler for universal connection responses for pExpect in this module.
@@ -348,7 +990,10 @@ class TunnelConnectionAgent(object):
                  client_connection_type='SSH',
                  timeout=10,
                  shell='/bin/bash',
-                 jumpservers=None):
+                 jumpservers=None,
+                 history=None,
+                 metrics=None,
+                 transcripts=None):
         """
         Connection Manager for managing connections. (Via Jumpnode (Tunnel mode))
 
@@ -367,7 +1012,11 @@ class TunnelConnectionAgent(object):
             timeout (int): Variable for current timeout value (seconds)
             client_connection_type (basestring): Default connection type [SSH or TELNET]
             shell (basestring): Shell command (future use)
-            jumpservers (object): Jumpserver instance
+            jumpservers (object): Jumpserver instance (JumpCollection or JumpPool)
+            history (object): TimingHistory instance, timeouts for login and commands are derived from
+            earlier durations of the host and durations are recorded (optional, timeout used if not set)
+            metrics (object): Metrics instance recording tunnel, login and command phases (optional)
+            transcripts (object): TranscriptStore recording a transcript of every session (optional)
         """
 
         self.prompt = pexpect.spawn  # PEXPECT Class definition for prompt.
@@ -376,11 +1025,11 @@ class TunnelConnectionAgent(object):
         # Jump settings
         self.jumpservers = JumpCollection
 
-        if isinstance(jumpservers, JumpCollection):
+        if isinstance(jumpservers, (JumpCollection, JumpPool)):
             self.jumpservers = jumpservers
         else:
             logging.error("Wrong Jumpserver type! (should be "
-                          "lib.ConnectionManager.JumpCollection or None)")
+                          "lib.ConnectionManager.JumpCollection or lib.ConnectionManager.JumpPool)")
             raise
 
         # Environmental settings
@@ -388,6 +1037,10 @@ class TunnelConnectionAgent(object):
         self.ssh_command = ssh_command
         self.telnet_command = telnet_command
         self.timeout = timeout
+        self.history = history
+        self.metrics = metrics
+        self.transcripts = transcripts
+        self.transcript = None  # Transcript of the current session.
 
         # Connection types
         self.allowed_connection_types = ['SSH', 'TELNET']
@@ -400,8 +1053,14 @@ class TunnelConnectionAgent(object):
         # Connected state
         self.connected = False
         self.connected_host = None
+        self.final_connection = None  # Tunnel instance to the end node, owned by this agent.
+
+        self.history_host = None  # Timing history key of the device being connected (device name).
+
+        # Exact prompts learned at login, per agent so workers do not share state. Host -> prompts.
+        self.learned_prompts = {}
 
-    def connect(self, host, connection_protocol=None, port=None):
+    def connect(self, host, connection_protocol=None, port=None, via=None, name=None, reroute=None):
         """
         Connection method to connect to end node.
 
@@ -409,12 +1068,17 @@ class TunnelConnectionAgent(object):
             port (int): Port number (TCP)
             connection_protocol (basestring): Protocol for connectivity to end host. (SSH or Telnet) (Default on init)
             host (basestring): Hostname for documentation purposes (logging)
+            via (basestring): Final jumpserver to connect through (optional, see JumpPool)
+            name (basestring): Device name, key of login durations in the timing history (Default: host)
+            reroute (callable): Called before connecting through another final jumpserver than via
+            (optional, see JumpPool)
 
         Returns:
             bool: Connection status
         """
 
         logging.debug("Trying to connect to end node ({})...".format(host))
+        self.history_host = name or host
 
         # Check for current connectivity and disconnect if connected.
         if self.connected:
@@ -441,12 +1105,14 @@ class TunnelConnectionAgent(object):
                 port = 22
 
             # First setup final SSH tunnel connection.
-            self.jumpservers.connect_jumpserver_final(host, port)
+            self.final_connection = self.open_final_connection(host, port, via=via, reroute=reroute)
 
             # Create PEXPECT instance after login with SSH.
+            started = time.time()
             status = self.ssh_connection(self.jumpservers.loopback_address,
-                                         port=self.jumpservers.final_connection.local_port,
+                                         port=self.final_connection.local_port,
                                          am_host_ref=host)
+            self.record_metric(MetricsManager.LOGIN, started, host, error=status > 101)
 
         elif connection_protocol == 'TELNET':
             # Port settings, fallback to default (23) if not set.
@@ -454,12 +1120,14 @@ class TunnelConnectionAgent(object):
                 port = 23
 
             # First setup final SSH tunnel connection.
-            self.jumpservers.connect_jumpserver_final(host, port)
+            self.final_connection = self.open_final_connection(host, port, via=via, reroute=reroute)
 
             # Create PEXPECT instance after login with TELNET.
+            started = time.time()
             status = self.telnet_connection(self.jumpservers.loopback_address,
-                                            port=self.jumpservers.final_connection.local_port,
+                                            port=self.final_connection.local_port,
                                             am_host_ref=host)
+            self.record_metric(MetricsManager.LOGIN, started, host, error=status > 101)
 
         # No other connection type yet.
         else:
@@ -480,11 +1148,112 @@ class TunnelConnectionAgent(object):
         """
 
         self.prompt.close() # Close PEXPECT first
-        self.jumpservers.disconnect_jumpserver_final() # Close SSH tunnel
+        self.close_transcript()
+
+        # Close SSH tunnel
+        if self.final_connection:
+            self.final_connection.disconnect()
+            self.final_connection = None
+        else:
+            logging.debug("Already disconnected from end node.")
+
         # Reset connected state
         self.connected = False
         self.connected_host = None
 
+    def get_timeout(self, host, key):
+        """
+        Timeout for login or command on host, derived from timing history if available.
+
+        Args:
+            host (basestring): Host reference
+            key (basestring): Command or TimingManager.LOGIN
+        """
+
+        if self.history is None:
+            return self.timeout
+        return self.history.timeout(host, key, self.timeout)
+
+    def record_timing(self, host, key, duration):
+        if self.history is not None:
+            self.history.record(host, key, duration)
+
+    def record_metric(self, phase, started, host, key=None, size=0, error=False):
+        if self.metrics is not None:
+            self.metrics.record(phase, time.time() - started, host=host, key=key, size=size, error=error)
+
+    def start_transcript(self, child, host, command, password):
+        """
+        Record the session of a spawned PEXPECT instance if transcripts are enabled.
+
+        Args:
+            child (object): PEXPECT spawn instance
+            host (basestring): Host reference
+            command (basestring): Command spawned
+            password (basestring): Password masked in the transcript
+        """
+
+        if self.transcripts is not None:
+            self.transcript = self.transcripts.open(host, command=command, secrets=[password])
+            self.transcript.attach(child)
+
+    def record_match(self, response, matched):
+        if self.transcript is not None:
+            self.transcript.match(response, matched)
+
+    def record_command(self, command, started, size=0, ok=True):
+        if self.transcript is not None:
+            self.transcript.command(command, time.time() - started, size, ok)
+
+    def close_transcript(self):
+        if self.transcript is not None:
+            self.transcript.close()
+            self.transcript = None
+
+    def open_final_connection(self, host, port, via=None, reroute=None):
+        """
+        Open the final tunnel to host via the jumpservers, recorded as tunnel phase.
+        """
+
+        started = time.time()
+        try:
+            connection = self.jumpservers.open_final_connection(host, port, via=via, reroute=reroute)
+        except Exception:
+            self.record_metric(MetricsManager.TUNNEL, started, host, error=True)
+            raise
+        self.record_metric(MetricsManager.TUNNEL, started, host)
+        return connection
+
+    def learn_prompt(self, host, matched):
+        """
+        Learn the exact prompt of host from the prompt matched at login.
+
+        Args:
+            host (basestring): Host reference
+            matched (basestring): Text matched by the generic prompt pattern (e.g. '\\nR1#')
+        """
+
+        name = matched.strip()[:-1]
+        self.learned_prompts[host] = ['\n{}#'.format(name), '\n{}>'.format(name)]
+        logging.debug("Learned prompt {}# for {}!".format(name, host))
+
+    def get_command_prompts(self, host):
+        """
+        Prompts ending the output of a command on host.
+
+        Args:
+            host (basestring): Host reference
+
+        Returns:
+            tuple: List of prompts (pexpect.TIMEOUT and pexpect.EOF at index 2 and 3) and True if
+            prompts are exact strings, False if generic regular expressions (prompt not learned).
+        """
+
+        if host in self.learned_prompts:
+            return self.learned_prompts[host] + [pexpect.TIMEOUT, pexpect.EOF], True
+
+        return ['\n\w+#', '\n\w+>', pexpect.TIMEOUT, pexpect.EOF], False
+
     def telnet_connection(self, host, port=23, am_host_ref=None):
         """
         Function to setup Telnet connection.
@@ -515,8 +1284,13 @@ class TunnelConnectionAgent(object):
         # Not connected status. For connection method.
         status = 200
 
+        # Login timeout and timing.
+        timeout = self.get_timeout(self.history_host, LOGIN)
+        started = time.time()
+
         # Create spawn instance for PEXPECT.
-        prompt = pexpect.spawn(conn, timeout=self.timeout)
+        prompt = pexpect.spawn(conn, timeout=timeout)
+        self.start_transcript(prompt, am_host_ref, conn, password)
 
         # Possible prompt returns
         prompts = [
@@ -530,7 +1304,8 @@ class TunnelConnectionAgent(object):
 
         # User prompt handeling
         logging.debug("Pending user prompt...")
-        response = prompt.expect(prompts, timeout=self.timeout);
+        response = prompt.expect(prompts, timeout=timeout);
+        self.record_match(response, prompt.after)
         if response == 0:
             logging.debug("Sending username! ({})".format(user))
             prompt.sendline(user);
@@ -543,7 +1318,8 @@ class TunnelConnectionAgent(object):
         # Password handeling, only continue on user send.
         if status == 100:
             logging.debug("Pending password prompt!")
-            response = prompt.expect(prompts, timeout=self.timeout);
+            response = prompt.expect(prompts, timeout=timeout);
+            self.record_match(response, prompt.after)
             if response == 1 and status == 100:
                 logging.debug("Sending password!")
                 prompt.sendline(password);
@@ -556,14 +1332,20 @@ class TunnelConnectionAgent(object):
         # Prompt handeling, only continue on password send.
         if status == 100:
             logging.debug("Pending Prompt!")
-            response = prompt.expect(prompts, timeout=self.timeout);
+            response = prompt.expect(prompts, timeout=timeout);
+            self.record_match(response, prompt.after)
             if response == 2 and status == 100:
                 logging.debug("Prompt detected!")
                 status = 100
+                self.learn_prompt(am_host_ref, prompt.after)
+                self.record_timing(self.history_host, LOGIN, time.time() - started)
             else:
                 logging.warn("No prompt, exiting for this node. (Line:{})".format(prompt.before))
                 status = 200
 
+        if response == 4:
+            self.record_timing(self.history_host, LOGIN, timeout)
+
         self.prompt = prompt
 
         return status
@@ -599,8 +1381,13 @@ class TunnelConnectionAgent(object):
         # Not connected status. For connection method.
         status = 200
 
+        # Login timeout and timing.
+        timeout = self.get_timeout(self.history_host, LOGIN)
+        started = time.time()
+
         # Create spawn instance for PEXPECT.
-        prompt = pexpect.spawn(conn, timeout=self.timeout)
+        prompt = pexpect.spawn(conn, timeout=timeout)
+        self.start_transcript(prompt, am_host_ref, conn, password)
 
         # Possible prompt returns
         prompts = [
@@ -614,7 +1401,8 @@ class TunnelConnectionAgent(object):
 
         # Password handeling.
         logging.debug("Pending password prompt!")
-        response = prompt.expect(prompts, timeout=self.timeout);
+        response = prompt.expect(prompts, timeout=timeout);
+        self.record_match(response, prompt.after)
         if response == 1:
             logging.debug("Sending password!")
             prompt.sendline(password);
@@ -627,14 +1415,20 @@ class TunnelConnectionAgent(object):
         # Prompt handeling, only continue on password send.
         if status == 100:
             logging.debug("Pending Prompt!")
-            response = prompt.expect(prompts, timeout=self.timeout);
+            response = prompt.expect(prompts, timeout=timeout);
+            self.record_match(response, prompt.after)
             if response == 2 and status == 100:
                 logging.debug("Prompt detected!")
                 status = 100
+                self.learn_prompt(am_host_ref, prompt.after)
+                self.record_timing(self.history_host, LOGIN, time.time() - started)
             else:
                 logging.warn("No prompt, exiting for this node. (Line:{})".format(prompt.before))
                 status = 200
 
+        if response == 4:
+            self.record_timing(self.history_host, LOGIN, timeout)
+
         self.prompt = prompt
 
         return status
@@ -650,48 +1444,28 @@ class TunnelConnectionAgent(object):
         logging.debug('Setting unlimit Terminal length!')
         self.send_command(host, 'terminal length 0', allow_more_show=True)
 
-    def send_command(self, host, command, allow_more_show=False):
+    def send_command(self, host, command, allow_more_show=False, timeout=None):
         """
         Function to send command. Validation for 'show'-commands prior to execution.
 
         Args:
-            host (basestring): Hostname for documentation
+            host (basestring): Hostname for documentation and timing history
             command (basestring): Command to send to node
             allow_more_show (bool): Validation for 'show'-commands only.
+            timeout (int): Timeout for the command (Default: derived from timing history or timeout)
         """
 
         # RegEx searcher for "show"-commands.
         search_show = re.search(r'show\s\w*', command)
 
-        # Possible prompt returns
-        prompts = [
-            '\n\w+#',
-            '\n\w+>',
-            pexpect.TIMEOUT,
-            pexpect.EOF
-        ]
-
         # Check for valid 'show'-command and overwrite if allowed
         # Check if correct prompt is pending for command!
         if (allow_more_show or search_show) and self.connected:
 
             self.prompt.sendline(command)
             logging.debug("Executing \"{}\" on {}... ".format(command, self.connected_host))
-            logging.debug("Pending for prompt...")
-
-            response = self.prompt.expect(prompts, timeout=self.timeout)
 
-            if response == 0 or response == 1:
-                logging.debug("Command executed! Return output!")
-                return self.connected, self.prompt.before
-            else:
-                if response == 2:
-                    logging.warning("Response timed out, consider increasing time out value in setting file!")
-                logging.critical("Undesired response! Disconnecting from host ({})!".format(self.connected_host))
-                self.disconnect()
-                # Return error value for analyses.
-                return self.connected, "Error: Disconnected from host by response error. " \
-                       "(No prompt)\nLast output:\n{}\nPexpect status:\n{}".format(self.prompt.before, self.prompt)
+            return self.wait_output(host, command, timeout)
         else:
             # Correct warning displays
             if not self.connected:
@@ -703,6 +1477,98 @@ class TunnelConnectionAgent(object):
                 logging.warn(warning)
             return self.connected, None
 
+    def send_commands(self, host, commands, allow_more_show=False):
+        """
+        Function to send a batch of commands in a single write (pipelining). Output is split per command
+        on the prompts returned by the node. Validation for 'show'-commands prior to execution.
+
+        Output is equal to sending the commands one by one with send_command, but the round trip to the
+        node is paid once per batch instead of once per command.
+
+        Args:
+            host (basestring): Hostname for documentation and timing history
+            commands (lst): Commands to send to node
+            allow_more_show (bool): Validation for 'show'-commands only.
+
+        Returns:
+            tuple: Connection status and list of output per command (None if not executed)
+        """
+
+        outputs = [None] * len(commands)
+
+        batch = []
+        for index, command in enumerate(commands):
+            if allow_more_show or re.search(r'show\s\w*', command):
+                batch.append(index)
+            else:
+                logging.warn("Command \"{}\" has not been executed! This is no \"show\"-command."
+                             "Make sure you execute fully typed show commands.".format(command))
+
+        if not self.connected:
+            logging.debug("Not connected ({})! Skipping commands ({}) check!".format(host, len(commands)))
+            return self.connected, outputs
+
+        if not batch:
+            return self.connected, outputs
+
+        self.prompt.send(''.join(commands[index] + os.linesep for index in batch))
+        logging.debug("Executing {} commands on {}... ".format(len(batch), self.connected_host))
+
+        for index in batch:
+            connected, outputs[index] = self.wait_output(host, commands[index])
+            if not connected:
+                break
+
+        return self.connected, outputs
+
+    def wait_output(self, host, command, timeout=None):
+        """
+        Function to wait for the prompt after a command is sent and return its output.
+
+        Args:
+            host (basestring): Hostname for documentation and timing history
+            command (basestring): Command sent to node
+            timeout (int): Timeout for the command (Default: derived from timing history or timeout)
+
+        Returns:
+            tuple: Connection status and output (error text if disconnected)
+        """
+
+        # Possible prompt returns, the exact prompt learned at login if available.
+        prompts, exact = self.get_command_prompts(self.connected_host)
+
+        if timeout is None:
+            timeout = self.get_timeout(host, command)
+
+        logging.debug("Pending for prompt ({}s)...".format(timeout))
+
+        started = time.time()
+        if exact:
+            # Searches only new data and the length of the prompt before it on each read.
+            response = self.prompt.expect_exact(prompts, timeout=timeout)
+        else:
+            response = self.prompt.expect(prompts, timeout=timeout)
+        self.record_match(response, self.prompt.after)
+
+        if response == 0 or response == 1:
+            logging.debug("Command executed! Return output!")
+            self.record_timing(host, command, time.time() - started)
+            self.record_metric(MetricsManager.COMMAND, started, self.connected_host, key=command,
+                               size=len(self.prompt.before))
+            self.record_command(command, started, len(self.prompt.before))
+            return self.connected, self.prompt.before
+        else:
+            self.record_metric(MetricsManager.COMMAND, started, self.connected_host, key=command, error=True)
+            self.record_command(command, started, ok=False)
+            if response == 2:
+                logging.warning("Response timed out after {}s, consider increasing time out value in "
+                                "setting file!".format(timeout))
+                self.record_timing(host, command, timeout)
+            logging.critical("Undesired response! Disconnecting from host ({})!".format(self.connected_host))
+            self.disconnect()
+            # Return error value for analyses.
+            return self.connected, "Error: Disconnected from host by response error. " \
+                   "(No prompt)\nLast output:\n{}\nPexpect status:\n{}".format(self.prompt.before, self.prompt)
 
 # noinspection PyArgumentList,PyCallByClass,PyTypeChecker,PyUnresolvedReferences
 class ConnectionAgent(object):
@@ -3,7 +3,10 @@
 Database Manager library for managing database.
 """
 
+import contextlib
 import logging
+import threading
+import time
 import mysql.connector
 
 __author__ = "Thomas Jongerius"
@@ -15,12 +18,141 @@ __maintainer__ = "Thomas Jongerius"
 __email__ = "thomasjongerius@yaworks.nl"
 __status__ = "Development"
 
+class ConnectionPool(object):
+    """
+    Pool of database connections shared by threads.
+    """
+
+    def __init__(self, connect, max_size=4, health_check_interval=30, checkout_timeout=None):
+        """
+        Pool handing out connections for exclusive use until returned.
+
+        Args:
+        @callable connect: function returning a new connection
+        @int max_size: maximum number of open connections
+        @int health_check_interval: seconds a connection may be idle before it is checked on checkout
+        @int checkout_timeout: seconds to wait for a free connection, None to wait forever
+        """
+
+        self.connect = connect
+        self.max_size = max(1, max_size)
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.idle = []  # (connection, returned timestamp)
+        self.size = 0  # Open connections, idle and checked out.
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def checkout(self):
+        """
+        Take a connection from the pool, opening a new one if none is idle and the pool is not full.
+
+        Returns:
+        @obj: connection, must be returned with checkin
+        """
+
+        deadline = None if self.checkout_timeout is None else time.time() + self.checkout_timeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise RuntimeError('Connection pool is closed!')
+                if self.idle:
+                    connection, returned = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    connection, returned = None, None
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError('No database connection available within {} seconds!'.format(
+                        self.checkout_timeout))
+                self.condition.wait(remaining)
+
+        # Connecting and health checks outside of the lock, other threads keep using the pool.
+        try:
+            if connection is not None and time.time() - returned > self.health_check_interval:
+                if not connection.is_connected():
+                    logging.warn('Dropping broken database connection!')
+                    self._close(connection)
+                    connection = None
+            if connection is None:
+                connection = self.connect()
+                logging.debug('Opened database connection ({} in pool)'.format(self.size))
+        except Exception:
+            self._release_slot()
+            raise
+
+        return connection
+
+    def checkin(self, connection, discard=False):
+        """
+        Return a connection to the pool.
+
+        Args:
+        @obj connection: connection from checkout
+        @bool discard: close the connection instead of reusing it (e.g. after an error)
+        """
+
+        if discard or self.closed:
+            self._close(connection)
+            self._release_slot()
+            return
+
+        with self.condition:
+            self.idle.append((connection, time.time()))
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Connection checked out for the duration of a with-block, discarded if the block raised
+        (or a generator using it was closed early).
+        """
+
+        connection = self.checkout()
+        try:
+            yield connection
+        except BaseException:
+            self.checkin(connection, discard=True)
+            raise
+        self.checkin(connection)
+
+    def close(self):
+        """
+        Close idle connections, checked out connections are closed when returned.
+        """
+
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+
+        for connection, _ in idle:
+            self._close(connection)
+            self._release_slot()
+
+    def _release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logging.debug('Could not close database connection cleanly! %r' % e)
+
+
 class DatbaseManager(object):
     """
     Database manager.
     """
 
-    def __init__(self, database=None, user=None, password=None, sql_server='127.0.0.1'):
+    def __init__(self, database=None, user=None, password=None, sql_server='127.0.0.1', batch_size=100,
+                 commit_interval=10, pool_size=4):
         # type: (obj, str, str, str, int, str, lst, int) -> obj
         """
         Database manager for managing connectivity and queries to MySQL database.
@@ -30,6 +162,9 @@ class DatbaseManager(object):
         @str password: password for database
         @str user: username for database
         @str database: database name
+        @int batch_size: rows per bulk statement when saving output
+        @int commit_interval: bulk statements per commit when saving output
+        @int pool_size: maximum number of connections used by concurrent threads
         """
 
         self.connected = False
@@ -37,86 +172,208 @@ class DatbaseManager(object):
         self.database = database
         self.database_user = user
         self.database_password = password
-        self.connector = mysql.connector.connect()
+        self.batch_size = max(1, batch_size)
+        self.commit_interval = max(1, commit_interval)
+        self.pool_size = pool_size
+        self.pool = None
+        self.lock = threading.Lock()
 
     def disconnect(self):
-        self.connector.close()
-        self.connected = False
+        with self.lock:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
+            self.connected = False
         logging.debug('Disconnected from database!')
 
+    def _new_connection(self):
+        return mysql.connector.connect(host=self.sql_server,
+                                       user=self.database_user,
+                                       password=self.database_password,
+                                       database=self.database)
+
     def connect(self):
-        if self.connected:
-            logging.warn('Already connected to DB, close connection first prior to opening new connection!')
-        elif self.sql_server and self.database and self.database_user and self.database_password:
-            try:
-                self.connector = mysql.connector.connect(host=self.sql_server,
-                                                         user=self.database_user,
-                                                         password=self.database_password,
-                                                         database=self.database)
+        with self.lock:
+            if self.connected:
+                logging.warn('Already connected to DB, close connection first prior to opening new connection!')
+            elif self.sql_server and self.database and self.database_user and self.database_password:
+                pool = ConnectionPool(self._new_connection, max_size=self.pool_size)
+                try:
+                    # Validate settings with a first connection, kept in the pool.
+                    pool.checkin(pool.checkout())
+                except Exception as e:
+                    logging.error('*** Failed to connect to %s! %r' % (self.sql_server, e))
+                    raise
+                self.pool = pool
                 self.connected = True
                 logging.debug('Now connected to {} ({})'.format(self.sql_server, self.database))
-
-            except Exception as e:
-                logging.error('*** Failed to connect to %s! %r' % (self.sql_server, e))
+            else:
+                logging.error('Not all required database settings are loaded! Cannot connect!')
                 raise
-        else:
-            logging.error('Not all required database settings are loaded! Cannot connect!')
-            raise
 
-    def get_device_list(self):
+    def get_device_list(self, site=None, role=None, collected_before=None, shard=None):
+        """
+        Device list as dict by device identifier (see iter_devices for filters).
+        """
+
+        devices = dict(self.iter_devices(site=site, role=role, collected_before=collected_before, shard=shard))
+
+        logging.debug('Received {} devices!'.format(str(len(devices))))
+
+        return devices
+
+    def iter_devices(self, site=None, role=None, collected_before=None, shard=None, page_size=1000):
+        """
+        Stream devices from the database, filtered by the database server.
+
+        Devices are read in pages of page_size devices ordered by deviceid (keyset pagination), the
+        connection is returned to the pool between pages so no cursor stays open during a run.
+
+        Args:
+        @str site: only devices of this site (devices.site)
+        @str role: only devices with this role (devices.role)
+        @str collected_before: only devices without output at or after this timestamp
+        @tuple shard: (index, count), only devices with deviceid modulo count equal to index
+        @int page_size: devices read per query
+
+        Returns:
+        @iter: (deviceid, device) tuples, device with NAME, IP, PROTOCOL and SITE/ROLE if set
+        """
+
         # Check for connection to DB.
         if not self.connected:
             self.connect()
 
-        # Open DB cursor
-        cursor = self.connector.cursor()
-        query = ("SELECT deviceid, name, ip, protocol FROM devices")
+        query = "SELECT deviceid, name, ip, protocol, site, role FROM devices"
+        conditions = []
+        params = []
+        if site is not None:
+            conditions.append("site = %s")
+            params.append(site)
+        if role is not None:
+            conditions.append("role = %s")
+            params.append(role)
+        if collected_before is not None:
+            conditions.append("NOT EXISTS (SELECT 1 FROM output WHERE output.deviceid = devices.deviceid "
+                              "AND output.timestamp >= %s)")
+            params.append(collected_before)
+        if shard is not None:
+            conditions.append("MOD(deviceid, %s) = %s")
+            params.extend([shard[1], shard[0]])
+
         logging.debug('Retrieving device list from DB ({})...'.format(query))
-        cursor.execute(query)
+        last = None
+        while True:
+            # Next page after the last device read.
+            page_conditions = conditions if last is None else conditions + ["deviceid > %s"]
+            page_params = params if last is None else params + [last]
+            page_query = query
+            if page_conditions:
+                page_query += " WHERE " + " AND ".join(page_conditions)
+            page_query += " ORDER BY deviceid LIMIT %s"
 
+            with self.pool.connection() as connector:
+                cursor = connector.cursor()
+                try:
+                    cursor.execute(page_query, page_params + [page_size])
+                    page = cursor.fetchall()
+                finally:
+                    cursor.close()
 
-        # Put data into dict
-        devices = {}
-        for (deviceid, name, ip, protocol) in cursor:
-            devices[deviceid] = {'NAME': name,
-                                 'IP': ip,
-                                 'PROTOCOL': protocol}
+            for (deviceid, name, ip, protocol, device_site, device_role) in page:
+                device = {'NAME': name,
+                          'IP': ip,
+                          'PROTOCOL': protocol}
+                if device_site is not None:
+                    device['SITE'] = device_site
+                if device_role is not None:
+                    device['ROLE'] = device_role
+                yield deviceid, device
 
-        logging.debug('Received {} devices!'.format(str(len(devices))))
+            if len(page) < page_size:
+                break
+            last = page[-1][0]
 
-        # Close cursor
-        cursor.close()
+    def save_command_output(self, data):
+        """
+        Save command output in bulk.
 
-        return devices
+        Rows are sent with parameterised multi-row statements of batch_size rows, committed every
+        commit_interval statements and at the end. Output is stored as collected.
+
+        Args:
+        @dict data: output by device identifier and command, each with OUTPUT, NAME and TIMESTAMP
+        """
 
-    def save_command_output(self, data):
         # Check for connection to DB.
         if not self.connected:
             self.connect()
 
-        # Open DB cursor
-        cursor = self.connector.cursor()
+        rows = ((deviceid, command, data[deviceid][command]['TIMESTAMP'], data[deviceid][command]['OUTPUT'])
+                for deviceid in data for command in data[deviceid])
+
+        return self.save_rows(rows)
 
-        # Prepare base query
-        add_output = ("REPLACE INTO `output` "
+    def save_rows(self, rows):
+        """
+        Save rows of command output in bulk (see save_command_output).
+
+        Args:
+        @iter rows: iterable of (deviceid, command, timestamp, output) tuples
+
+        Returns:
+        @int: number of rows saved
+        """
+
+        # Check for connection to DB.
+        if not self.connected:
+            self.connect()
+
+        # Prepare base query, an upsert as multi-row statements are only built for INSERT.
+        add_output = ("INSERT INTO `output` "
                       "(`deviceid`, `command`, `timestamp`, `output`) "
-                      "VALUES ({}, '{}', '{}', '{}')")
-
-        # Send query per command
-        for deviceid in data:
-            for command in data[deviceid]:
-                query = add_output.format(deviceid, command,
-                                          data[deviceid][command]['TIMESTAMP'],
-                                          str(data[deviceid][command]['OUTPUT']).replace("'", '"'))
-                # Insert data
-                cursor.execute(query)
-                logging.debug('Sending command data ({}) for {} to DB...'.format(command,
-                                                                                 data[deviceid][command]['NAME']))
-
-        # Make sure data is committed to the database
-        self.connector.commit()
-        logging.debug('Commit data to database!')
-
-        # Close cursor
-        cursor.close()
+                      "VALUES (%s, %s, %s, %s) "
+                      "ON DUPLICATE KEY UPDATE `timestamp` = VALUES(`timestamp`), `output` = VALUES(`output`)")
+
+        total = 0
+        batches = 0
+        batch = []
+        with self.pool.connection() as connector:
+            # Open DB cursor
+            cursor = connector.cursor()
+            try:
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) < self.batch_size:
+                        continue
+
+                    # Insert data
+                    cursor.executemany(add_output, batch)
+                    total += len(batch)
+                    batches += 1
+                    batch = []
+
+                    if batches % self.commit_interval == 0:
+                        connector.commit()
+                        logging.debug('Commit {} rows to database!'.format(total))
+
+                if batch:
+                    cursor.executemany(add_output, batch)
+                    total += len(batch)
+
+                # Make sure data is committed to the database
+                connector.commit()
+                logging.debug('Commit data to database! ({} rows)'.format(total))
+            except Exception as e:
+                # Uncommitted rows are rolled back, the connection is discarded by the pool.
+                logging.error('*** Failed to save output to {}! {!r}'.format(self.sql_server, e))
+                try:
+                    connector.rollback()
+                except mysql.connector.Error as rollback_error:
+                    logging.warn('Rollback on {} failed! {!r}'.format(self.sql_server, rollback_error))
+                raise
+            finally:
+                # Close cursor
+                cursor.close()
 
+        return total
@@ -0,0 +1,741 @@
+#!/usr/bin/env python -tt
+"""
+Event driven Connection Manager library for managing many connections to hosts from a single thread.
+
+Sessions are driven by a SessionLoop polling the PEXPECT child file descriptors. Connection methods
+are generator based coroutines, yielding instructions to the loop:
+
+    - Expect(session, patterns, timeout, exact): wait for one of the patterns, resumes with the index.
+    - Call(function, *args): run a blocking function in the executor, resumes with the return value.
+    - Sleep(seconds): resume after a delay without blocking the loop.
+    - Return(value): finish the current coroutine with a return value.
+    - Another coroutine: run it to completion, resumes with its return value.
+"""
+
+import collections
+import heapq
+import logging
+import os
+import re
+import select
+import sys
+import threading
+import time
+import types
+import Queue
+import pexpect
+import MetricsManager
+from ConnectionManager import TunnelConnectionAgent
+from TimingManager import LOGIN
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+class Expect(object):
+    """
+    Instruction to wait for one of the patterns on a session.
+    """
+
+    def __init__(self, session, patterns, timeout, exact=False, searchwindowsize=None):
+        """
+        Args:
+            session (object): Session instance to wait on
+            patterns (lst): List of regular expressions (or strings if exact), pexpect.TIMEOUT or pexpect.EOF
+            timeout (int): Seconds to wait for a pattern
+            exact (bool): Patterns are plain strings, only new data and the overlap of the longest
+            string are searched on each read
+            searchwindowsize (int): Search only new data and this many bytes before it (regular expressions)
+        """
+
+        self.session = session
+        self.patterns = []
+        self.timeout_index = None
+        self.eof_index = None
+        self.deadline = time.time() + timeout
+        self.window = searchwindowsize  # Bytes of searched data searched again, None for all.
+        self.scanned = 0  # Buffer size at last search without match.
+
+        for index, pattern in enumerate(patterns):
+            if pattern is pexpect.TIMEOUT:
+                self.timeout_index = index
+            elif pattern is pexpect.EOF:
+                self.eof_index = index
+            elif exact:
+                self.patterns.append((index, re.compile(re.escape(pattern))))
+            else:
+                self.patterns.append((index, re.compile(pattern)))
+
+        if exact:
+            self.window = max([len(pattern.pattern) for _, pattern in self.patterns] or [1]) - 1
+
+
+class Call(object):
+    """
+    Instruction to run a blocking function outside of the event loop.
+    """
+
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Sleep(object):
+    """
+    Instruction to resume a coroutine after a delay.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Return(object):
+    """
+    Instruction to finish a coroutine with a return value.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class Session(object):
+    """
+    Non-blocking wrapper around a PEXPECT spawn instance.
+    """
+
+    def __init__(self, command, timeout=10):
+        """
+        Args:
+            command (basestring): Command to spawn
+            timeout (int): Default timeout for PEXPECT instance
+        """
+
+        self.child = pexpect.spawn(command, timeout=timeout)
+        self.child.delaybeforesend = None  # Sleeping before send would block the whole loop.
+        self.chunks = []  # Data read and not consumed by a match yet.
+        self.size = 0
+        self.before = ''
+        self.after = None
+        self.eof = False
+
+    def __str__(self):
+        return str(self.child)
+
+    @property
+    def buffer(self):
+        return ''.join(self.chunks)
+
+    def fileno(self):
+        return self.child.child_fd
+
+    def sendline(self, line=''):
+        return self.child.sendline(line)
+
+    def send(self, data):
+        return self.child.send(data)
+
+    def read(self, size=65536):
+        """
+        Read available data into the buffer, sets EOF state if session is closed.
+        """
+
+        try:
+            data = self.child.read_nonblocking(size=size, timeout=0)
+            self.chunks.append(data)
+            self.size += len(data)
+        except pexpect.TIMEOUT:
+            pass
+        except pexpect.EOF:
+            self.eof = True
+
+    def match(self, expect):
+        """
+        Match pending patterns against the buffer.
+
+        Args:
+            expect (object): Expect instruction
+
+        Returns:
+            int: Index of matched pattern or None if nothing matched (yet)
+        """
+
+        # Data searched before without match is only searched again within the window.
+        start = 0
+        if expect.window is not None:
+            start = max(0, expect.scanned - expect.window)
+        window = self._tail(start)
+
+        first = None
+        for index, pattern in expect.patterns:
+            m = pattern.search(window)
+            if m and (first is None or m.start() < first[1].start()):
+                first = (index, m)
+
+        expect.scanned = self.size
+
+        if first:
+            index, m = first
+            buffer = self.buffer
+            self.before = buffer[:start + m.start()]
+            self.after = m.group()
+            self._consume(buffer[start + m.end():])
+            return index
+
+        if self.eof and expect.eof_index is not None:
+            self.before = self.buffer
+            self.after = pexpect.EOF
+            self._consume('')
+            return expect.eof_index
+
+        return None
+
+    def _tail(self, start):
+        # Buffer data from offset start, joining only the chunks required.
+        tail = []
+        offset = self.size
+        for chunk in reversed(self.chunks):
+            if offset <= start:
+                break
+            tail.append(chunk)
+            offset -= len(chunk)
+        return ''.join(reversed(tail))[start - offset:]
+
+    def _consume(self, rest):
+        self.chunks = [rest] if rest else []
+        self.size = len(rest)
+
+    def close(self):
+        self.child.close()
+
+
+class Task(object):
+    """
+    Stack of coroutines driven by the SessionLoop.
+    """
+
+    def __init__(self, coroutine, name=None):
+        self.stack = [coroutine]
+        self.name = name
+
+
+class SessionLoop(object):
+    """
+    Event loop driving coroutines and their sessions from a single thread.
+    """
+
+    def __init__(self, executor_threads=4):
+        """
+        Args:
+            executor_threads (int): Number of threads for blocking Call instructions (tunnels, credentials)
+        """
+
+        self.executor_threads = executor_threads
+        self.ready = collections.deque()  # (task, value, exc_info) ready to be resumed
+        self.waiting = {}  # File descriptor -> (task, Expect)
+        self.sleeping = []  # Heap of (deadline, sequence, task)
+        self.sequence = 0
+        self.tasks = 0
+        self.poller = select.poll()
+
+        # Executor for blocking calls, wakes up the loop by pipe on completion.
+        self.calls = Queue.Queue()
+        self.completed = Queue.Queue()
+        self.wake_read, self.wake_write = os.pipe()
+        self.poller.register(self.wake_read, select.POLLIN)
+        self.threads = []
+
+    def spawn(self, coroutine, name=None):
+        """
+        Schedule coroutine to run on the loop.
+        """
+
+        self.tasks += 1
+        self.ready.append((Task(coroutine, name), None, None))
+
+    def run(self):
+        """
+        Run loop until all tasks are finished.
+        """
+
+        for index in range(self.executor_threads):
+            thread = threading.Thread(target=self._executor, name='Executor-{}'.format(index))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        try:
+            while self.tasks:
+                while self.ready:
+                    self._step(*self.ready.popleft())
+
+                if not self.tasks:
+                    break
+
+                self._poll()
+        finally:
+            for _ in self.threads:
+                self.calls.put(None)
+            self.threads = []
+
+    def _poll(self):
+        # Wait for data or the first deadline.
+        timeout = None
+        deadlines = [expect.deadline for _, expect in self.waiting.itervalues()]
+        if self.sleeping:
+            deadlines.append(self.sleeping[0][0])
+        if deadlines:
+            timeout = max(0, int((min(deadlines) - time.time()) * 1000) + 1)
+
+        for fd, event in self.poller.poll(timeout):
+            if fd == self.wake_read:
+                os.read(self.wake_read, 4096)
+                continue
+            if fd not in self.waiting:
+                continue
+
+            task, expect = self.waiting[fd]
+            expect.session.read()
+            index = expect.session.match(expect)
+
+            if index is None and expect.session.eof:
+                # Closed without match, raise EOF as PEXPECT would do.
+                self._unwait(fd)
+                self.ready.append((task, None, (pexpect.EOF, pexpect.EOF(str(expect.session)), None)))
+            elif index is not None:
+                self._unwait(fd)
+                self.ready.append((task, index, None))
+
+        # Finished blocking calls
+        while True:
+            try:
+                self.ready.append(self.completed.get_nowait())
+            except Queue.Empty:
+                break
+
+        # Expired expects and sleeps
+        now = time.time()
+        while self.sleeping and self.sleeping[0][0] <= now:
+            self.ready.append((heapq.heappop(self.sleeping)[2], None, None))
+        for fd, (task, expect) in self.waiting.items():
+            if expect.deadline <= now:
+                self._unwait(fd)
+                if expect.timeout_index is not None:
+                    expect.session.before = expect.session.buffer
+                    expect.session.after = pexpect.TIMEOUT
+                    self.ready.append((task, expect.timeout_index, None))
+                else:
+                    self.ready.append((task, None, (pexpect.TIMEOUT, pexpect.TIMEOUT(str(expect.session)), None)))
+
+    def _unwait(self, fd):
+        self.poller.unregister(fd)
+        del self.waiting[fd]
+
+    def _executor(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                break
+
+            task, instruction = call
+            try:
+                result = (task, instruction.function(*instruction.args, **instruction.kwargs), None)
+            except Exception:
+                result = (task, None, sys.exc_info())
+
+            self.completed.put(result)
+            os.write(self.wake_write, 'x')
+
+    def _step(self, task, value, exc):
+        # Resume coroutine stack until it waits on the loop or finishes.
+        while task.stack:
+            coroutine = task.stack[-1]
+            try:
+                if exc:
+                    instruction = coroutine.throw(*exc)
+                    exc = None
+                else:
+                    instruction = coroutine.send(value)
+            except StopIteration:
+                task.stack.pop()
+                value = None
+                continue
+            except Exception:
+                task.stack.pop()
+                exc = sys.exc_info()
+                continue
+
+            if isinstance(instruction, Return):
+                coroutine.close()
+                task.stack.pop()
+                value = instruction.value
+            elif isinstance(instruction, types.GeneratorType):
+                task.stack.append(instruction)
+                value = None
+            elif isinstance(instruction, Expect):
+                value = instruction.session.match(instruction)
+                if value is None:
+                    fd = instruction.session.fileno()
+                    self.waiting[fd] = (task, instruction)
+                    self.poller.register(fd, select.POLLIN | select.POLLPRI)
+                    return
+            elif isinstance(instruction, Call):
+                self.calls.put((task, instruction))
+                return
+            elif isinstance(instruction, Sleep):
+                self.sequence += 1
+                heapq.heappush(self.sleeping, (time.time() + instruction.seconds, self.sequence, task))
+                return
+            else:
+                exc = (TypeError, TypeError("Unknown instruction: {!r}".format(instruction)), None)
+
+        # Task finished
+        self.tasks -= 1
+        if exc:
+            logging.error("Task {} failed!".format(task.name), exc_info=exc)
+
+
+class EventTunnelConnectionAgent(TunnelConnectionAgent):
+    """
+    Connection Agent to manage connection to the hosts on a SessionLoop.
+
+    Same contract as TunnelConnectionAgent, but connect, send_command, terminal_lenth_cisco and
+    disconnect are coroutines that must be yielded from a coroutine running on a SessionLoop.
+    """
+
+    def connect(self, host, connection_protocol=None, port=None, via=None, name=None, reroute=None):
+        """
+        Connection method to connect to end node.
+
+        Args:
+            port (int): Port number (TCP)
+            connection_protocol (basestring): Protocol for connectivity to end host. (SSH or Telnet) (Default on init)
+            host (basestring): Hostname for documentation purposes (logging)
+            via (basestring): Final jumpserver to connect through (optional, see JumpPool)
+            name (basestring): Device name, key of login durations in the timing history (Default: host)
+            reroute (callable): Called before connecting through another final jumpserver than via
+            (optional, see JumpPool)
+
+        Returns:
+            bool: Connection status
+        """
+
+        logging.debug("Trying to connect to end node ({})...".format(host))
+        self.history_host = name or host
+
+        # Check for current connectivity and disconnect if connected.
+        if self.connected:
+            logging.warn("Still connected to end node, disconnecting first!")
+            yield self.disconnect()
+
+        # Set values if given or use initial value and check allowed values.
+        if connection_protocol is None:
+            connection_protocol = self.conn_type
+        elif connection_protocol not in self.allowed_connection_types:
+            logging.error("{} not a allowed connection type. Falling back to: {}".
+                          format(connection_protocol, self.conn_type))
+            connection_protocol = self.conn_type
+
+        # Default status set.
+        status = 500
+
+        if port is None:
+            port = 22 if connection_protocol == 'SSH' else 23
+
+        # First setup final SSH tunnel connection, blocking so outside of the loop.
+        self.final_connection = yield Call(self.open_final_connection, host, port, via=via,
+                                                   reroute=reroute)
+
+        started = time.time()
+        if connection_protocol == 'SSH':
+            status = yield self.ssh_connection(self.jumpservers.loopback_address,
+                                               port=self.final_connection.local_port,
+                                               am_host_ref=host)
+        else:
+            status = yield self.telnet_connection(self.jumpservers.loopback_address,
+                                                  port=self.final_connection.local_port,
+                                                  am_host_ref=host)
+        self.record_metric(MetricsManager.LOGIN, started, host, error=status > 101)
+
+        # If any other connecting value, disconnect otherwise accept connection.
+        if status > 101:
+            yield self.disconnect()
+        else:
+            self.connected = True
+            self.connected_host = host
+
+        yield Return(self.connected)
+
+    def disconnect(self):
+        """
+        Disconnect function to terminate connection to a host.
+        """
+
+        # Closing waits for the child to terminate, so outside of the loop.
+        if isinstance(self.prompt, Session):
+            yield Call(self.prompt.close)
+        self.close_transcript()
+
+        if self.final_connection:
+            yield Call(self.final_connection.disconnect)
+            self.final_connection = None
+
+        self.connected = False
+        self.connected_host = None
+
+    def _get_login(self, am_host_ref):
+        user = self.am.get_username(am_host_ref)
+        return user, self.am.get_password(am_host_ref, user)
+
+    def telnet_connection(self, host, port=23, am_host_ref=None):
+        """
+        Function to setup Telnet connection.
+
+        Args:
+            port (int): Integer for connecting to port. (May vary due to TCP port forwarding)
+            host (basestring): String for host connection address. (May vary due to TCP port forwarding to loopback)
+            am_host_ref (basestring): Hostname reference for logging and credential selection in AccountManager.
+        """
+
+        # Known credentials are used directly, keyring and password prompt run outside of the loop.
+        login = self.am.get_cached_login(am_host_ref)
+        if login is None:
+            login = yield Call(self._get_login, am_host_ref)
+        user, password = login
+
+        conn = self.telnet_command.replace("HOST", host)
+        conn = conn.replace("PORT", str(port))
+        logging.debug("Connecting using '{}' command...".format(conn))
+
+        timeout = self.get_timeout(self.history_host, LOGIN)
+        started = time.time()
+
+        prompt = Session(conn, timeout=timeout)
+        self.prompt = prompt
+        self.start_transcript(prompt.child, am_host_ref, conn, password)
+
+        prompts = [
+            '[U|u]sername:',
+            '[P|p]assword:',
+            '\n\w+#',
+            '\n\w+>',
+            pexpect.TIMEOUT,
+            pexpect.EOF
+        ]
+
+        # User prompt handeling
+        response = yield Expect(prompt, prompts, timeout)
+        self.record_match(response, prompt.after)
+        if response != 0:
+            logging.warn("No user prompt, exiting for this node. (Line:{} {})".format(prompt.before, prompt.after))
+            if response == 4:
+                self.record_timing(self.history_host, LOGIN, timeout)
+            yield Return(200)
+        prompt.sendline(user)
+
+        # Password handeling
+        response = yield Expect(prompt, prompts, timeout)
+        self.record_match(response, prompt.after)
+        if response != 1:
+            logging.warn("No password prompt, exiting for this node. (Line:{} {})".format(prompt.before, prompt.after))
+            if response == 4:
+                self.record_timing(self.history_host, LOGIN, timeout)
+            yield Return(200)
+        prompt.sendline(password)
+
+        # Prompt handeling
+        response = yield Expect(prompt, prompts, timeout)
+        self.record_match(response, prompt.after)
+        if response != 2:
+            logging.warn("No prompt, exiting for this node. (Line:{})".format(prompt.before))
+            if response == 4:
+                self.record_timing(self.history_host, LOGIN, timeout)
+            yield Return(200)
+
+        logging.debug("Prompt detected!")
+        self.learn_prompt(am_host_ref, prompt.after)
+        self.record_timing(self.history_host, LOGIN, time.time() - started)
+        yield Return(100)
+
+    def ssh_connection(self, host, port=22, am_host_ref=None):
+        """
+        Function to setup SSH connection.
+
+        Args:
+            port (int): Integer for connecting to port. (May vary due to TCP port forwarding)
+            host (basestring): String for host connection address. (May vary due to TCP port forwarding to loopback)
+            am_host_ref (basestring): Hostname reference for logging and credential selection in AccountManager.
+        """
+
+        # Known credentials are used directly, keyring and password prompt run outside of the loop.
+        login = self.am.get_cached_login(am_host_ref)
+        if login is None:
+            login = yield Call(self._get_login, am_host_ref)
+        user, password = login
+
+        conn = self.ssh_command.replace("HOST", host)
+        conn = conn.replace("PORT", str(port))
+        conn = conn.replace("USER", str(user))
+        logging.debug("Connecting using '{}' command...".format(conn))
+
+        timeout = self.get_timeout(self.history_host, LOGIN)
+        started = time.time()
+
+        prompt = Session(conn, timeout=timeout)
+        self.prompt = prompt
+        self.start_transcript(prompt.child, am_host_ref, conn, password)
+
+        prompts = [
+            '[U|u]sername:',
+            '[P|p]assword:',
+            '\n\w+#',
+            '\n\w+>',
+            pexpect.TIMEOUT,
+            pexpect.EOF
+        ]
+
+        # Password handeling
+        response = yield Expect(prompt, prompts, timeout)
+        self.record_match(response, prompt.after)
+        if response != 1:
+            logging.warn("No password prompt, exiting for this node. (Line:{} {})".format(prompt.before, prompt.after))
+            if response == 4:
+                self.record_timing(self.history_host, LOGIN, timeout)
+            yield Return(200)
+        prompt.sendline(password)
+
+        # Prompt handeling
+        response = yield Expect(prompt, prompts, timeout)
+        self.record_match(response, prompt.after)
+        if response != 2:
+            logging.warn("No prompt, exiting for this node. (Line:{})".format(prompt.before))
+            if response == 4:
+                self.record_timing(self.history_host, LOGIN, timeout)
+            yield Return(200)
+
+        logging.debug("Prompt detected!")
+        self.learn_prompt(am_host_ref, prompt.after)
+        self.record_timing(self.history_host, LOGIN, time.time() - started)
+        yield Return(100)
+
+    def terminal_lenth_cisco(self, host):
+        """
+        Function to set unlimit terminal lenth for Cisco devices.
+
+        Args:
+            host (basestring): Hostname for documentation
+        """
+
+        logging.debug('Setting unlimit Terminal length!')
+        result = yield self.send_command(host, 'terminal length 0', allow_more_show=True)
+        yield Return(result)
+
+    def send_command(self, host, command, allow_more_show=False, timeout=None):
+        """
+        Function to send command. Validation for 'show'-commands prior to execution.
+
+        Args:
+            host (basestring): Hostname for documentation and timing history
+            command (basestring): Command to send to node
+            allow_more_show (bool): Validation for 'show'-commands only.
+            timeout (int): Timeout for the command (Default: derived from timing history or timeout)
+        """
+
+        search_show = re.search(r'show\s\w*', command)
+
+        if (allow_more_show or search_show) and self.connected:
+            self.prompt.sendline(command)
+            logging.debug("Executing \"{}\" on {}... ".format(command, self.connected_host))
+
+            result = yield self.wait_output(host, command, timeout)
+            yield Return(result)
+
+        if not self.connected:
+            logging.debug("Not connected ({})! Skipping command ({}) check!".format(host, command))
+        if not search_show and not allow_more_show:
+            logging.warn("Command \"{}\" has not been executed! This is no \"show\"-command."
+                         "Make sure you execute fully typed show commands.".format(command))
+        yield Return((self.connected, None))
+
+    def send_commands(self, host, commands, allow_more_show=False):
+        """
+        Function to send a batch of commands in a single write (pipelining), see TunnelConnectionAgent.
+
+        Returns:
+            tuple: Connection status and list of output per command (None if not executed)
+        """
+
+        outputs = [None] * len(commands)
+
+        batch = []
+        for index, command in enumerate(commands):
+            if allow_more_show or re.search(r'show\s\w*', command):
+                batch.append(index)
+            else:
+                logging.warn("Command \"{}\" has not been executed! This is no \"show\"-command."
+                             "Make sure you execute fully typed show commands.".format(command))
+
+        if not self.connected:
+            logging.debug("Not connected ({})! Skipping commands ({}) check!".format(host, len(commands)))
+            yield Return((self.connected, outputs))
+
+        if not batch:
+            yield Return((self.connected, outputs))
+
+        self.prompt.send(''.join(commands[index] + os.linesep for index in batch))
+        logging.debug("Executing {} commands on {}... ".format(len(batch), self.connected_host))
+
+        for index in batch:
+            connected, outputs[index] = yield self.wait_output(host, commands[index])
+            if not connected:
+                break
+
+        yield Return((self.connected, outputs))
+
+    def wait_output(self, host, command, timeout=None):
+        """
+        Function to wait for the prompt after a command is sent and return its output.
+
+        Args:
+            host (basestring): Hostname for documentation and timing history
+            command (basestring): Command sent to node
+            timeout (int): Timeout for the command (Default: derived from timing history or timeout)
+
+        Returns:
+            tuple: Connection status and output (error text if disconnected)
+        """
+
+        prompts, exact = self.get_command_prompts(self.connected_host)
+
+        if timeout is None:
+            timeout = self.get_timeout(host, command)
+
+        started = time.time()
+        response = yield Expect(self.prompt, prompts, timeout, exact=exact)
+        self.record_match(response, self.prompt.after)
+
+        if response == 0 or response == 1:
+            self.record_timing(host, command, time.time() - started)
+            self.record_metric(MetricsManager.COMMAND, started, self.connected_host, key=command,
+                               size=len(self.prompt.before))
+            self.record_command(command, started, len(self.prompt.before))
+            yield Return((self.connected, self.prompt.before))
+
+        self.record_metric(MetricsManager.COMMAND, started, self.connected_host, key=command, error=True)
+        self.record_command(command, started, ok=False)
+        if response == 2:
+            logging.warning("Response timed out after {}s, consider increasing time out value in "
+                            "setting file!".format(timeout))
+            self.record_timing(host, command, timeout)
+        logging.critical("Undesired response! Disconnecting from host ({})!".format(self.connected_host))
+        before = self.prompt.before
+        yield self.disconnect()
+        yield Return((self.connected, "Error: Disconnected from host by response error. "
+                                      "(No prompt)\nLast output:\n{}\nPexpect status:\n{}".format(before,
+                                                                                                  self.prompt)))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python -tt
+"""
+Governor Manager library for limiting jumpserver sessions and login rates of a collection run.
+"""
+
+import logging
+import threading
+import time
+import Queue
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+class TokenBucket(object):
+    """
+    Token bucket handing out tokens at a fixed rate with a burst allowance.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        Args:
+            rate (float): Tokens per second
+            burst (int): Maximum number of tokens available at once
+        """
+
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+
+    def reserve(self):
+        """
+        Take a token, tokens not yet available are reserved in order of request.
+
+        Returns:
+            float: Seconds to wait before the token may be used
+        """
+
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class Permit(object):
+    """
+    Permit to collect a device, returned to the governor when the device is done.
+    """
+
+    def __init__(self, jumpserver, realm, delay):
+        self.jumpserver = jumpserver  # Final jumpserver to connect through
+        self.realm = realm  # Credential section of the device
+        self.delay = delay  # Seconds to wait before login
+
+
+class Governor(object):
+    """
+    Governor limiting sessions per final jumpserver and logins per credential realm over all workers.
+    """
+
+    def __init__(self, jumpservers, session_limits=None, login_rates=None, realm=None):
+        """
+        Governor shared by all workers of a collection run.
+
+        A device is started once one of the final jumpservers has a free session. Logins of a
+        credential realm are spread by a token bucket per realm, a device waits for its token
+        before login.
+
+        Args:
+            jumpservers (lst): Final jumpservers devices can be connected through
+            session_limits (dict): Maximum number of sessions by final jumpserver (unlimited if not set)
+            login_rates (dict): Settings by credential section, each with RATE (logins per second) and
+            BURST (optional, Default: 1). DEFAULT applies to every section without settings.
+            realm (callable): Callable returning the credential section of a device address
+            (e.g. AccountManager.get_section)
+        """
+
+        self.jumpservers = list(jumpservers)
+        self.session_limits = session_limits or {}
+        self.login_rates = login_rates or {}
+        self.realm = realm
+        self.sessions = dict((jumpserver, 0) for jumpserver in self.jumpservers)
+        self.buckets = {}
+        self.condition = threading.Condition()
+
+        for jumpserver in self.jumpservers:
+            logging.info("Sessions via {}: {}".format(jumpserver, self.session_limits.get(jumpserver, 'no limit')))
+        for section in sorted(self.login_rates):
+            logging.info("Login rate of {}: {RATE}/s (Burst: {BURST})".format(
+                section, **dict({'BURST': 1}, **self.login_rates[section])))
+
+    def _bucket(self, section):
+        # Token bucket of credential section, None if not limited.
+        if section not in self.buckets:
+            settings = self.login_rates.get(section, self.login_rates.get('DEFAULT'))
+            self.buckets[section] = None
+            if settings:
+                self.buckets[section] = TokenBucket(settings['RATE'], settings.get('BURST', 1))
+        return self.buckets[section]
+
+    def _free_jumpserver(self):
+        # Least loaded final jumpserver with a free session, False if none.
+        free = [jumpserver for jumpserver in self.jumpservers
+                if jumpserver not in self.session_limits
+                or self.sessions[jumpserver] < self.session_limits[jumpserver]]
+        if not free:
+            return False
+        return min(free, key=lambda jumpserver: self.sessions[jumpserver])
+
+    def acquire(self, device, block=True, timeout=None):
+        """
+        Take a session and login token for a device.
+
+        Args:
+            device (dict): Device settings containing NAME and IP
+            block (bool): Wait until a session is free
+            timeout (int): Seconds to wait (optional, wait forever if not set)
+
+        Returns:
+            Permit: Jumpserver to connect through and delay before login, returned with release
+        """
+
+        # Credential lookup outside of the lock.
+        section = self.realm(device['IP']) if self.realm else 'DEFAULT'
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                jumpserver = self._free_jumpserver()
+                if jumpserver is not False:
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Queue.Empty
+                self.condition.wait(remaining)
+
+            self.sessions[jumpserver] += 1
+            bucket = self._bucket(section)
+            delay = bucket.reserve() if bucket else 0
+
+        if delay:
+            logging.debug("Login to {} delayed {:.1f} seconds (Login rate of {})".format(device['NAME'], delay,
+                                                                                        section))
+
+        return Permit(jumpserver, section, delay)
+
+    def transfer(self, permit, jumpserver):
+        """
+        Move the session of a permit to another final jumpserver, if that jumpserver has a free session.
+
+        Args:
+            permit (object): Permit from acquire
+            jumpserver (basestring): Final jumpserver the device is connected through instead
+
+        Returns:
+            bool: True if the session is on jumpserver, False if jumpserver has no free session
+        """
+
+        with self.condition:
+            if jumpserver == permit.jumpserver:
+                return True
+            if jumpserver in self.session_limits and \
+                    self.sessions.get(jumpserver, 0) >= self.session_limits[jumpserver]:
+                return False
+
+            self.sessions[permit.jumpserver] -= 1
+            self.sessions[jumpserver] = self.sessions.get(jumpserver, 0) + 1
+            logging.debug("Session moved from {} to {}".format(permit.jumpserver, jumpserver))
+            permit.jumpserver = jumpserver
+            self.condition.notify_all()
+
+        return True
+
+    def wait(self, timeout=None):
+        """
+        Wait until a session is released or the timeout expired.
+        """
+
+        with self.condition:
+            self.condition.wait(timeout)
+
+    def release(self, permit):
+        """
+        Return the session of a permit.
+
+        Args:
+            permit (object): Permit from acquire
+        """
+
+        with self.condition:
+            self.sessions[permit.jumpserver] -= 1
+            self.condition.notify_all()
@@ -5,7 +5,7 @@ Library for HostManagement Objects
 
 import logging
 import datetime
-from DatabaseManager import DatbaseManager
+import threading
 from utils import write_dict_to_json_file
 
 __author__ = "Thomas Jongerius"
@@ -65,13 +65,14 @@ class HostManagment(Device):
     Host Manager to keep data for hosts. Export, and import data.
     '''
 
-    def __init__(self, prefix=None, postfix='.log', db=DatbaseManager):
+    def __init__(self, prefix=None, postfix='.log', db=None):
         super(Device, self).__init__()
 
         self.hm = {}
         self.prefix = prefix
         self.postfix = postfix
         self.db = db
+        self.lock = threading.RLock()  # Guards self.hm for concurrent collection workers.
 
     def add_host(self, host, **kwargs):
         '''
@@ -84,6 +85,10 @@ class HostManagment(Device):
         - prompt = Prompt of device (as of beginning new line)
         - timeout = settings for node
         '''
+        with self.lock:
+            self._add_host(host, **kwargs)
+
+    def _add_host(self, host, **kwargs):
         self.hm[host] = {}
 
         d = Device(host)
@@ -100,7 +105,7 @@ class HostManagment(Device):
 
         self.hm[host]['SETTINGS'] = d
 
-    def add_command(self, host, command, output=None):
+    def add_command(self, host, command, output=None, timestamp=None):
         '''
         Function to add command to host and timestamp of output retrieval.
 
@@ -108,19 +113,66 @@ class HostManagment(Device):
             output (basestring): Output as string
             command (basestring): Command as string
             host (basestring): Hostname or IP as referenced in HostManager
+            timestamp (basestring): Timestamp of output retrieval if not now (e.g. output from journal)
 
+        Returns:
+            dict: Command record with OUTPUT and TIMESTAMP
         '''
 
-        if host not in self.hm:
-            self.add_host(host)
+        with self.lock:
+            if host not in self.hm:
+                self._add_host(host)
 
-        if 'COMMANDS' not in self.hm[host]:
-            self.hm[host]['COMMANDS'] = {}
+            if 'COMMANDS' not in self.hm[host]:
+                self.hm[host]['COMMANDS'] = {}
 
-        self.hm[host]['COMMANDS'][command] = {
-            'OUTPUT': output,
-            'TIMESTAMP': str(datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
-        }
+            if timestamp is None:
+                timestamp = str(datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
+
+            self.hm[host]['COMMANDS'][command] = {
+                'OUTPUT': output,
+                'TIMESTAMP': timestamp
+            }
+
+            return self.hm[host]['COMMANDS'][command]
+
+    def export_host(self, host):
+        '''
+        Function to return host data in exportable format (JSON).
+
+        Args:
+            host (basestring): Hostname or IP as referenced in HostManager
+
+        Returns:
+            dict: Host data with SETTINGS as dict instead of Device object
+        '''
+
+        # Remove device object as it is not exportable to JSON
+        json_out = {}
+        for y in self.hm[host]:
+            if y == 'SETTINGS':
+                json_out['SETTINGS'] = self.hm[host]['SETTINGS'].all_node_details()
+            else:
+                json_out[y] = self.hm[host][y]
+
+        return json_out
+
+    def pop_host(self, host):
+        '''
+        Function to remove host from HostManager, returning its data in exportable format.
+
+        Args:
+            host (basestring): Hostname or IP as referenced in HostManager
+
+        Returns:
+            dict: Host data as returned by export_host
+        '''
+
+        with self.lock:
+            json_out = self.export_host(host)
+            del self.hm[host]
+
+        return json_out
 
     def write_to_json(self, filename):
         '''
@@ -131,15 +183,9 @@ class HostManagment(Device):
         '''
         logging.debug("Writing JSON output to {}...".format(filename))
 
-        # Remove device object as it is not exportable to JSON
         json_out = {}
         for x in self.hm:
-            json_out[x] = {}
-            for y in self.hm[x]:
-                if y == 'SETTINGS':
-                    json_out[x]['SETTINGS'] = self.hm[x]['SETTINGS'].all_node_details()
-                else:
-                    json_out[x][y] = self.hm[x][y]
+            json_out[x] = self.export_host(x)
 
         write_dict_to_json_file(filename, json_out, indent=2)
 
@@ -161,10 +207,10 @@ class HostManagment(Device):
 
     def write_to_db(self):
         '''
-        Output to DataBase if database object is given.
+        Output to DataBase if database object is given (DatbaseManager or SqliteDatabaseManager).
         '''
 
-        if isinstance(self.db, DatbaseManager):
+        if hasattr(self.db, 'save_command_output'):
             logging.debug("Writing output to database...")
 
             # Format for supported DataBase Object
@@ -181,10 +227,8 @@ class HostManagment(Device):
                             'TIMESTAMP': self.hm[host]['COMMANDS'][command]['TIMESTAMP']
                             }
 
-            # Connect and send to database
-            self.db.connect()
+            # Send to database, connects if required and keeps pooled connections for the owner to disconnect.
             self.db.save_command_output(db_output)
-            self.db.disconnect()
         else:
             logging.error("Database object not loaded into HostManager! Did not save data to DB!")
 
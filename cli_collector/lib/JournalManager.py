@@ -0,0 +1,149 @@
+#!/usr/bin/env python -tt
+"""
+Journal Manager library for recording collected output while a collection runs.
+"""
+
+import json
+import logging
+import os
+import threading
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+class Journal(object):
+    """
+    Append-only journal (JSON Lines) of completed commands and devices.
+
+    Each line is one record:
+        - {"TYPE": "COMMAND", "HOST": .., "DB_ID": .., "IPV4": .., "COMMAND": .., "OUTPUT": .., "TIMESTAMP": ..}
+        - {"TYPE": "DEVICE", "HOST": .., "DB_ID": ..} once all commands of a device are collected
+    """
+
+    def __init__(self, filename, resume=False):
+        """
+        Journal for checkpointing a collection run.
+
+        Args:
+            filename (basestring): Path to journal file
+            resume (bool): Continue existing journal, otherwise an existing journal is overwritten
+        """
+
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.completed_devices = set()
+        self.commands = {}  # Host -> set of completed commands
+
+        if resume and os.path.exists(self.filename):
+            self._load()
+            logging.info("Resuming from journal {} ({} devices completed)!".format(self.filename,
+                                                                                 len(self.completed_devices)))
+        elif os.path.exists(self.filename):
+            logging.warn("Journal {} already exists. Will be overwritten!".format(self.filename))
+            open(self.filename, 'w').close()
+
+        self.journal_file = open(self.filename, 'a')
+
+    def _records(self):
+        # Read complete records with their size, a partial last line (crash during write) ends the journal.
+        with open(self.filename, 'r') as journal_file:
+            for line in journal_file:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    yield json.loads(line), len(line)
+                except ValueError:
+                    break
+
+    def _load(self):
+        valid_size = 0
+        for record, size in self._records():
+            valid_size += size
+            if record['TYPE'] == 'COMMAND':
+                self.commands.setdefault(record['HOST'], set()).add(record['COMMAND'])
+            elif record['TYPE'] == 'DEVICE':
+                self.completed_devices.add(record['HOST'])
+
+        # Drop partial record so new records start on a new line.
+        if os.path.getsize(self.filename) > valid_size:
+            logging.warn("Dropping incomplete record at end of journal {}!".format(self.filename))
+            with open(self.filename, 'r+') as journal_file:
+                journal_file.truncate(valid_size)
+
+    def _write(self, record, sync=False):
+        with self.lock:
+            self.journal_file.write(json.dumps(record) + '\n')
+            self.journal_file.flush()
+            if sync:
+                os.fsync(self.journal_file.fileno())
+
+    def record_command(self, host, db_id, command, output, timestamp, ipv4=None):
+        """
+        Record output of a command.
+
+        Args:
+            host (basestring): Hostname as referenced in HostManager
+            db_id (int): Device identifier
+            command (basestring): Command as string
+            output (basestring): Output as string
+            timestamp (basestring): Timestamp of output retrieval
+            ipv4 (basestring): IPv4 management address
+        """
+
+        self._write({'TYPE': 'COMMAND', 'HOST': host, 'DB_ID': db_id, 'IPV4': ipv4, 'COMMAND': command,
+                     'OUTPUT': output, 'TIMESTAMP': timestamp})
+        with self.lock:
+            self.commands.setdefault(host, set()).add(command)
+
+    def record_device(self, host, db_id):
+        """
+        Record device as completed, synced to disk.
+
+        Args:
+            host (basestring): Hostname as referenced in HostManager
+            db_id (int): Device identifier
+        """
+
+        self._write({'TYPE': 'DEVICE', 'HOST': host, 'DB_ID': db_id}, sync=True)
+        with self.lock:
+            self.completed_devices.add(host)
+
+    def is_completed(self, host):
+        return host in self.completed_devices
+
+    def completed_commands(self, host):
+        with self.lock:
+            return set(self.commands.get(host, ()))
+
+    def replay(self, hm, on_completed=None):
+        """
+        Load output recorded in the journal into a HostManagment instance.
+
+        Args:
+            hm (object): HostManagment instance
+            on_completed (callable): Called with the host name once a completed device is replayed (optional)
+        """
+
+        count = 0
+        for record, _ in self._records():
+            if record['TYPE'] == 'DEVICE' and on_completed and record['HOST'] in hm.hm:
+                on_completed(record['HOST'])
+            if record['TYPE'] != 'COMMAND':
+                continue
+            if record['HOST'] not in hm.hm:
+                hm.add_host(record['HOST'], db_id=record['DB_ID'], ipv4=record['IPV4'])
+            hm.add_command(record['HOST'], record['COMMAND'], record['OUTPUT'], timestamp=record['TIMESTAMP'])
+            count += 1
+
+        logging.debug("Replayed {} commands from journal!".format(count))
+
+    def close(self):
+        with self.lock:
+            self.journal_file.close()
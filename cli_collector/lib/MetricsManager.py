@@ -0,0 +1,207 @@
+#!/usr/bin/env python -tt
+"""
+Metrics Manager library for recording durations and sizes of collection phases.
+"""
+
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+# Phases of a collection run.
+TUNNEL = 'tunnel'  # Final connection via the jumpservers
+LOGIN = 'login'  # SSH/Telnet login on the end node
+COMMAND = 'command'  # Command output
+DEVICE = 'device'  # Complete device, tunnel to disconnect
+EXPORT = 'export'  # Writing output (files, database, sinks)
+
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(samples, percent):
+    """
+    Nearest rank percentile of sorted samples.
+    """
+
+    rank = int(math.ceil(percent / 100.0 * len(samples)))
+    return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+def _escape(value):
+    # Prometheus label value escaping.
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """
+    Durations, byte counts and errors per phase, per command and per host of a collection run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}  # Phase -> durations
+        self.keys = {}  # (Phase, command or output) -> durations
+        self.totals = {}  # Phase or (phase, key) -> {'BYTES': .., 'ERRORS': ..}
+        self.hosts = {}  # Host -> phase -> {'COUNT': .., 'SECONDS': .., 'BYTES': .., 'ERRORS': ..}
+
+    def record(self, phase, duration, host=None, key=None, size=0, error=False):
+        """
+        Record a duration of a phase.
+
+        Args:
+            phase (basestring): TUNNEL, LOGIN, COMMAND, DEVICE or EXPORT
+            duration (float): Duration in seconds
+            host (basestring): Host reference (optional)
+            key (basestring): Command for COMMAND, output for EXPORT (optional)
+            size (int): Bytes received or written
+            error (bool): Phase failed
+        """
+
+        with self.lock:
+            self.phases.setdefault(phase, []).append(duration)
+            self._add(self.totals.setdefault(phase, {}), 0, size, error)
+            if key is not None:
+                self.keys.setdefault((phase, key), []).append(duration)
+                self._add(self.totals.setdefault((phase, key), {}), 0, size, error)
+            if host is not None:
+                self._add(self.hosts.setdefault(host, {}).setdefault(phase, {}), duration, size, error)
+
+    @staticmethod
+    def _add(entry, duration, size, error):
+        entry['COUNT'] = entry.get('COUNT', 0) + 1
+        entry['SECONDS'] = entry.get('SECONDS', 0) + duration
+        entry['BYTES'] = entry.get('BYTES', 0) + size
+        entry['ERRORS'] = entry.get('ERRORS', 0) + (1 if error else 0)
+
+    @contextlib.contextmanager
+    def timer(self, phase, host=None, key=None, size=0):
+        """
+        Record the duration of a with-block, as error if the block raised.
+        """
+
+        started = time.time()
+        try:
+            yield
+        except Exception:
+            self.record(phase, time.time() - started, host=host, key=key, size=size, error=True)
+            raise
+        self.record(phase, time.time() - started, host=host, key=key, size=size)
+
+    @staticmethod
+    def _summary(durations, totals):
+        samples = sorted(durations)
+        summary = {'COUNT': len(samples),
+                   'SECONDS': round(sum(samples), 3),
+                   'BYTES': totals.get('BYTES', 0),
+                   'ERRORS': totals.get('ERRORS', 0),
+                   'MAX': round(samples[-1], 3) if samples else None}
+        for percent in PERCENTILES:
+            summary['P{}'.format(percent)] = round(percentile(samples, percent), 3) if samples else None
+        return summary
+
+    def _keyed(self, phase):
+        return dict((key, self._summary(self.keys[(keyed_phase, key)], self.totals[(keyed_phase, key)]))
+                    for keyed_phase, key in self.keys if keyed_phase == phase)
+
+    def summary(self):
+        """
+        Summary of the run with percentiles over the fleet.
+
+        Returns:
+            dict: RUN_SECONDS, HOSTS and per PHASES, COMMANDS, EXPORTS (by output) and HOST: COUNT,
+            SECONDS, BYTES, ERRORS (and MAX and percentiles, except per host)
+        """
+
+        with self.lock:
+            return {
+                'STARTED': self.started,
+                'RUN_SECONDS': round(time.time() - self.started, 3),
+                'HOSTS': len(self.hosts),
+                'PHASES': dict((phase, self._summary(self.phases[phase], self.totals[phase]))
+                               for phase in self.phases),
+                'COMMANDS': self._keyed(COMMAND),
+                'EXPORTS': self._keyed(EXPORT),
+                'HOST': dict((host, dict((phase, dict(entry, SECONDS=round(entry['SECONDS'], 3)))
+                                         for phase, entry in phases.iteritems()))
+                             for host, phases in self.hosts.iteritems()),
+            }
+
+    def write_json(self, filename):
+        """
+        Write the summary to a JSON file.
+        """
+
+        with open(filename, 'w') as metrics_file:
+            json.dump(self.summary(), metrics_file, indent=2, sort_keys=True)
+        logging.info("Saved metrics to {}!".format(filename))
+
+    def write_prometheus(self, filename, prefix='cli_collector'):
+        """
+        Write fleet metrics in Prometheus text format (node exporter textfile collector).
+
+        The file is replaced at once, so the exporter never reads a partial file. Per host
+        metrics are left out to keep the number of series bounded.
+        """
+
+        summary = self.summary()
+        lines = [
+            '# HELP {}_run_seconds Duration of the collection run.'.format(prefix),
+            '# TYPE {}_run_seconds gauge'.format(prefix),
+            '{}_run_seconds {}'.format(prefix, summary['RUN_SECONDS']),
+            '# HELP {}_last_run_timestamp_seconds Start of the collection run.'.format(prefix),
+            '# TYPE {}_last_run_timestamp_seconds gauge'.format(prefix),
+            '{}_last_run_timestamp_seconds {}'.format(prefix, summary['STARTED']),
+            '# HELP {}_hosts Hosts seen in the collection run.'.format(prefix),
+            '# TYPE {}_hosts gauge'.format(prefix),
+            '{}_hosts {}'.format(prefix, summary['HOSTS']),
+        ]
+
+        for name, label, entries in (('phase', 'phase', summary['PHASES']),
+                                     ('command', 'command', summary['COMMANDS']),
+                                     ('export', 'output', summary['EXPORTS'])):
+            metric = '{}_{}_seconds'.format(prefix, name)
+            lines.append('# HELP {} Duration per {}.'.format(metric, name))
+            lines.append('# TYPE {} summary'.format(metric))
+            for value in sorted(entries):
+                entry = entries[value]
+                labels = '{}="{}"'.format(label, _escape(value))
+                for percent in PERCENTILES:
+                    lines.append('{}{{{},quantile="{}"}} {}'.format(metric, labels, percent / 100.0,
+                                                                    entry['P{}'.format(percent)]))
+                lines.append('{}_sum{{{}}} {}'.format(metric, labels, entry['SECONDS']))
+                lines.append('{}_count{{{}}} {}'.format(metric, labels, entry['COUNT']))
+
+            for total in ('BYTES', 'ERRORS'):
+                metric = '{}_{}_{}_total'.format(prefix, name, total.lower())
+                lines.append('# HELP {} {} per {}.'.format(metric, total.capitalize(), name))
+                lines.append('# TYPE {} counter'.format(metric))
+                for value in sorted(entries):
+                    lines.append('{}{{{}="{}"}} {}'.format(metric, label, _escape(value), entries[value][total]))
+
+        temp_file = filename + '.tmp'
+        with open(temp_file, 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.rename(temp_file, filename)
+        logging.info("Saved Prometheus metrics to {}!".format(filename))
+
+    def log_summary(self):
+        """
+        Log phase percentiles of the run.
+        """
+
+        for phase, entry in sorted(self.summary()['PHASES'].iteritems()):
+            logging.info("Phase {}: {COUNT} times, {SECONDS}s total, p50 {P50}s, p90 {P90}s, p99 {P99}s, "
+                         "max {MAX}s, {BYTES} bytes, {ERRORS} errors".format(phase, **entry))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python -tt
+"""
+Profile Manager library for profiling a run, with per stage reports.
+
+Two modes are available:
+    cprofile: Deterministic profile (cProfile) of every thread, precise but slows the run down.
+    sample: Statistical profile by sampling the stacks of all threads, cheap enough for production runs.
+            Samples see Python frames only, a long call into C (the JSON scanner, a regex search) is
+            attributed to its Python caller.
+"""
+
+import contextlib
+import cProfile
+import logging
+import os
+import pstats
+import StringIO
+import sys
+import threading
+import time
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+MODES = ['cprofile', 'sample']
+
+# Stage -> test on (filename, function name) of a function. Built-in functions have filename '~'.
+STAGES = [
+    ('expect', lambda filename, name: (os.sep + 'pexpect' + os.sep in filename and name.startswith('expect')) or
+                                      (filename.endswith('EventConnectionManager.py') and name == '_poll')),
+    ('regex', lambda filename, name: os.path.basename(filename) in ('re.py', 'sre_compile.py', 'sre_parse.py') or
+                                     (filename == '~' and '_sre.' in name)),
+    ('json', lambda filename, name: os.sep + 'json' + os.sep in filename or
+                                    (filename == '~' and '_json' in name)),
+]
+
+TOP = 30  # Functions listed per hot spot table
+
+
+def stages_of(function):
+    """
+    Stages a function belongs to.
+
+    Args:
+        function (tuple): (filename, line, function name)
+
+    Returns:
+        tuple: Stage names
+    """
+
+    return tuple(stage for stage, test in STAGES if test(function[0], function[2]))
+
+
+def label(function):
+    """
+    Short readable name of a function.
+    """
+
+    filename, line, name = function
+    if filename == '~':
+        return name
+    return '{} ({}:{})'.format(name, os.path.basename(filename), line)
+
+
+class Profiler(object):
+    """
+    Profiler of all threads of a run.
+    """
+
+    def __init__(self, mode='sample', interval=0.01):
+        """
+        Constructor
+
+        Args:
+            mode (basestring): cprofile or sample
+            interval (float): Seconds between samples (sample mode)
+        """
+
+        if mode not in MODES:
+            raise ValueError("Unknown profile mode {}! (Available: {})".format(mode, ', '.join(MODES)))
+
+        self.mode = mode
+        self.interval = interval
+        self.started = None
+        self.elapsed = None
+
+        # cprofile mode
+        self.profiles = []
+
+        # sample mode
+        self.sampler = None
+        self.running = threading.Event()
+        self.rounds = 0
+        self.samples = 0
+        self.self_samples = {}  # Function -> samples on top of the stack
+        self.total_samples = {}  # Function -> samples on the stack
+        self.stage_samples = {}  # Stage -> samples
+        self.stacks = {}  # Folded stack -> samples
+        self.functions = {}  # Code object -> (function, stages)
+
+    def start(self):
+        """
+        Start profiling the current and all new threads.
+        """
+
+        self.started = time.time()
+        if self.mode == 'cprofile':
+            threading.setprofile(self._profile_thread)
+            profile = cProfile.Profile()
+            self.profiles.append(profile)
+            profile.enable()
+        else:
+            self.running.set()
+            self.sampler = threading.Thread(target=self._sample, name='ProfileSampler')
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def stop(self):
+        """
+        Stop profiling.
+        """
+
+        if self.mode == 'cprofile':
+            self.profiles[0].disable()
+            threading.setprofile(None)
+        else:
+            self.running.clear()
+            self.sampler.join()
+        self.elapsed = time.time() - self.started
+
+    def _profile_thread(self, frame, event, arg):
+        # First profile event of a new thread, replaced by a profile of its own.
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+
+    def _function(self, code):
+        function = self.functions.get(code)
+        if function is None:
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            function = self.functions[code] = (key, stages_of(key))
+        return function
+
+    def _sample(self):
+        own = threading.current_thread().ident
+        while self.running.is_set():
+            time.sleep(self.interval)
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            self.rounds += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(self._function(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+
+                self.samples += 1
+                top = stack[-1][0]
+                self.self_samples[top] = self.self_samples.get(top, 0) + 1
+                stages = set()
+                for function, function_stages in set(stack):
+                    self.total_samples[function] = self.total_samples.get(function, 0) + 1
+                    stages.update(function_stages)
+                for stage in stages:
+                    self.stage_samples[stage] = self.stage_samples.get(stage, 0) + 1
+
+                folded = ';'.join([names.get(ident, 'Thread')] + [label(function) for function, _ in stack])
+                self.stacks[folded] = self.stacks.get(folded, 0) + 1
+
+    def stats(self):
+        """
+        Merged cProfile statistics of all threads (cprofile mode).
+
+        Returns:
+            object: pstats.Stats
+        """
+
+        stats = None
+        for profile in self.profiles:
+            profile.create_stats()
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def stage_seconds(self, stats=None):
+        """
+        Time per stage, summed over threads. Time spent in a stage is counted once where it is
+        entered from outside the stage. Stages can overlap (regex matching within expect).
+
+        Args:
+            stats (object): pstats.Stats of the run (cprofile mode)
+
+        Returns:
+            dict: Stage -> seconds
+        """
+
+        seconds = dict((stage, 0.0) for stage, _ in STAGES)
+        if self.mode == 'sample':
+            per_sample = self.elapsed / self.rounds if self.rounds else 0
+            for stage, samples in self.stage_samples.iteritems():
+                seconds[stage] = samples * per_sample
+            return seconds
+
+        for function, (_, _, _, cumulative, callers) in stats.stats.iteritems():
+            for stage in stages_of(function):
+                if not callers:
+                    seconds[stage] += cumulative
+                for caller, call in callers.iteritems():
+                    if stage not in stages_of(caller):
+                        seconds[stage] += call[3]
+        return seconds
+
+    def write(self, filename):
+        """
+        Write the profile report to filename, with the raw profile next to it: filename.pstats
+        (cprofile mode, for pstats or snakeviz) or filename.folded (sample mode, for flamegraph.pl).
+
+        Args:
+            filename (basestring): Report file
+        """
+
+        stats = self.stats() if self.mode == 'cprofile' else None
+        stages = self.stage_seconds(stats)
+
+        report = StringIO.StringIO()
+        report.write("Profile mode: {}\n".format(self.mode))
+        report.write("Run time: {:.3f}s\n".format(self.elapsed))
+        if self.mode == 'cprofile':
+            report.write("Threads profiled: {}\n".format(len(self.profiles)))
+        else:
+            report.write("Samples: {} in {} rounds of {}s\n".format(self.samples, self.rounds, self.interval))
+
+        report.write("\nStages (wall time summed over threads):\n")
+        for stage, _ in STAGES:
+            logging.info("Profile stage {}: {:.3f}s".format(stage, stages[stage]))
+            report.write("  {:<8} {:>10.3f}s {:>7.1f}%\n".format(
+                stage, stages[stage], 100.0 * stages[stage] / self.elapsed if self.elapsed else 0))
+
+        if self.mode == 'cprofile':
+            stats.stream = report
+            report.write("\nHot spots by own time:\n")
+            stats.sort_stats('tottime').print_stats(TOP)
+            report.write("\nHot spots by cumulative time:\n")
+            stats.sort_stats('cumulative').print_stats(TOP)
+            stats.dump_stats(filename + '.pstats')
+        else:
+            for title, samples in (('own', self.self_samples), ('cumulative', self.total_samples)):
+                report.write("\nHot spots by {} samples:\n".format(title))
+                for function in sorted(samples, key=samples.get, reverse=True)[:TOP]:
+                    report.write("  {:>8} {:>7.1f}%  {}\n".format(
+                        samples[function], 100.0 * samples[function] / self.samples, label(function)))
+            with open(filename + '.folded', 'w') as folded_file:
+                for stack in sorted(self.stacks):
+                    folded_file.write('{} {}\n'.format(stack, self.stacks[stack]))
+
+        with open(filename, 'w') as report_file:
+            report_file.write(report.getvalue())
+        logging.info("Saved profile report to {}!".format(filename))
+
+
+@contextlib.contextmanager
+def profiling(filename, mode='sample', interval=0.01):
+    """
+    Profile a with-block and write the report to filename, also when the block exits.
+
+    Args:
+        filename (basestring): Report file, None for no profiling
+        mode (basestring): cprofile or sample
+        interval (float): Seconds between samples (sample mode)
+    """
+
+    if not filename:
+        yield
+        return
+
+    profiler = Profiler(mode, interval)
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.write(filename)
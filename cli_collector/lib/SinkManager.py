@@ -0,0 +1,220 @@
+#!/usr/bin/env python -tt
+"""
+Sink Manager library for streaming host results to outputs while a collection runs.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import Queue
+
+import MetricsManager
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+
+class ResultSink(object):
+    """
+    Base class for result sinks. A sink receives the results of one host at a time.
+    """
+
+    def write(self, host, data):
+        """
+        Write results of a host.
+
+        Args:
+            host (basestring): Hostname as referenced in HostManager
+            data (dict): Host data as returned by HostManagment.export_host (SETTINGS and COMMANDS)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TextFileSink(ResultSink):
+    """
+    Sink writing a text file per host and command (same as HostManagment.write_to_txt_files).
+    """
+
+    def __init__(self, hm, output_dir):
+        """
+        Args:
+            hm (object): HostManagment instance providing file naming (create_file)
+            output_dir (basestring): Path to directory for output
+        """
+
+        self.hm = hm
+        self.output_dir = output_dir
+
+    def write(self, host, data):
+        for command in data.get('COMMANDS', {}):
+            self.hm.create_file(host=host, command=command,
+                                output=data['COMMANDS'][command]['OUTPUT'],
+                                output_dir=self.output_dir)
+
+
+class JsonSink(ResultSink):
+    """
+    Sink writing a single JSON object keyed by host (same format as HostManagment.write_to_json).
+    """
+
+    def __init__(self, filename, indent=2):
+        """
+        Args:
+            filename (basestring): Path to JSON file for output
+            indent (int): Indentation of JSON output
+        """
+
+        if os.path.exists(filename):
+            logging.warn("File {} already exists. Will be overwritten!".format(filename))
+
+        self.filename = filename
+        self.indent = indent
+        self.first = True
+        self.outfile = open(filename, 'w')
+        self.outfile.write('{')
+
+    def write(self, host, data):
+        if not self.first:
+            self.outfile.write(',')
+        self.first = False
+
+        self.outfile.write('\n{}: {}'.format(json.dumps(host), json.dumps(data, indent=self.indent)))
+
+    def close(self):
+        self.outfile.write('\n}')
+        self.outfile.close()
+
+
+class JsonLinesSink(ResultSink):
+    """
+    Sink writing one JSON object per host per line, host name in key HOST.
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename (basestring): Path to JSON Lines file for output
+        """
+
+        if os.path.exists(filename):
+            logging.warn("File {} already exists. Will be overwritten!".format(filename))
+
+        self.filename = filename
+        self.outfile = open(filename, 'w')
+
+    def write(self, host, data):
+        line = dict(data)
+        line['HOST'] = host
+        self.outfile.write(json.dumps(line) + '\n')
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+
+class DatabaseSink(ResultSink):
+    """
+    Sink sending results of each host to the database.
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db (object): Database manager instance with save_command_output
+        """
+
+        self.db = db
+
+    def write(self, host, data):
+        db_id = data['SETTINGS']['DB_ID']
+        db_output = {db_id: {}}
+        for command in data.get('COMMANDS', {}):
+            db_output[db_id][command] = {
+                'OUTPUT': data['COMMANDS'][command]['OUTPUT'],
+                'NAME': host,
+                'TIMESTAMP': data['COMMANDS'][command]['TIMESTAMP']
+            }
+
+        if db_output[db_id]:
+            self.db.save_command_output(db_output)
+
+    def close(self):
+        if self.db.connected:
+            self.db.disconnect()
+
+
+class SinkDispatcher(object):
+    """
+    Dispatcher passing host results to all sinks from a writer thread, with a bounded queue for backpressure.
+    """
+
+    def __init__(self, sinks, max_queue=16, metrics=None):
+        """
+        Args:
+            sinks (lst): List of ResultSink instances
+            max_queue (int): Maximum number of hosts waiting to be written, put() blocks when full
+            metrics (object): Metrics instance recording writes as export phase per sink (optional)
+        """
+
+        self.sinks = sinks
+        self.metrics = metrics
+        self.queue = Queue.Queue(maxsize=max_queue)
+        self.writer = threading.Thread(target=self._write, name='SinkWriter')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def put(self, host, data):
+        """
+        Queue results of a host for all sinks, blocks while the queue is full.
+
+        Args:
+            host (basestring): Hostname as referenced in HostManager
+            data (dict): Host data as returned by HostManagment.export_host
+        """
+
+        self.queue.put((host, data))
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            host, data = item
+            size = sum(len(entry['OUTPUT']) for entry in data.get('COMMANDS', {}).itervalues())
+            for sink in self.sinks:
+                started = time.time()
+                error = False
+                try:
+                    sink.write(host, data)
+                except Exception as e:
+                    error = True
+                    logging.error("Could not write {} to {}! ({})".format(host, sink.__class__.__name__, e))
+                if self.metrics:
+                    self.metrics.record(MetricsManager.EXPORT, time.time() - started, key=sink.__class__.__name__,
+                                        size=size, error=error)
+
+            logging.debug("Results for {} written to sinks!".format(host))
+
+    def close(self):
+        """
+        Write all queued results and close sinks.
+        """
+
+        self.queue.put(None)
+        while self.writer.is_alive():
+            self.writer.join(1)
+
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python -tt
+"""
+SQLite Manager library for storing devices and output in a local database file.
+"""
+
+import logging
+import sqlite3
+import threading
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS `devices` ("
+    "`deviceid` INTEGER PRIMARY KEY, `name` TEXT NOT NULL, `ip` TEXT NOT NULL, `protocol` TEXT NOT NULL, "
+    "`site` TEXT, `role` TEXT)",
+    "CREATE TABLE IF NOT EXISTS `output` ("
+    "`deviceid` INTEGER NOT NULL, `command` TEXT NOT NULL, `timestamp` TEXT NOT NULL, `output` BLOB)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS `output_device_command_timestamp` "
+    "ON `output` (`deviceid`, `command`, `timestamp`)",
+]
+
+
+class SqliteDatabaseManager(object):
+    """
+    Database manager for a local SQLite database, same interface as DatbaseManager.
+    """
+
+    def __init__(self, filename, batch_size=500, commit_interval=10):
+        """
+        Database manager for a SQLite database file in WAL mode. Tables are created on connect.
+
+        Args:
+        @str filename: path to SQLite database file
+        @int batch_size: rows per executemany when saving output
+        @int commit_interval: batches per transaction when saving output
+        """
+
+        self.connected = False
+        self.filename = filename
+        self.batch_size = max(1, batch_size)
+        self.commit_interval = max(1, commit_interval)
+        self.connector = None
+        self.lock = threading.Lock()  # SQLite has a single writer, the connection is shared by threads.
+
+    def disconnect(self):
+        with self.lock:
+            if self.connector:
+                self.connector.close()
+                self.connector = None
+            self.connected = False
+        logging.debug('Disconnected from database!')
+
+    def connect(self):
+        with self.lock:
+            if self.connected:
+                logging.warn('Already connected to DB, close connection first prior to opening new connection!')
+                return
+
+            try:
+                self.connector = sqlite3.connect(self.filename, check_same_thread=False)
+                # Output is stored and returned as collected (byte strings).
+                self.connector.text_factory = str
+                self.connector.execute('PRAGMA journal_mode=WAL')
+                self.connector.execute('PRAGMA synchronous=NORMAL')
+                for statement in SCHEMA:
+                    self.connector.execute(statement)
+                self.connector.commit()
+            except sqlite3.Error as e:
+                logging.error('*** Failed to open %s! %r' % (self.filename, e))
+                raise
+
+            self.connected = True
+            logging.debug('Now connected to {}'.format(self.filename))
+
+    def get_device_list(self, site=None, role=None, collected_before=None, shard=None):
+        """
+        Device list as dict by device identifier (see iter_devices for filters).
+        """
+
+        devices = dict(self.iter_devices(site=site, role=role, collected_before=collected_before, shard=shard))
+
+        logging.debug('Received {} devices!'.format(str(len(devices))))
+
+        return devices
+
+    def iter_devices(self, site=None, role=None, collected_before=None, shard=None, page_size=1000):
+        """
+        Stream devices from the database, filtered by SQLite.
+
+        Devices are read with a separate connection, so output can be saved while iterating. Devices are
+        read in pages of page_size devices ordered by deviceid (keyset pagination), no read transaction
+        stays open between pages so WAL checkpoints are not held back during a run.
+
+        Args:
+        @str site: only devices of this site (devices.site)
+        @str role: only devices with this role (devices.role)
+        @str collected_before: only devices without output at or after this timestamp
+        @tuple shard: (index, count), only devices with deviceid modulo count equal to index
+        @int page_size: devices read per query
+
+        Returns:
+        @iter: (deviceid, device) tuples, device with NAME, IP, PROTOCOL and SITE/ROLE if set
+        """
+
+        # Check for connection to DB (creates tables).
+        if not self.connected:
+            self.connect()
+
+        query = "SELECT deviceid, name, ip, protocol, site, role FROM devices"
+        conditions = []
+        params = []
+        if site is not None:
+            conditions.append("site = ?")
+            params.append(site)
+        if role is not None:
+            conditions.append("role = ?")
+            params.append(role)
+        if collected_before is not None:
+            conditions.append("NOT EXISTS (SELECT 1 FROM output WHERE output.deviceid = devices.deviceid "
+                              "AND output.timestamp >= ?)")
+            params.append(collected_before)
+        if shard is not None:
+            conditions.append("deviceid % ? = ?")
+            params.extend([shard[1], shard[0]])
+
+        logging.debug('Retrieving device list from DB ({})...'.format(query))
+        reader = sqlite3.connect(self.filename)
+        reader.text_factory = str
+        try:
+            last = None
+            while True:
+                # Next page after the last device read, fetched at once so the statement is finished.
+                page_conditions = conditions if last is None else conditions + ["deviceid > ?"]
+                page_params = params if last is None else params + [last]
+                page_query = query
+                if page_conditions:
+                    page_query += " WHERE " + " AND ".join(page_conditions)
+                page_query += " ORDER BY deviceid LIMIT ?"
+                page = reader.execute(page_query, page_params + [page_size]).fetchall()
+
+                for (deviceid, name, ip, protocol, device_site, device_role) in page:
+                    device = {'NAME': name,
+                              'IP': ip,
+                              'PROTOCOL': protocol}
+                    if device_site is not None:
+                        device['SITE'] = device_site
+                    if device_role is not None:
+                        device['ROLE'] = device_role
+                    yield deviceid, device
+
+                if len(page) < page_size:
+                    break
+                last = page[-1][0]
+        finally:
+            reader.close()
+
+    def save_command_output(self, data):
+        """
+        Save command output in batched transactions.
+
+        Args:
+        @dict data: output by device identifier and command, each with OUTPUT, NAME and TIMESTAMP
+        """
+
+        rows = ((deviceid, command, data[deviceid][command]['TIMESTAMP'], data[deviceid][command]['OUTPUT'])
+                for deviceid in data for command in data[deviceid])
+
+        return self.save_rows(rows)
+
+    def save_rows(self, rows):
+        """
+        Save rows of command output, output of the same device, command and timestamp is replaced.
+
+        Args:
+        @iter rows: iterable of (deviceid, command, timestamp, output) tuples
+
+        Returns:
+        @int: number of rows saved
+        """
+
+        # Check for connection to DB.
+        if not self.connected:
+            self.connect()
+
+        add_output = ("INSERT OR REPLACE INTO `output` "
+                      "(`deviceid`, `command`, `timestamp`, `output`) "
+                      "VALUES (?, ?, ?, ?)")
+
+        total = 0
+        batches = 0
+        batch = []
+        with self.lock:
+            try:
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) < self.batch_size:
+                        continue
+
+                    self.connector.executemany(add_output, batch)
+                    total += len(batch)
+                    batches += 1
+                    batch = []
+
+                    if batches % self.commit_interval == 0:
+                        self.connector.commit()
+                        logging.debug('Commit {} rows to database!'.format(total))
+
+                if batch:
+                    self.connector.executemany(add_output, batch)
+                    total += len(batch)
+
+                self.connector.commit()
+                logging.debug('Commit data to database! ({} rows)'.format(total))
+            except BaseException as e:
+                # Any failure (also in reading rows) rolls back, the shared connection never keeps a partial batch.
+                logging.error('*** Failed to save output to {}! {!r}'.format(self.filename, e))
+                self.connector.rollback()
+                raise
+
+        return total
@@ -0,0 +1,146 @@
+#!/usr/bin/env python -tt
+"""
+Timing Manager library for learning response times of hosts over collection runs.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+# Keys for timings which are no command.
+LOGIN = '_LOGIN'
+DEVICE = '_DEVICE'
+
+
+class TimingHistory(object):
+    """
+    History of observed durations per host and command, used to derive timeouts.
+
+    The history file is a JSON object:
+        {"<host>": {"<command>": [<duration>, ...], "_LOGIN": [...], "_DEVICE": [...]}}
+    """
+
+    def __init__(self, filename=None, margin=3.0, percentile=99, minimum=5, min_samples=5, max_samples=100):
+        """
+        Timing history to derive timeouts from earlier runs.
+
+        A timeout is the percentile of the observed durations multiplied by the margin. Without
+        enough samples the default timeout is used. A timed out command is recorded with the timeout
+        as duration, so a timeout which was too tight grows by the margin on the next run.
+
+        Args:
+            filename (basestring): Path to history file, loaded if existing (optional, in memory only if not set)
+            margin (float): Multiplier on the percentile
+            percentile (int): Percentile of observed durations
+            minimum (int): Lower limit of a derived timeout in seconds
+            min_samples (int): Number of samples required before a timeout is derived
+            max_samples (int): Number of most recent samples kept per host and command
+        """
+
+        self.filename = filename
+        self.margin = margin
+        self.percentile = percentile
+        self.minimum = minimum
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.history = {}
+
+        if self.filename and os.path.exists(self.filename):
+            with open(self.filename, 'r') as history_file:
+                self.history = json.load(history_file)
+            logging.info("Loaded timing history of {} hosts from {}!".format(len(self.history), self.filename))
+
+    def record(self, host, key, duration):
+        """
+        Record an observed duration.
+
+        Args:
+            host (basestring): Host reference
+            key (basestring): Command, LOGIN or DEVICE
+            duration (float): Duration in seconds
+        """
+
+        with self.lock:
+            samples = self.history.setdefault(host, {}).setdefault(key, [])
+            samples.append(round(duration, 3))
+            del samples[:-self.max_samples]
+
+    def samples(self, host, key):
+        with self.lock:
+            return list(self.history.get(host, {}).get(key, ()))
+
+    def estimate(self, host, key, percentile=None, default=None, min_samples=None):
+        """
+        Percentile of observed durations.
+
+        Args:
+            host (basestring): Host reference
+            key (basestring): Command, LOGIN or DEVICE
+            percentile (int): Percentile (Default: percentile of this history)
+            default (float): Returned if there are not enough samples
+            min_samples (int): Number of samples required (Default: min_samples of this history)
+
+        Returns:
+            float: Duration in seconds
+        """
+
+        if min_samples is None:
+            min_samples = self.min_samples
+
+        samples = sorted(self.samples(host, key))
+        if not samples or len(samples) < min_samples:
+            return default
+
+        if percentile is None:
+            percentile = self.percentile
+
+        # Nearest rank
+        rank = int(math.ceil(percentile / 100.0 * len(samples)))
+        return samples[min(max(rank, 1), len(samples)) - 1]
+
+    def timeout(self, host, key, default):
+        """
+        Timeout for host and command derived from history.
+
+        Args:
+            host (basestring): Host reference
+            key (basestring): Command or LOGIN
+            default (int): Timeout if there are not enough samples
+
+        Returns:
+            float: Timeout in seconds
+        """
+
+        estimate = self.estimate(host, key)
+        if estimate is None:
+            return default
+
+        return max(self.minimum, estimate * self.margin)
+
+    def save(self):
+        """
+        Write history to history file.
+        """
+
+        if not self.filename:
+            return
+
+        with self.lock:
+            temp_file = self.filename + '.tmp'
+            with open(temp_file, 'w') as history_file:
+                json.dump(self.history, history_file)
+            os.rename(temp_file, self.filename)
+
+        logging.info("Saved timing history to {}!".format(self.filename))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python -tt
+"""
+Transcript Manager library for recording sessions with end nodes.
+
+A transcript is a gzip compressed JSON Lines file per session. The first line is a header
+({"HOST": .., "STARTED": .., "COMMAND": .., "VERSION": 1}), every next line an event:
+
+    [seconds, "in", data]                               Bytes received from the node
+    [seconds, "out", data]                              Bytes sent to the node (passwords masked)
+    [seconds, "match", index, matched]                  Prompt matched by expect (index in the prompt list)
+    [seconds, "command", command, seconds, bytes, ok]   Timing of a command
+
+Seconds are counted from the start of the session, data is stored as latin-1 text to keep all bytes.
+"""
+
+import gzip
+import itertools
+import json
+import os
+import re
+import threading
+import time
+
+__author__ = "Thomas Jongerius"
+__copyright__ = "Copyright 2016, Thomas Jongerius"
+__credits__ = ["Thomas Jongerius"]
+__license__ = "GPL"
+__version__ = "0.1"
+__maintainer__ = "Thomas Jongerius"
+__email__ = "thomasjongerius@yaworks.nl"
+__status__ = "Development"
+
+VERSION = 1
+
+# Events
+IN = 'in'
+OUT = 'out'
+MATCH = 'match'
+COMMAND = 'command'
+
+MASK = '********'
+
+
+class TranscriptStream(object):
+    """
+    File like object for the pexpect logfile_read and logfile_send hooks.
+    """
+
+    def __init__(self, transcript, direction):
+        self.transcript = transcript
+        self.direction = direction
+
+    def write(self, data):
+        self.transcript.data(self.direction, data)
+
+    def flush(self):
+        pass
+
+
+class Transcript(object):
+    """
+    Transcript of one session.
+    """
+
+    def __init__(self, filename, host, command=None, secrets=None):
+        """
+        Constructor
+
+        Args:
+            filename (basestring): Transcript file
+            host (basestring): Host reference
+            command (basestring): Command spawned for the session
+            secrets (lst): Strings masked in data sent (passwords)
+        """
+
+        self.filename = filename
+        self.secrets = [secret for secret in secrets or [] if secret]
+        self.started = time.time()
+        self.file = gzip.open(filename, 'wb')
+        self._write({'HOST': host, 'STARTED': self.started, 'COMMAND': command, 'VERSION': VERSION})
+
+    def attach(self, child):
+        """
+        Record all data read from and sent to a pexpect spawn instance.
+        """
+
+        child.logfile_read = TranscriptStream(self, IN)
+        child.logfile_send = TranscriptStream(self, OUT)
+
+    def data(self, direction, data):
+        if not data or self.file is None:
+            return
+        if direction == OUT:
+            for secret in self.secrets:
+                data = data.replace(secret, MASK)
+        self._event(direction, data.decode('latin-1'))
+
+    def match(self, index, matched):
+        if self.file is not None:
+            self._event(MATCH, index, str(matched).decode('latin-1'))
+
+    def command(self, command, seconds, size, ok=True):
+        if self.file is not None:
+            self._event(COMMAND, command, round(seconds, 4), size, ok)
+
+    def _event(self, kind, *fields):
+        self._write([round(time.time() - self.started, 4), kind] + list(fields))
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TranscriptStore(object):
+    """
+    Directory of transcripts, one file per session: <host>-<YYYYmmddHHMMSS>-<n>.jsonl.gz
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def open(self, host, command=None, secrets=None):
+        """
+        Start the transcript of a session.
+
+        Args:
+            host (basestring): Host reference
+            command (basestring): Command spawned for the session
+            secrets (lst): Strings masked in data sent (passwords)
+
+        Returns:
+            Transcript: Open transcript, closed by the caller
+        """
+
+        with self.lock:
+            number = next(self.counter)
+        filename = os.path.join(self.directory, '{}-{}-{}.jsonl.gz'.format(
+            re.sub(r'[^\w.-]', '_', str(host)), time.strftime('%Y%m%d%H%M%S'), number))
+        return Transcript(filename, host, command=command, secrets=secrets)
+
+
+def read_transcript(filename):
+    """
+    Read a transcript.
+
+    Args:
+        filename (basestring): Transcript file
+
+    Returns:
+        tuple: Header (dict) and events (list), data of in, out and match events as byte strings
+    """
+
+    with gzip.open(filename, 'rb') as transcript_file:
+        header = json.loads(transcript_file.readline())
+        events = []
+        for line in transcript_file:
+            event = json.loads(line)
+            if event[1] in (IN, OUT):
+                event[2] = event[2].encode('latin-1')
+            elif event[1] == MATCH:
+                event[3] = event[3].encode('latin-1')
+            events.append(event)
+    return header, events
@@ -1,5 +1,39 @@
-import accountmgr
-import ConnectionManager
-import HostManager
-import utils
-import DatabaseManager
\ No newline at end of file
+"""
+Collector libraries.
+
+Modules are imported by their users. Backends with heavy dependencies (paramiko/sshtunnel,
+mysql.connector, keyring) are loaded on demand through the registries below, so a run only
+imports what its options use.
+"""
+
+import importlib
+
+# Backend name -> (module, attribute)
+DATABASE_BACKENDS = {
+    'MYSQL': ('DatabaseManager', 'DatbaseManager'),
+    'SQLITE': ('SqliteManager', 'SqliteDatabaseManager'),
+}
+
+AGENT_BACKENDS = {
+    'thread': ('ConnectionManager', 'TunnelConnectionAgent'),
+    'event': ('EventConnectionManager', 'EventTunnelConnectionAgent'),
+}
+
+
+def load_backend(registry, name):
+    """
+    Import the module of a backend and return the backend class.
+
+    Args:
+        registry (dict): DATABASE_BACKENDS or AGENT_BACKENDS
+        name (basestring): Backend name
+
+    Returns:
+        object: Backend class
+    """
+
+    if name not in registry:
+        raise ValueError("Unknown backend {}! (Available: {})".format(name, ', '.join(sorted(registry))))
+
+    module, attribute = registry[name]
+    return getattr(importlib.import_module('{}.{}'.format(__name__, module)), attribute)
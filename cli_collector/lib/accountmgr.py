@@ -28,15 +28,29 @@ import ConfigParser
 import getpass
 import fnmatch
 import logging
+import re
 import sys
+import threading
 
-try:
-    import keyring
-except ImportError:
-    logging.error("No keyring library installed. Password must be provided in mannualy.")
-except Exception as e:
-    logging.error('Unknown error! {}'.format(e))
-    sys.exit(200)
+keyring = None  # Imported on first use, loading the keyring backend is slow.
+
+
+def load_keyring():
+    """
+    Function importing keyring on first use, False if not installed
+    """
+    global keyring
+    if keyring is None:
+        try:
+            import keyring as keyring_module
+        except ImportError:
+            logging.error("No keyring library installed. Password must be provided in mannualy.")
+            keyring_module = False
+        except Exception as e:
+            logging.error('Unknown error! {}'.format(e))
+            sys.exit(200)
+        keyring = keyring_module
+    return keyring
 
 def make_realm(name):
     """
@@ -60,10 +74,15 @@ class AccountManager(object):
         self.config_file = config_file
         self.config = ConfigParser.SafeConfigParser({'username': '', 'password_type': ''})
         self.config.read(self.config_file)
-        self.config.write(open(self.config_file, 'w'))
         self.allowed_password_types=['Fixed', 'PublicKey', 'NoPassword']
         self.reset = reset
         self.already_reset = []
+        self.lock = threading.RLock()  # Serialise keyring access and password prompts between threads.
+
+        # Lookups are memoised for the run, the keyring is asked once per section and username.
+        self.sections = {}  # Realm -> section
+        self.passwords = {}  # (Section, username) -> password
+        self._build_index()
 
         if self.reset:
             logging.warn('Password reset flag set, passwords will be prompted!')
@@ -80,14 +99,40 @@ class AccountManager(object):
     def _prompt_for_password(self, prompt):
         return getpass.getpass(prompt)
 
-    def _find_section(self, realm):
-        for section in iter(self.config.sections()):
-            if fnmatch.fnmatch(realm, section):
+    def _build_index(self):
+        # Sections without wildcards are looked up directly, patterns are compiled once.
+        self.exact_sections = {}
+        self.pattern_sections = []
+        for position, section in enumerate(self.config.sections()):
+            if any(char in section for char in '*?['):
+                self.pattern_sections.append((position, section, re.compile(fnmatch.translate(section)).match))
+            else:
+                self.exact_sections.setdefault(section, position)
+
+    def _match_section(self, realm):
+        # First section in file order matching realm, as fnmatch over all sections.
+        position = self.exact_sections.get(realm)
+        for pattern_position, section, match in self.pattern_sections:
+            if position is not None and pattern_position > position:
                 break
-        else:
-            section = 'DEFAULT'
+            if match(realm):
+                return section
+        if position is not None:
+            return realm
+        return 'DEFAULT'
+
+    def _find_section(self, realm):
+        section = self.sections.get(realm)
+        if section is None:
+            section = self.sections[realm] = self._match_section(realm)
         return section
 
+    def get_section(self, realm):
+        """
+        Credential section used for realm (host reference).
+        """
+        return self._find_section(realm)
+
     def _get_username(self, section):
         username = self.config.get(section, 'username')
         if username == '':
@@ -118,13 +163,24 @@ class AccountManager(object):
         return password_type
 
     def get_password(self, realm, username=None, interact=True, reset=False):
+        with self.lock:
+            return self._get_password(realm, username, interact, reset)
+
+    def _get_password(self, realm, username=None, interact=True, reset=False):
         section = self._find_section(realm)
         config_user_name = self._get_username(section)
         if not config_user_name or username != config_user_name:
-                return Noner
+                return None
         if not username:
             username = config_user_name
 
+        return self._get_section_password(section, username, realm, interact, reset)
+
+    def _get_section_password(self, section, username, realm, interact=True, reset=False):
+        if not reset and (section, username) in self.passwords:
+            return self.passwords[(section, username)]
+
+        load_keyring()
         try:
             if self.reset or reset:
                 if username not in self.already_reset or reset:
@@ -142,9 +198,49 @@ class AccountManager(object):
                 username,
                 password)
 
+        if password is not None:
+            self.passwords[(section, username)] = password
+
         return password
 
+    def get_cached_login(self, realm):
+        """
+        Login for realm if its password is already known, None otherwise (never blocks).
+        """
+        username = self.get_username(realm)
+        password = self.passwords.get((self._find_section(realm), username))
+        if password is None:
+            return None
+        return (username, password)
+
+    def preload(self, realms=None, interact=True):
+        """
+        Resolve credentials up front, so logins do not wait on the keyring or a password prompt.
+
+        Each section is resolved once. Without realms all sections of the credential file are
+        resolved from the keyring only, missing passwords are prompted for at first login.
+        """
+        if realms is None:
+            sections = self.config.sections() + ['DEFAULT']
+            interact = False
+        else:
+            sections = []
+            for realm in realms:
+                section = self._find_section(realm)
+                if section not in sections:
+                    sections.append(section)
+
+        resolved = 0
+        with self.lock:
+            for section in sections:
+                username = self._get_username(section)
+                if username and self._get_section_password(section, username, section, interact) is not None:
+                    resolved += 1
+
+        logging.info("Preloaded credentials of {} of {} sections!".format(resolved, len(sections)))
+
     def set_password(self, realm, username, password):
+        load_keyring()
         try:
             keyring.set_password(
                 realm,
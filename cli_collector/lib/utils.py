@@ -12,6 +12,8 @@ __maintainer__ = "Thomas Jongerius"
 __email__ = "thomasjongerius@yaworks.nl"
 __status__ = "Development"
 
+import errno
+import select
 import socket
 import time
 import json
@@ -56,7 +58,7 @@ def to_list(item):
     return [item]
 
 
-def is_reachable(host, port=23):
+def is_reachable(host, port=23, timeout=5):
     """
     This function check reachability for specified hostname/port
     It tries to open TCP socket.
@@ -64,6 +66,7 @@ def is_reachable(host, port=23):
     :param host string: hostname or ip address string
     :rtype: str
     :param port number: tcp port number
+    :param timeout number: connect timeout in seconds
     :rtype: bool
     :return: True if host is reachable else false
     """
@@ -78,22 +81,79 @@ def is_reachable(host, port=23):
     for family, socktype, proto, cannonname, sockaddr in addresses:
         sock = socket.socket(family, socket.SOCK_STREAM)
         #sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 0)
-        sock.settimeout(5)
+        sock.settimeout(timeout)
         try:
             sock.connect(sockaddr)
         except IOError as e:
+            sock.close()
             continue
 
         sock.shutdown(socket.SHUT_RDWR)
         sock.close()
-        # Wait 2 sec for socket to shutdown
-        time.sleep(2)
         break
     else:
         return False
     return True
 
 
+def scan_reachable(targets, timeout=5, max_parallel=256):
+    """
+    This function checks reachability for many hostname/port pairs at once.
+    It starts non-blocking TCP connects and waits for all of them together,
+    with at most max_parallel connects in flight.
+    :param targets list: list of (host, port) tuples
+    :param timeout number: connect timeout in seconds per target
+    :param max_parallel number: maximum number of connects in flight
+    :rtype: dict
+    :return: dict with (host, port) as key and True if reachable else False
+    """
+
+    result = {}
+    pending = list(set(targets))
+    in_flight = {}  # fileno -> (sock, target, deadline)
+    poller = select.poll()
+
+    while pending or in_flight:
+        # Start new connects
+        while pending and len(in_flight) < max_parallel:
+            target = pending.pop()
+            try:
+                family, socktype, proto, cannonname, sockaddr = socket.getaddrinfo(
+                    target[0], target[1], socket.AF_UNSPEC, socket.SOCK_STREAM)[0]
+            except socket.gaierror:
+                result[target] = False
+                continue
+
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            error = sock.connect_ex(sockaddr)
+            if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                result[target] = False
+                continue
+
+            in_flight[sock.fileno()] = (sock, target, time.time() + timeout)
+            poller.register(sock, select.POLLOUT)
+
+        # Wait for connects to finish or first deadline
+        wait = max(0, min(deadline for _, _, deadline in in_flight.values()) - time.time()) if in_flight else 0
+        for fd, event in poller.poll(int(wait * 1000) + 1):
+            sock, target, deadline = in_flight.pop(fd)
+            poller.unregister(fd)
+            result[target] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+            sock.close()
+
+        # Expired connects
+        now = time.time()
+        for fd in [fd for fd in in_flight if in_flight[fd][2] <= now]:
+            sock, target, deadline = in_flight.pop(fd)
+            poller.unregister(fd)
+            result[target] = False
+            sock.close()
+
+    return result
+
+
 def read_from_json_file(filename):
     '''Read JSON file and send back dict.'''
     try:
@@ -117,6 +177,70 @@ def write_dict_to_json_file(filename, dict, indent=2):
         outfile.close()
 
 
+def parse_shard(shard):
+    '''
+    Parse shard selection 'i/N' (0 <= i < N) into tuple (i, N).
+    Raises ValueError on invalid selection.
+    '''
+    try:
+        index, count = [int(part) for part in shard.split('/')]
+    except ValueError:
+        raise ValueError("Shard must be 'i/N', not '{}'!".format(shard))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Shard index must be 0 <= i < N, not '{}'!".format(shard))
+    return index, count
+
+
+def read_device_file(filename, protocol='SSH', site=None, role=None, shard=None):
+    '''
+    Stream devices from device list file as (index, device) tuples.
+
+    Each line is a hostname, or comma separated NAME,IP,PROTOCOL,SITE,ROLE,PORT where the columns after
+    NAME are optional (PORT defaults to the port of the protocol). Empty lines and lines starting with '#' are
+    skipped, lines with an invalid PORT are logged and skipped. The index of a device is its line number
+    (from 0), so shards stay stable when the file is filtered.
+    :param filename string: path to device list file
+    :param protocol string: protocol if not in file (SSH or TELNET)
+    :param site string: only devices of this site
+    :param role string: only devices with this role
+    :param shard tuple: (index, count), only devices with line number modulo count equal to index
+    '''
+    with open(filename) as device_file:
+        for index, line in enumerate(device_file):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if shard and index % shard[1] != shard[0]:
+                continue
+
+            columns = [column.strip() for column in line.split(',')]
+            columns += [''] * (6 - len(columns))
+            name, ip, device_protocol, device_site, device_role, device_port = columns[:6]
+
+            if site is not None and device_site != site:
+                continue
+            if role is not None and device_role != role:
+                continue
+
+            device = {
+                'NAME': name,
+                'IP': ip or name,
+                'PROTOCOL': device_protocol.upper() or protocol
+            }
+            if device_site:
+                device['SITE'] = device_site
+            if device_role:
+                device['ROLE'] = device_role
+            if device_port:
+                if not device_port.isdigit() or not 0 < int(device_port) < 65536:
+                    logging.error('Skipping line {} of {}, invalid port {}!'.format(index + 1, filename,
+                                                                                    device_port))
+                    continue
+                device['PORT'] = int(device_port)
+
+            yield index, device
+
+
 def dir_check(directory):
     '''Function to check directory existence'''
 
@@ -13,7 +13,8 @@ Script that allows you to collect data from network via CLI.
 There is an option to collect data via Jumpserver.
 """
 
-from lib.utils import read_from_json_file
+from lib import ProfileManager
+from lib.utils import iter_hosts
 import argparse
 import logging
 import sys
@@ -29,74 +30,94 @@ __email__ = "thomasjongerius@yaworks.nl"
 __status__ = "Development"
 
 
-def interfaces(input):
-    c = str(input).splitlines()
-    interfaces = []
-    output = ''
-    current_int_flag = False
-
-    for x in c:
-        protocol = re.search('line protocol', x)
-        if protocol:
-            if current_int_flag:
-                interfaces.append(output)
-                current_int_flag = False
-            else:
-                current_int_flag = True
-                output = x
-        else:
-            if current_int_flag:
-                output += x
-
-    return interfaces
-
-def int_mac_ip(input):
-
-    output = ''
-    interface_details = {}
-
-    for interface in input:
-        interface_name = None
-        ip_address = None
-        mac_address = None
-        mtu_size = None
-        in_error = None
-        out_error = None
-
-
-        mac = re.search('\w\w\w\w\.\w\w\w\w\.\w\w\w\w', interface)
-        if mac:
-            mac_address = mac.group()
-
-        mtu = re.search('(MTU\s)(\d+)(\sbytes)', interface)
-        if mtu:
-            mtu_size = mtu.group(2)
-
-        iner = re.search('(\d+)(\sinput\serrors)', interface)
-        if iner:
-            in_error = iner.group(1)
-
-        outer = re.search('(\d+)(\soutput\serrors)', interface)
-        if outer:
-            out_error = outer.group(1)
-
-        int_re = re.search('\w*Ethernet\d/\d', interface)
-        if int_re:
-            interface_name = int_re.group()
-
-        ip = re.search('\d+\.\d+\.\d+\.\d+', interface)
-        if ip:
-            ip_address = ip.group()
-
-        interface_details[str(interface_name)] = {
-            'IP' : str(ip_address),
-            'MAC' : str(mac_address),
-            'INERROR' : str(in_error),
-            'OUTERROR' : str(out_error),
-            'MTU' : str(mtu_size)
-        }
-
-    return interface_details
+# Compiled once, each line of the output is matched against the expressions of its keyword only.
+INTERFACE_RE = re.compile(r'(\S+) is ([^,]+)(?:, line protocol is (\S+))?')
+MAC_RE = re.compile(r'address(?: is|:) ([0-9a-fA-F]{4}\.[0-9a-fA-F]{4}\.[0-9a-fA-F]{4})')
+IP_RE = re.compile(r'(?:Internet [Aa]ddress is|Secondary address) (\d+\.\d+\.\d+\.\d+)(?:/(\d+))?')
+MTU_RE = re.compile(r'MTU (\d+) bytes')
+PACKETS_RE = re.compile(r'(\d+) (?:packets (input|output),|(input|output) packets) +(\d+) bytes')
+ERRORS_RE = re.compile(r'(\d+) (input|output) errors?')
+CRC_RE = re.compile(r'(\d+) CRC')
+
+
+def new_interface(name, status, protocol):
+    return {
+        'INTERFACE': name,
+        'STATUS': status,
+        'PROTOCOL': protocol,
+        'DESCRIPTION': None,
+        'MAC': None,
+        'IPS': [],
+        'MTU': None,
+        'IN_PACKETS': None,
+        'IN_BYTES': None,
+        'OUT_PACKETS': None,
+        'OUT_BYTES': None,
+        'IN_ERRORS': None,
+        'CRC': None,
+        'OUT_ERRORS': None
+    }
+
+
+def parse_interfaces(output):
+    """
+    Parse "show interfaces" output (Cisco IOS and NX-OS style) in a single pass.
+
+    An interface starts on a line without indent matching "NAME is STATUS[, line protocol is PROTOCOL]",
+    the lines after it are matched on keywords (address, MTU, packets, errors).
+
+    Args:
+        output (basestring): Command output
+
+    Returns:
+        generator: Interface records with INTERFACE, STATUS, PROTOCOL, DESCRIPTION, MAC, IPS (list of
+        'address/prefix'), MTU, IN_PACKETS, IN_BYTES, OUT_PACKETS, OUT_BYTES, IN_ERRORS, CRC and
+        OUT_ERRORS (integers, None if not in the output)
+    """
+
+    interface = None
+
+    for line in output.splitlines():
+        # Line without indent and matching the header: next interface. Other lines without indent
+        # (NX-OS "admin state is up, ...", the prompt) belong to the current interface.
+        if line and line[0] not in ' \t' and ' is ' in line:
+            m = INTERFACE_RE.match(line)
+            if m:
+                if interface is not None:
+                    yield interface
+                interface = new_interface(*m.groups())
+                continue
+        if interface is None:
+            continue
+
+        if 'ddress' in line:
+            m = MAC_RE.search(line)
+            if m:
+                interface['MAC'] = m.group(1)
+            m = IP_RE.search(line)
+            if m:
+                interface['IPS'].append(m.group(1) + '/' + m.group(2) if m.group(2) else m.group(1))
+        if 'MTU' in line:
+            m = MTU_RE.search(line)
+            if m:
+                interface['MTU'] = int(m.group(1))
+        if 'packets' in line:
+            for m in PACKETS_RE.finditer(line):
+                direction = 'IN' if (m.group(2) or m.group(3)) == 'input' else 'OUT'
+                interface[direction + '_PACKETS'] = int(m.group(1))
+                interface[direction + '_BYTES'] = int(m.group(4))
+        if 'errors' in line or 'error ' in line:
+            for m in ERRORS_RE.finditer(line):
+                interface['IN_ERRORS' if m.group(2) == 'input' else 'OUT_ERRORS'] = int(m.group(1))
+        if 'CRC' in line:
+            m = CRC_RE.search(line)
+            if m:
+                interface['CRC'] = int(m.group(1))
+        if line.lstrip().startswith('Description:'):
+            interface['DESCRIPTION'] = line.split(':', 1)[1].strip()
+
+    if interface is not None:
+        yield interface
 
 
 class CliClient(object):
@@ -123,8 +144,20 @@ class CliClient(object):
                             LEVEL is a string of DEBUG, INFO, ERROR, CRITICAL.
                             Default is ERROR.
                             ''')
+        self.parser.add_argument("--profile", help="Profile the run and write a report with hot spots and time in "
+                                                   "regex and JSON to FILE (raw profile in FILE.pstats or "
+                                                   "FILE.folded)",
+                                 type=str, default=None, dest='profile', metavar='FILE')
+        self.parser.add_argument("--profile-mode", help="cprofile: every call (slow), sample: sampled stacks "
+                                                        "(Default: sample)",
+                                 choices=ProfileManager.MODES, default='sample', dest='profile_mode')
+        self.parser.add_argument("--profile-interval", help="Seconds between samples in sample mode (Default: 0.01)",
+                                 type=float, default=0.01, dest='profile_interval')
         self.parser.add_argument('input', metavar='INPUT_FILE', type=str,
                                  help="JSON file with input data from CLI collector.")
+        self.parser.add_argument("--jsonl", help="Input file is JSON Lines, one host per line (collector --jsonl). "
+                                                 "Default for .jsonl files",
+                                 default=None, dest='jsonl', action='store_true')
 
     def execute(self):
 
@@ -152,30 +185,34 @@ class CliClient(object):
         logging.info("Level of logging: {}".format(self.args.log_level))
         logging.info("Input file: {}".format(self.args.input))
 
-        input_file = read_from_json_file(self.args.input)
-
-        output_collector = 'HOST,INTERFACE,IP,MAC,MTU,IN_ERRORS,OUT_ERRORS\n'
+        # Hosts are read and printed one at a time, memory is bounded by the largest host.
+        print 'HOST,INTERFACE,IP,MAC,MTU,IN_ERRORS,OUT_ERRORS'
         sep = ','
-        for host in input_file:
-
-            if 'COMMANDS' in input_file[host]:
-                for command in input_file[host]['COMMANDS']:
-                    if command == 'show interfaces':
-                        inter = interfaces(input_file[host]['COMMANDS'][command]['OUTPUT'])
-                        x = int_mac_ip(inter)
-                        for y in x:
-                            output_collector += host + sep + y + sep + x[y]['IP'] + sep + x[y]['MAC'] + sep + x[y]['MTU'] + sep + x[y]['INERROR'] + sep + x[y]['OUTERROR'] + '\n'
-
-
-        # Print output to screen
-        print output_collector
+        try:
+            for host, data in iter_hosts(self.args.input, json_lines=self.args.jsonl):
+
+                if 'COMMANDS' in data:
+                    for command in data['COMMANDS']:
+                        if command == 'show interfaces':
+                            for interface in parse_interfaces(data['COMMANDS'][command]['OUTPUT']):
+                                ip = interface['IPS'][0].split('/')[0] if interface['IPS'] else None
+                                print sep.join([host, interface['INTERFACE'], str(ip), str(interface['MAC']),
+                                                str(interface['MTU']), str(interface['IN_ERRORS']),
+                                                str(interface['OUT_ERRORS'])])
+        except IOError as e:
+            logging.error("I/O error({0}): {1}".format(e.errno, e.strerror))
+            logging.warn("JSON file could not be loaded!")
+
+        # End of output
+        print
 
         logging.debug("Script ended")
         sys.exit()
 
 def main():
     cli = CliClient()
-    cli.execute()
+    with ProfileManager.profiling(cli.args.profile, cli.args.profile_mode, cli.args.profile_interval):
+        cli.execute()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
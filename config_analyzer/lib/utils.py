@@ -108,6 +108,90 @@ def read_from_json_file(filename):
         logging.warn("JSON file could not be loaded!")
 
 
+def iter_json_hosts(filename, chunk_size=65536):
+    '''Yield (host, data) of a collector JSON output file ({host: data, ...}) one host at a time.
+
+    The file is read in chunks and each host is decoded on its own, memory is bounded by the
+    largest host instead of the whole file.'''
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\r\n'
+
+    with open(filename) as file_load:
+        state = {'buffer': '', 'position': 0, 'eof': False}
+
+        def read(size=chunk_size):
+            # Reads at least the size of the pending buffer, retried decodes stay linear.
+            data = file_load.read(max(size, len(state['buffer']) - state['position']))
+            state['buffer'] = state['buffer'][state['position']:] + data
+            state['position'] = 0
+            state['eof'] = not data
+            return not state['eof']
+
+        def next_char():
+            # Next non whitespace character, None at the end of the file.
+            while True:
+                buffer, position = state['buffer'], state['position']
+                while position < len(buffer) and buffer[position] in whitespace:
+                    position += 1
+                state['position'] = position
+                if position < len(buffer):
+                    return buffer[position]
+                if not read():
+                    return None
+
+        def decode():
+            # Decode the value at the position, complete only if followed by more data or the end of the file.
+            while True:
+                try:
+                    value, end = decoder.raw_decode(state['buffer'], state['position'])
+                except ValueError:
+                    if not read():
+                        raise
+                    continue
+                if end < len(state['buffer']) or state['eof']:
+                    state['position'] = end
+                    return value
+                read()
+
+        def expect(chars):
+            char = next_char()
+            if char is None or char not in chars:
+                raise ValueError("Expected {} in {}, found {}".format(' or '.join(chars), filename, char))
+            state['position'] += 1
+            return char
+
+        expect('{')
+        if next_char() == '}':
+            return
+        while True:
+            if next_char() != '"':
+                raise ValueError("Expected host name in {}".format(filename))
+            host = decode()
+            expect(':')
+            next_char()
+            yield host, decode()
+            if expect(',}') == '}':
+                return
+
+
+def iter_json_lines_hosts(filename):
+    '''Yield (host, data) of a collector JSON Lines output file (--jsonl, host name in key HOST).'''
+    with open(filename) as file_load:
+        for line in file_load:
+            if line.strip():
+                data = json.loads(line)
+                yield data.pop('HOST'), data
+
+
+def iter_hosts(filename, json_lines=None):
+    '''Yield (host, data) of a collector output file, JSON Lines for .jsonl files unless json_lines is set.'''
+    if json_lines is None:
+        json_lines = filename.endswith('.jsonl')
+    if json_lines:
+        return iter_json_lines_hosts(filename)
+    return iter_json_hosts(filename)
+
+
 def write_dict_to_json_file(filename, dict, indent=2):
     '''Write dict to JSON file.'''
     if os.path.exists(filename):